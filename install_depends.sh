@@ -26,7 +26,7 @@ echo
 
 doit apt-get install --assume-yes \
     build-essential \
-    python python-dev python-setuptools python-simplejson python-virtualenv \
+    python python-dev python-setuptools python-simplejson python-numpy python-virtualenv \
     python-imaging gettext
 
 echo
@@ -17,8 +17,12 @@ from django.core.exceptions import PermissionDenied
 from django.contrib.admin import AdminSite as BaseAdminSite
 from django.contrib.gis.admin import OSMGeoAdmin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin, GroupAdmin
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+import redis
 import taggit.admin
-from occupywallst import models as db
+from occupywallst import (commenttree, pagecache, jobs, moderation,
+                          models as db)
 
 class GeoAdmin(OSMGeoAdmin):
     default_lat = 39.95  # philadelphia
@@ -111,13 +115,26 @@ class ArticleTranslationInline(admin.StackedInline):
     extra = 1
 
 
+def _purge_articles(articles):
+    tags = set(['recent'])
+    for article in articles:
+        tags.update(article.cache_tags())
+    pagecache.purge(*tags)
+
+
 def action_invisible(modeladmin, request, queryset):
+    articles = list(queryset)
     queryset.update(is_visible=False)
+    db.ArchiveDay.recount((a.is_forum, a.published) for a in articles)
+    _purge_articles(articles)
 action_invisible.short_description = "Make article/thread invisible"
 
 
 def action_visible(modeladmin, request, queryset):
+    articles = list(queryset)
     queryset.update(is_visible=True)
+    db.ArchiveDay.recount((a.is_forum, a.published) for a in articles)
+    _purge_articles(articles)
 action_visible.short_description = "Make article/thread visible"
 
 
@@ -168,13 +185,21 @@ class ArticleAdmin(GeoAdmin):
         return HttpResponseRedirect(url)
 
 
+def _invalidate_comment_trees(queryset):
+    for article_id in set(queryset.values_list('article', flat=True)):
+        commenttree.invalidate(article_id)
+    pagecache.purge('forum')
+
+
 def action_remove(modeladmin, request, queryset):
     queryset.update(is_removed=True)
+    _invalidate_comment_trees(queryset)
 action_remove.short_description = "Remove comments from forum"
 
 
 def action_unremove(modeladmin, request, queryset):
     queryset.update(is_removed=False)
+    _invalidate_comment_trees(queryset)
 action_unremove.short_description = "Unremove comments from forum"
 
 
@@ -242,6 +267,12 @@ class ListMemberAdmin(GeoAdmin):
     list_filter = ('mlist__name',)
 
 
+class SpamTextAdmin(admin.ModelAdmin):
+    list_display = ('text', 'is_regex', 'hits', 'last_hit')
+    search_fields = ('text',)
+    ordering = ('-hits',)
+
+
 class PledgeAdmin(admin.ModelAdmin):
     list_filter = ['is_public', 'streets', 'meet', 'social', 'donate',
                    'strike', 'organize', 'train', 'bank', 'occupy']
@@ -250,13 +281,28 @@ class PledgeAdmin(admin.ModelAdmin):
     ordering = ['-created']
 
 
+def view_queues(request):
+    """Shows how backed up the background queues are"""
+    queues = []
+    for name, stats in (('jobs', jobs.queue_stats),
+                        ('spam', moderation.filter_stats)):
+        try:
+            queues.append((name, sorted(stats().items())))
+        except redis.ConnectionError:
+            queues.append((name, None))
+    return render_to_response('admin/queues.html', {
+        'title': 'Queues',
+        'queues': queues,
+    }, context_instance=RequestContext(request))
+
+
 admin.site.register(db.Carousel, CarouselAdmin)
 admin.site.register(db.Verbiage, VerbiageAdmin)
 admin.site.register(db.NewsArticle, ArticleAdmin)
 admin.site.register(db.ForumPost, ArticleAdmin)
 admin.site.register(db.UserInfo, UserInfoAdmin)
 admin.site.register(db.Comment, CommentAdmin)
-admin.site.register(db.SpamText, admin.ModelAdmin)
+admin.site.register(db.SpamText, SpamTextAdmin)
 admin.site.register(db.List, ListAdmin)
 admin.site.register(db.ListMember, ListMemberAdmin)
 admin.site.register(db.Pledge, PledgeAdmin)
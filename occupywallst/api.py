@@ -35,29 +35,21 @@ r"""
 import re
 from datetime import datetime, date, timedelta
 
-import redis
-from redisbayes import RedisBayes
 from django.conf import settings
 from django.contrib import auth
+from django.db.models import Q
 from django.core.cache import cache
 from django.core.validators import email_re
-from django.contrib.gis.geos import Polygon
 from django.template.defaultfilters import slugify
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext as _
 
-from occupywallst import models as db
+from occupywallst import (attendeemap, commenttree, moderation, utils, votes,
+                          models as db)
 from occupywallst.templatetags.ows import synopsis
 from occupywallst.utils import APIException, timesince, now
 
 
-REDBAY = RedisBayes(redis.Redis())
-
-
-def _str_to_bbox(val):
-    swlat, swlng, nwlat, nwlng = [float(s) for s in val.split(',')]
-    return Polygon.from_bbox([swlng, swlat, nwlng, nwlat])
-
 
 def _to_bool(val):
     if type(val) is bool:
@@ -80,54 +72,81 @@ def _too_many_caps(text):
     return (caps + lows >= 8 and caps > lows)
 
 
-def forumlinks(user, after, count, **kwargs):
-    """Used for continuous stream of forum post links"""
-    after, count = int(after), int(count)
+def _seek(qset, field, after, count, cursor):
+    """Returns page of ``qset`` sorted newest first by ``(field, id)``
+
+    If ``cursor`` is given we seek to it, otherwise we fall back to
+    skipping ``after`` rows for clients that haven't been updated.
+    """
+    after, count = int(after or 0), int(count)
     if after < 0 or count <= 0:
         raise APIException(_("bad arguments"))
-    articles = (db.Article.objects_as(user)
-                .select_related("author", "author__userinfo")
-                .order_by('-killed'))
-    for article in articles[after:after + count]:
-        yield render_to_string('occupywallst/forumpost_synopsis.html',
-                               {'article': article,
-                                'user': user})
+    qset = qset.order_by('-' + field, '-id')
+    if cursor:
+        when, id = utils.parse_cursor(cursor)
+        qset = qset.filter(Q(**{field + '__lt': when}) |
+                           Q(**{field: when, 'id__lt': id}))
+        return list(qset[:count])
+    return list(qset[after:after + count])
+
 
+def _next_cursor(items, field):
+    if items:
+        return utils.make_cursor(getattr(items[-1], field), items[-1].id)
+
+
+def forumlinks(user, count, after=0, cursor=None, **kwargs):
+    """Used for continuous stream of forum post links
+
+    Pass the ``cursor`` from the last response to get the next page.
+    """
+    articles = _seek(db.Article.objects_as(user)
+                     .select_related("author", "author__userinfo"),
+                     'killed', after, count, cursor)
+    res = [render_to_string('occupywallst/forumpost_synopsis.html',
+                            {'article': article,
+                             'user': user})
+           for article in articles]
+    return utils.Page(res, _next_cursor(articles, 'killed'))
 
-def commentfeed(user, after, count, **kwargs):
-    """Used for continuous stream of forum comments"""
+
+def commentfeed(user, count, after=0, cursor=None, **kwargs):
+    """Used for continuous stream of forum comments
+
+    Pass the ``cursor`` from the last response to get the next page.
+    """
     ip = _try_to_get_ip(kwargs)
-    after, count = int(after), int(count)
-    if after < 0 or count <= 0:
-        raise APIException(_("bad arguments"))
-    comments = (db.Comment.objects_as(user)
-                .select_related("article", "user", "user__userinfo")
-                .order_by('-published'))[after:after + count + 10]
+    comments = _seek(db.Comment.objects_as(user)
+                     .select_related("article", "user", "user__userinfo"),
+                     'published', after, count, cursor)
     comments = db.mangle_comments(comments, user, ip)
-    for comment in comments[:count]:
-        yield render_to_string('occupywallst/comment.html',
-                               {'comment': comment,
-                                'user': user,
-                                'can_reply': True,
-                                'extended': True})
-
-
-def attendees(bounds, **kwargs):
-    """Find all people going who live within visible map area"""
-    if bounds:
-        bbox = _str_to_bbox(bounds)
-        qset = (db.UserInfo.objects
-                .select_related("user")
-                .filter(position__isnull=False,
-                        position__within=bbox))
-    else:
-        qset = (db.UserInfo.objects
-                .select_related("user")
-                .filter(position__isnull=False))
-    for userinfo in qset[:1000]:
-        yield {'id': userinfo.user.id,
-               'username': userinfo.user.username,
-               'position': userinfo.position_latlng}
+    res = [render_to_string('occupywallst/comment.html',
+                            {'comment': comment,
+                             'user': user,
+                             'can_reply': True,
+                             'extended': True})
+           for comment in comments]
+    return utils.Page(res, _next_cursor(comments, 'published'))
+
+
+def attendees(bounds, zoom=None, **kwargs):
+    """Find all people going who live within visible map area
+
+    When zoomed out this returns clusters with a ``count`` of people
+    instead, see :py:mod:`occupywallst.attendeemap`.
+    """
+    try:
+        if bounds:
+            bounds = [float(s) for s in bounds.split(',')]
+        else:
+            bounds = [-85.0, -180.0, 85.0, 180.0]
+        zoom = attendeemap.MAX_ZOOM if zoom is None else int(zoom)
+        if len(bounds) != 4:
+            raise ValueError()
+    except ValueError:
+        raise APIException(_("bad bounds or zoom"))
+    return attendeemap.attendees(bounds, zoom)
+
 
 def attendee_info(username, **kwargs):
     """Get information for displaying attendee bubble"""
@@ -166,30 +185,21 @@ def _check_post(user, post):
             raise APIException(_("turn off bloody caps lock"))
         if db.SpamText.is_spam(post.title):
             post.is_removed = True
-        if 'watch' in re.sub('[^a-z]', '', post.title.lower()):
-            post.is_removed = True
-        if 'episode' in re.sub('[^a-z]', '', post.title.lower()):
-            post.is_removed = True
-        if 'streaming' in re.sub('[^a-z]', '', post.title.lower()):
-            post.is_removed = True
-        if 'download' in re.sub('[^a-z]', '', post.title.lower()):
-            post.is_removed = True
-        if re.match(r's\d\de\d\d', post.title.lower()):
-            post.is_removed = True
-        if ' HD ' in post.title:
-            post.is_removed = True
     if db.SpamText.is_spam(post.content):
         post.is_removed = True
     if post.is_removed:
         _train(post)
     if user.userinfo.is_shadow_banned:
         post.is_removed = True
-    try:
-        bclass = REDBAY.classify(post.full_text())
-    except redis.ConnectionError:
-        bclass = 'good'
-    if bclass == 'bad' and user.userinfo.karma < settings.OWS_KARMA_THRESHOLD:
-        post.is_removed = True
+
+
+def _moderate(post):
+    """Have spam filter take a look at post once it's been saved
+
+    This happens in the background, see :py:mod:`moderation`.
+    """
+    if not post.is_removed:
+        moderation.submit('classify', post)
 
 
 def _limiter(last, seconds):
@@ -238,6 +248,7 @@ def article_new(user, title, content, is_forum, **kwargs):
     article.ip = _try_to_get_ip(kwargs)
     _check_post(user, article)
     article.save()
+    _moderate(article)
     return article_get(user, slug)
 
 
@@ -286,14 +297,20 @@ def shadowban(user, username, action, **kwargs):
     if user2.userinfo.can_moderate():
         raise APIException(_("cannot ban privileged users"))
     if action == 'ban':
-        if not user2.userinfo.is_shadow_banned:
-            user2.userinfo.is_shadow_banned = True
+        banned = True
     elif action == 'unban':
-        if user2.userinfo.is_shadow_banned:
-            user2.userinfo.is_shadow_banned = False
+        banned = False
     else:
         raise APIException(_("invalid action"))
-    user2.userinfo.save()
+    if user2.userinfo.is_shadow_banned != banned:
+        user2.userinfo.is_shadow_banned = banned
+        user2.userinfo.save()
+        # moderators see ban links and banned comments in cached trees
+        for article_id in (db.Comment.objects
+                           .filter(user=user2)
+                           .values_list('article_id', flat=True)
+                           .distinct()):
+            commenttree.invalidate(article_id)
     return []
 
 
@@ -320,6 +337,7 @@ def article_edit(user, article_slug, title, content, **kwargs):
     article.content = content
     _check_post(user, article)
     article.save()
+    _moderate(article)
     return article_get(user, article_slug)
 
 
@@ -358,21 +376,14 @@ def _train(obj, user=None):
     """Train bayesian spam filter that stuff like this is spam"""
     if user and not user.userinfo.can_moderate():
         return
-    try:
-        REDBAY.train('bad', obj.full_text())
-    except redis.ConnectionError:
-        pass
+    moderation.submit('train', obj)
 
 
 def _untrain(obj, user=None):
     """Undo previous spam training and train to think this is good"""
     if user and not user.userinfo.can_moderate():
         return
-    try:
-        REDBAY.untrain('bad', obj.full_text())
-        REDBAY.train('good', obj.full_text())
-    except redis.ConnectionError:
-        pass
+    moderation.submit('untrain', obj)
 
 
 def article_remove(user, article_slug, action, **kwargs):
@@ -494,17 +505,19 @@ def comment_new(user, article_slug, parent_id, content, **kwargs):
         article.comment_count += 1
         article.killed = now()
     article.save()
-    if not comment.is_removed:
+    _moderate(comment)
+    # spam filter may have removed it if it ran inline
+    if db.Comment.objects.filter(id=comment.id, is_removed=False).exists():
         if parent:
             db.Notification.send(
                 parent.user, comment.get_absolute_url(),
                 '%s replied to your comment: %s' % (
-                    username, synopsis(parent.content, 7)))
+                    username, synopsis(parent, 7)))
         else:
             db.Notification.send(
                 article.author, comment.get_absolute_url(),
                 '%s replied to your post: %s' % (
-                    username, synopsis(article.content, 7)))
+                    username, synopsis(article, 7)))
     return comment_get(user, comment.id)
 
 
@@ -514,18 +527,9 @@ def comment_get(user, comment_id=None, **kwargs):
         comment = db.Comment.objects.get(id=comment_id, is_deleted=False)
     except db.Comment.DoesNotExist:
         raise APIException(_("comment not found"))
-    comment.upvoted = False
-    comment.downvoted = False
-    if user and user.id:
-        try:
-            vote = db.CommentVote.objects.get(comment=comment, user=user)
-        except db.CommentVote.DoesNotExist:
-            vote = None
-        if vote:
-            if vote.vote == 1:
-                comment.upvoted = True
-            elif vote.vote == -1:
-                comment.downvoted = True
+    vote = votes.lookup(user, [comment]).get(comment.id)
+    comment.upvoted = (vote == 1)
+    comment.downvoted = (vote == -1)
     html = render_to_string('occupywallst/comment.html',
                             {'comment': comment,
                              'user': user,
@@ -551,6 +555,7 @@ def comment_edit(user, comment_id, content, **kwargs):
     comment.content = content
     _check_post(user, comment)
     comment.save()
+    _moderate(comment)
     return comment_get(user, comment.id)
 
 
@@ -0,0 +1,199 @@
+r"""
+
+    occupywallst.attendeemap
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tiled and clustered data for the attendees map.
+
+    The map is split into the same tiles as Google Maps: at zoom ``z``
+    the world is ``2**z`` by ``2**z`` tiles in the Web Mercator
+    projection.  Zoomed out past ``CLUSTER_MAX_ZOOM`` each tile is
+    split into a ``GRID`` by ``GRID`` grid and we return how many
+    people live in each cell, positioned at their average location.
+    Zoomed in further we return the people themselves.
+
+    Tiles are computed from ``values_list`` rows rather than model
+    instances and cached in memcached keyed by ``(zoom, x, y)`` and
+    the ``attendees`` version counter, which :py:func:`invalidate`
+    bumps when someone moves.
+
+    The same counter keys the "nearby users" list on profile pages,
+    see :py:func:`nearby`.
+
+"""
+
+import math
+
+from django.db import connection
+from django.core.cache import cache
+from django.contrib.gis.geos import Polygon
+from django.contrib.gis.measure import Distance
+
+from occupywallst import geo, utils, models as db
+
+
+VERSION = 'attendees'
+CLUSTER_MAX_ZOOM = 9
+MAX_ZOOM = 18
+MAX_TILES = 36
+GRID = 8
+TIMEOUT = 60 * 60
+NEARBY = 9
+NEARBY_CANDIDATES = 5
+
+
+def invalidate():
+    utils.bump_version(VERSION)
+
+
+def lng_to_x(lng, zoom):
+    return int((lng + 180.0) / 360.0 * 2 ** zoom)
+
+
+def lat_to_y(lat, zoom):
+    lat = max(min(lat, 85.0511), -85.0511)
+    rad = math.radians(lat)
+    merc = math.log(math.tan(rad) + 1 / math.cos(rad))
+    return int((1 - merc / math.pi) / 2 * 2 ** zoom)
+
+
+def x_to_lng(x, zoom):
+    return x / float(2 ** zoom) * 360.0 - 180.0
+
+
+def y_to_lat(y, zoom):
+    merc = math.pi * (1 - 2 * y / float(2 ** zoom))
+    return math.degrees(math.atan(math.sinh(merc)))
+
+
+def tile_bounds(zoom, x, y):
+    """Returns ``(swlat, swlng, nelat, nelng)`` of a tile"""
+    return (y_to_lat(y + 1, zoom), x_to_lng(x, zoom),
+            y_to_lat(y, zoom), x_to_lng(x + 1, zoom))
+
+
+def tiles_for(bounds, zoom):
+    """Returns ``(zoom, [(x, y), ...])`` of tiles covering bounds
+
+    If that's more than ``MAX_TILES`` tiles we zoom out until it
+    isn't, so a huge browser window can't make us do tons of work.
+    """
+    swlat, swlng, nelat, nelng = bounds
+    if swlng > nelng:
+        swlng, nelng = -180.0, 180.0  # crosses the date line
+    zoom = max(0, min(zoom, MAX_ZOOM))
+    while True:
+        top = 2 ** zoom - 1
+        xs = range(max(lng_to_x(swlng, zoom), 0),
+                   min(lng_to_x(nelng, zoom), top) + 1)
+        ys = range(max(lat_to_y(nelat, zoom), 0),
+                   min(lat_to_y(swlat, zoom), top) + 1)
+        if len(xs) * len(ys) <= MAX_TILES or zoom == 0:
+            return zoom, [(x, y) for x in xs for y in ys]
+        zoom -= 1
+
+
+def _rows(zoom, x, y, *fields):
+    swlat, swlng, nelat, nelng = tile_bounds(zoom, x, y)
+    bbox = Polygon.from_bbox([swlng, swlat, nelng, nelat])
+    return (db.UserInfo.objects
+            .filter(position__isnull=False, position__within=bbox)
+            .extra(select={'lat': 'ST_Y(occupywallst_userinfo.position)',
+                           'lng': 'ST_X(occupywallst_userinfo.position)'})
+            .values_list(*fields))
+
+
+def render_tile(zoom, x, y):
+    """Returns list of attendees or clusters in a tile"""
+    if zoom > CLUSTER_MAX_ZOOM:
+        return [{'id': user_id, 'username': username,
+                 'position': (lat, lng)}
+                for user_id, username, lat, lng
+                in _rows(zoom, x, y, 'user_id', 'user__username',
+                         'lat', 'lng')]
+    swlat, swlng, nelat, nelng = tile_bounds(zoom, x, y)
+    height = (nelat - swlat) / GRID or 1
+    width = (nelng - swlng) / GRID or 1
+    cells = {}
+    for lat, lng in _rows(zoom, x, y, 'lat', 'lng'):
+        row = min(int((lat - swlat) / height), GRID - 1)
+        col = min(int((lng - swlng) / width), GRID - 1)
+        cell = cells.setdefault(row * GRID + col, [0, 0.0, 0.0])
+        cell[0] += 1
+        cell[1] += lat
+        cell[2] += lng
+    return [{'id': '%d/%d/%d/%d' % (zoom, x, y, n), 'count': count,
+             'position': (lats / count, lngs / count)}
+            for n, (count, lats, lngs) in sorted(cells.items())]
+
+
+def attendees(bounds, zoom):
+    """Yields attendees or clusters visible in bounds at zoom level"""
+    zoom, tiles = tiles_for(bounds, zoom)
+    version = utils.get_version(VERSION)
+    keys = dict(('attendees:%d:%d:%d:%s' % (zoom, x, y, version), (x, y))
+                for x, y in tiles)
+    found = cache.get_many(keys.keys())
+    for key, (x, y) in keys.items():
+        res = found.get(key)
+        if res is None:
+            res = render_tile(zoom, x, y)
+            cache.set(key, res, TIMEOUT)
+        for item in res:
+            yield item
+
+
+def nearest(userinfo, count=NEARBY):
+    """Returns user ids of the ``count`` people living closest to someone
+
+    PostGIS answers ``ORDER BY position <-> point LIMIT n`` by walking
+    the GiST index on ``position``, so this takes the same time no
+    matter how many people we have.  That operator measures distance
+    in degrees though, which stretches east/west distances away from
+    the equator, so we ask for a few times more people than needed
+    and re-rank them by real distance.
+    """
+    lat, lng = userinfo.position_latlng
+    cursor = connection.cursor()
+    cursor.execute("SELECT user_id, ST_Y(position), ST_X(position)"
+                   "  FROM occupywallst_userinfo"
+                   " WHERE position IS NOT NULL AND user_id != %s"
+                   " ORDER BY position <-> ST_GeomFromText(%s, 4326)"
+                   " LIMIT %s",
+                   [userinfo.user_id, userinfo.position.wkt,
+                    count * NEARBY_CANDIDATES])
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    ids, lats, lngs = zip(*rows)
+    kms = geo.distances(lat, lng, lats, lngs)
+    return [user_id for km, user_id in sorted(zip(kms, ids))[:count]]
+
+
+def nearby(userinfo, count=NEARBY):
+    """Returns the ``count`` closest people as :py:class:`UserInfo` list
+
+    Each one gets a ``distance`` attribute.  The neighbours of each
+    user are cached until someone moves.
+    """
+    if userinfo.position is None:
+        return []
+    key = 'nearby:%d:%d:%s' % (userinfo.user_id, count,
+                               utils.get_version(VERSION))
+    ids = cache.get(key)
+    if ids is None:
+        ids = nearest(userinfo, count)
+        cache.set(key, ids, TIMEOUT)
+    found = dict((info.user_id, info) for info in
+                 db.UserInfo.objects
+                 .select_related('user')
+                 .filter(user__in=ids, position__isnull=False))
+    res = []
+    lat, lng = userinfo.position_latlng
+    for user_id in ids:
+        info = found.get(user_id)
+        if info is not None:
+            info.distance = Distance(km=geo.haversine(
+                lat, lng, info.position_lat, info.position_lng))
+            res.append(info)
+    return res
@@ -0,0 +1,267 @@
+r"""
+
+    occupywallst.bayes
+    ~~~~~~~~~~~~~~~~~~
+
+    In-process naive bayesian spam filter.
+
+    :py:class:`LocalBayes` behaves like ``RedisBayes`` except the word
+    counts live in this process rather than redis, so classifying a
+    post doesn't need hundreds of network round trips.  Words are
+    interned to integer ids and each category keeps its counts in an
+    ``array('l')`` indexed by word id, which is a lot more compact
+    than a dict of strings.
+
+    The model can be snapshotted to a file with :py:meth:`save` so
+    workers start fast.  ``occupywallst train`` builds it from every
+    post we have in a few seconds using :py:meth:`train_many`.
+
+    Set ``OWS_SPAM_BAYES`` to the snapshot path to use it.  Each
+    process has its own copy, so if they all trained and saved their
+    own, they'd clobber each other.  Instead :py:func:`learn` appends
+    training to a redis list and a single ``occupywallst jobworker``,
+    whichever holds the trainer lease, applies it with
+    :py:func:`absorb` and saves the snapshot.  Everyone else loads the
+    new one when :py:func:`refresh` notices the file changed.  So a
+    local filter needs a job worker running even if ``OWS_JOB_QUEUE``
+    is off.  Training may get applied twice if the trainer dies at
+    just the wrong moment, which is harmless enough for a spam filter.
+
+"""
+
+import os
+import json
+import math
+import socket
+import cPickle as pickle
+from array import array
+from collections import defaultdict
+
+import redis
+from redisbayes import RedisBayes, english_tokenizer
+from django.conf import settings
+
+
+TRAIN_KEY = 'ows:bayes:train'
+TRAINER_KEY = 'ows:bayes:trainer'
+TRAINER_TIMEOUT = 60 * 5
+BATCH = 500
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis()
+    return _redis
+
+
+def occurrences(words):
+    res = defaultdict(int)
+    for word in words:
+        res[word] += 1
+    return res
+
+
+class LocalBayes(object):
+    """Naive bayesian classifier held in memory"""
+
+    def __init__(self, correction=0.1, tokenizer=None):
+        self.correction = correction
+        self.tokenizer = tokenizer or english_tokenizer
+        self.flush()
+
+    def flush(self):
+        self.words = {}
+        self.counts = {}
+        self.tallies = {}
+        self.dirty = True
+        self.mtime = None
+
+    def _wid(self, word):
+        wid = self.words.get(word)
+        if wid is None:
+            wid = self.words[word] = len(self.words)
+        return wid
+
+    def _table(self, category):
+        counts = self.counts.get(category)
+        if counts is None:
+            counts = self.counts[category] = array('l')
+            self.tallies[category] = 0
+        if len(counts) < len(self.words):
+            counts.extend([0] * (len(self.words) - len(counts)))
+        return counts
+
+    def _add(self, category, occurs, sign):
+        wids = [(self._wid(word), count) for word, count in occurs.items()]
+        counts = self._table(category)
+        tally = 0
+        for wid, count in wids:
+            new = max(counts[wid] + sign * count, 0)
+            tally += new - counts[wid]
+            counts[wid] = new
+        self.tallies[category] += tally
+        if not self.tallies[category]:
+            del self.counts[category]
+            del self.tallies[category]
+        self.dirty = True
+
+    def train(self, category, text):
+        self._add(category, occurrences(self.tokenizer(text)), 1)
+
+    def untrain(self, category, text):
+        if category in self.counts:
+            self._add(category, occurrences(self.tokenizer(text)), -1)
+
+    def train_many(self, pairs):
+        """Trains from iterable of ``(category, text)`` in one pass
+
+        Word counts are summed in plain dicts first and then added to
+        the tables, which is much faster than calling :py:meth:`train`
+        for each post.
+        """
+        totals = defaultdict(lambda: defaultdict(int))
+        for category, text in pairs:
+            occurs = totals[category]
+            for word in self.tokenizer(text):
+                occurs[word] += 1
+        for category, occurs in totals.items():
+            self._add(category, occurs, 1)
+
+    def tally(self, category):
+        return self.tallies.get(category, 0)
+
+    def score(self, text):
+        occurs = occurrences(self.tokenizer(text))
+        wids = [self.words.get(word) for word in occurs]
+        scores = {}
+        for category, counts in self.counts.items():
+            tally = float(self.tallies[category])
+            scores[category] = 0.0
+            for wid in wids:
+                count = 0
+                if wid is not None and wid < len(counts):
+                    count = counts[wid]
+                scores[category] += math.log((count or self.correction) /
+                                             tally)
+        return scores
+
+    def classify(self, text):
+        scores = self.score(text)
+        if not scores:
+            return None
+        return max(scores.items(), key=lambda v: v[1])[0]
+
+    def save(self, path):
+        """Writes model to file atomically"""
+        words = [None] * len(self.words)
+        for word, wid in self.words.items():
+            words[wid] = word
+        data = {'words': words,
+                'counts': dict((c, t.tostring())
+                               for c, t in self.counts.items())}
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+        self.mtime = os.stat(path).st_mtime
+        self.dirty = False
+
+    def load(self, path):
+        with open(path, 'rb') as fp:
+            mtime = os.fstat(fp.fileno()).st_mtime
+            data = pickle.load(fp)
+        self.words = dict((word, wid) for wid, word
+                          in enumerate(data['words']))
+        self.counts = {}
+        self.tallies = {}
+        for category, raw in data['counts'].items():
+            counts = array('l')
+            counts.fromstring(raw)
+            self.counts[category] = counts
+            self.tallies[category] = sum(counts)
+        self.mtime = mtime
+        self.dirty = False
+
+    def reload(self, path):
+        """Loads snapshot if it changed since we last loaded or saved it
+
+        Returns true if it did.  Training we haven't saved yet is never
+        thrown away.
+        """
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        if mtime == self.mtime or (self.dirty and self.counts):
+            return False
+        self.load(path)
+        return True
+
+
+def get_backend():
+    """Returns classifier configured by ``OWS_SPAM_BAYES``"""
+    path = settings.OWS_SPAM_BAYES
+    if not path:
+        return RedisBayes(redis.Redis())
+    res = LocalBayes()
+    if os.path.exists(path):
+        res.load(path)
+    return res
+
+
+def _learn(backend, category, text):
+    if category == 'good':
+        backend.untrain('bad', text)
+    backend.train(category, text)
+
+
+def learn(backend, category, text):
+    """Trains filter that ``text`` is ``category``
+
+    Good text is also untrained as bad, in case a moderator changed
+    their mind.  Local filters only get trained by :py:func:`absorb`.
+    """
+    try:
+        if isinstance(backend, LocalBayes):
+            _get_redis().rpush(TRAIN_KEY, json.dumps([category, text]))
+        else:
+            _learn(backend, category, text)
+    except redis.ConnectionError:
+        pass
+
+
+def absorb(backend, batch=BATCH):
+    """Applies queued training to local filter and saves a snapshot
+
+    Only the process holding the trainer lease does anything.  Returns
+    number of posts trained.
+    """
+    if not isinstance(backend, LocalBayes):
+        return 0
+    conn = _get_redis()
+    me = '%s:%d' % (socket.gethostname(), os.getpid())
+    conn.set(TRAINER_KEY, me, nx=True, ex=TRAINER_TIMEOUT)
+    if conn.get(TRAINER_KEY) != me:
+        return 0
+    conn.expire(TRAINER_KEY, TRAINER_TIMEOUT)
+    refresh(backend)
+    items = conn.lrange(TRAIN_KEY, 0, batch - 1)
+    for item in items:
+        _learn(backend, *json.loads(item))
+    checkpoint(backend)
+    conn.ltrim(TRAIN_KEY, len(items), -1)
+    return len(items)
+
+
+def refresh(backend):
+    """Picks up a snapshot saved by some other process"""
+    if isinstance(backend, LocalBayes) and settings.OWS_SPAM_BAYES:
+        backend.reload(settings.OWS_SPAM_BAYES)
+
+
+def checkpoint(backend):
+    """Snapshots local model to disk if it changed"""
+    if isinstance(backend, LocalBayes) and backend.dirty:
+        backend.save(settings.OWS_SPAM_BAYES)
@@ -0,0 +1,156 @@
+r"""
+
+    occupywallst.commenttree
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cached rendering of the comment section on article/thread pages.
+
+    Rendering a hot thread means running ``comment.html`` and markdown
+    once for every comment, which is way too slow to do on each page
+    view for logged-in users.  So we render the whole tree once per
+    article and cache it.  The cache key includes a version counter
+    which gets bumped whenever a comment on the article is posted,
+    edited, removed or voted on.
+
+    The cached html doesn't know who's looking at it.  Anything that
+    depends on the viewer is left as a marker in the html which
+    :py:func:`overlay` fills in with a single regex pass:
+
+    - ``<!--ows:up:ID-->`` and ``<!--ows:down:ID-->`` become the css
+      classes for the vote arrows the user already clicked.
+
+    - ``<!--ows:own:ID-->`` becomes the edit/delete links if the user
+      wrote the comment.
+
+    - ``<!--ows:rm:ID-->...<!--ows:else:ID-->...<!--ows:/rm:ID-->``
+      picks between the "[Removed]" placeholder and the actual comment.
+      We don't want trolls to know if their comments are being removed
+      so they get to see their own stuff.
+
+    Moderators see a different tree (removed comments, mod links) so
+    we cache one tree per role rather than per user.  The html gets
+    zlib compressed so big threads fit in a memcached item.
+
+"""
+
+import re
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext
+
+from occupywallst import utils, votes, pagecache, models as db
+from occupywallst.templatetags.ows import show_comments
+
+
+pat_overlay = re.compile(
+    r'<!--ows:rm:(\d+)-->(.*?)<!--ows:else:\1-->(.*?)<!--ows:/rm:\1-->'
+    r'|<!--ows:(up|down|own):(\d+)-->', re.S)
+
+
+def instate_hierarchy(comments):
+    """Rearranges list of comments into hierarchical structure
+
+    This adds the pseudo-field "replies" to each comment.
+    """
+    for com in comments:
+        com.replies = []
+    comhash = dict([(c.id, c) for c in comments])
+    res = []
+    for com in comments:
+        if com.parent_id is None:
+            res.append(com)
+        else:
+            if com.parent_id in comhash:
+                comhash[com.parent_id].replies.append(com)
+    return res
+
+
+def version(article):
+    """Returns current version number of an article's comment tree"""
+    return utils.get_version('comments:%d' % (article.id))
+
+
+def invalidate(article_id):
+    """Call me when any comment on an article changes
+
+    This also purges cached copies of the article's page.
+    """
+    utils.bump_version('comments:%d' % (article_id))
+    pagecache.purge('article:%d' % (article_id))
+
+
+def _role(user):
+    if user and user.id and user.userinfo.can_moderate():
+        return 'super' if user.is_superuser else 'mod'
+    return 'public'
+
+
+def _render(article, user):
+    """Renders comment tree with markers instead of per-user stuff"""
+    comments = (db.Comment.objects
+                .select_related("article", "user", "user__userinfo")
+                .filter(article=article)
+                .order_by('-karma', '-published'))[:]
+    owners = {}
+    removed = {}
+    for com in comments:
+        owners[com.id] = com.user_id
+        if com.is_removed:
+            removed[com.id] = com.ip
+    html = show_comments({'overlay': True}, user,
+                         instate_hierarchy(comments))
+    return {'html': zlib.compress(html.encode('utf8')),
+            'article_id': article.id,
+            'owners': owners, 'removed': removed}
+
+
+def overlay(tree, user, ip=None, myvotes=None):
+    """Fills in per-user markers in a cached comment tree
+
+    ``myvotes`` maps comment ids to ``1`` or ``-1`` for how the user
+    voted.  If it isn't specified, we'll check the vote index.
+    """
+    uid = user.id if user and user.id else None
+    owners = tree['owners']
+    removed = tree['removed']
+    if myvotes is None:
+        myvotes = votes.lookup_article(user, tree['article_id'])
+    own = None
+    if uid:
+        own = ('<a class="edit" href="#">%s</a>\n'
+               '<a class="delete" href="#">%s</a>' % (
+                   ugettext('edit'), ugettext('delete')))
+
+    def _overlay(mat):
+        if mat.group(1):
+            comid = int(mat.group(1))
+            if ((uid and owners.get(comid) == uid) or
+                (ip and removed.get(comid) == ip)):
+                return pat_overlay.sub(_overlay, mat.group(3))
+            else:
+                return mat.group(2)
+        what, comid = mat.group(4), int(mat.group(5))
+        if what == 'up':
+            return 'upvoted' if myvotes.get(comid) == 1 else ''
+        elif what == 'down':
+            return 'downvoted' if myvotes.get(comid) == -1 else ''
+        else:
+            return own if uid and owners.get(comid) == uid else ''
+
+    html = zlib.decompress(tree['html']).decode('utf8')
+    return mark_safe(pat_overlay.sub(_overlay, html))
+
+
+def render(article, user, ip=None, language=None):
+    """Returns comment section html for article as seen by user"""
+    role = _role(user)
+    key = 'comment_tree:%d:%d:%s:%s' % (
+        article.id, version(article), role, language)
+    tree = cache.get(key)
+    if tree is None:
+        tree = _render(article, user if role != 'public' else None)
+        cache.set(key, tree, settings.OWS_COMMENT_TREE_CACHE)
+    return overlay(tree, user, ip)
@@ -10,18 +10,36 @@ r"""
 from django.conf import settings
 from occupywallst import models as db
 from django.utils.safestring import mark_safe
-from django.core.exceptions import ObjectDoesNotExist
+
+
+# looked up by base.html on pretty much every page
+PREFETCH = ('title', 'description', 'header', 'navbar', 'footer', 'scripts')
 
 
 class VerbiageGetter(object):
+    """Looks up verbiage for templates
+
+    The first lookup fetches the verbiage version counter and
+    everything in ``PREFETCH`` at once, so rendering a page usually
+    costs a single memcached round trip.
+    """
+
     def __init__(self, request):
         self.request = request
+        self.version = None
+        self.found = {}
+
+    def _fetch(self, names):
+        self.found.update(db.Verbiage.get_many(
+            names, self.request.LANGUAGE_CODE, self.version))
 
     def __getitem__(self, key):
-        try:
-            return mark_safe(db.Verbiage.get(key, self.request.LANGUAGE_CODE))
-        except ObjectDoesNotExist:
-            return ''
+        if self.version is None:
+            self.version = db.Verbiage.version()
+            self._fetch(set(PREFETCH) | set([key]))
+        elif key not in self.found:
+            self._fetch([key])
+        return mark_safe(self.found.get(key, ''))
 
 
 def verbiage(request):
@@ -87,7 +87,7 @@ class RSSCommentFeed(Feed):
                 .order_by('-published'))[:50]
 
     def item_title(self, comment):
-        return escape(synopsis(comment.content))
+        return escape(synopsis(comment))
 
     def item_pubdate(self, comment):
         return comment.published
@@ -11,7 +11,7 @@ from django import forms
 from django.forms.models import modelformset_factory
 from django.conf import settings
 
-from occupywallst import models as db
+from occupywallst import attendeemap, models as db
 from occupywallst.fields import ReCaptchaField
 
 
@@ -57,6 +57,7 @@ class ProfileForm(forms.Form):
     def save(self):
         user = self.user
         ui = user.userinfo
+        old_position = ui.position_latlng
         ui.info = self.cleaned_data.get('info')
         position_lat = self.cleaned_data.get('position_lat')
         position_lng = self.cleaned_data.get('position_lng')
@@ -71,6 +72,8 @@ class ProfileForm(forms.Form):
         ui.address = self.cleaned_data.get('address')
         ui.zipcode = self.cleaned_data.get('zipcode')
         ui.save()
+        if ui.position_latlng != old_position:
+            attendeemap.invalidate()
         user.email = self.cleaned_data.get('email')
         user.save()
         return user
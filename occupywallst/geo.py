@@ -5,86 +5,229 @@ r"""
 
     Useful geographic map type functions.
 
+    :py:func:`distances` and :py:func:`distance_matrix` compute lots of
+    haversine distances at once.  They use NumPy if it's installed and
+    fall back to calling :py:func:`haversine` in a loop otherwise.
+    ``occupywallst benchmark haversine`` compares the two.
+
+    :py:func:`geocode` and :py:func:`directions` remember everything
+    Google tells us (see :py:func:`_lookup`) so the same trip is never
+    looked up twice.  Who we ask is up to ``OWS_GEO_PROVIDER``; set
+    it to :py:class:`FixtureProvider` to work offline.
+
 """
 
+import re
 import json
+import time
+import socket
 import urllib
-import urllib2
-from math import sqrt, cos, sin, atan2, pi
+import httplib
+import hashlib
+import threading
+from math import sqrt, cos, sin, asin, radians
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils.encoding import smart_str
+from django.utils.importlib import import_module
+
+from occupywallst import utils, polyline, models as db
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+EARTH_KM = 6367.0
+CACHE_TIMEOUT = 60 * 60 * 24
+MISS_TIMEOUT = 60 * 10  # how long to remember google found nothing
+_providers = {}
 
 
 class GeocodeException(Exception):
     pass
 
 
+class GoogleProvider(object):
+    """Asks the Google Maps web services
+
+    Each thread keeps an HTTP connection open to Google so we don't
+    pay for a handshake on every lookup.  Requests give up after
+    ``OWS_GEO_TIMEOUT`` seconds.
+    """
+
+    host = 'maps.googleapis.com'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def _get(self, path, params):
+        url = path + '?' + urllib.urlencode(dict(params, sensor='false'))
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = httplib.HTTPConnection(
+                    self.host, timeout=settings.OWS_GEO_TIMEOUT)
+                self.local.conn = conn
+            try:
+                conn.request('GET', url)
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error), exc:
+                conn.close()
+                self.local.conn = None
+                # a kept alive connection might have been closed on
+                # us, so try once more unless google is just slow
+                if attempt or isinstance(exc, socket.timeout):
+                    raise GeocodeException('request failed', exc)
+                continue
+            if response.status != 200:
+                raise GeocodeException('http error', response.status)
+            return json.loads(body)
+
+    def geocode(self, address):
+        response = self._get('/maps/api/geocode/json',
+                             {'address': smart_str(address)})
+        if response['status'] == 'ZERO_RESULTS':
+            return []
+        if response['status'] != 'OK':
+            raise GeocodeException(response['status'], address)
+        return response['results']
+
+    def directions(self, waypoints):
+        waypoints = [smart_str(w) for w in waypoints]
+        response = self._get('/maps/api/directions/json',
+                             {'origin': waypoints[0],
+                              'destination': waypoints[-1],
+                              'waypoints': '|'.join(waypoints[1:-1])})
+        if response['status'] != 'OK':
+            raise GeocodeException(response['status'], waypoints)
+        return response['routes']
+
+
+class FixtureProvider(object):
+    """Serves canned responses, for tests and offline deployments
+
+    Responses are loaded from the JSON file ``OWS_GEO_FIXTURES``
+    which looks like ``{"geocode": {address: results},
+    "directions": {"waypoint|waypoint": routes}}`` where addresses are
+    normalized with :py:func:`normalize_address`.  Anything not in
+    there raises :py:class:`GeocodeException`.
+    """
+
+    def __init__(self):
+        with open(settings.OWS_GEO_FIXTURES) as fp:
+            self.data = json.load(fp)
+
+    def _get(self, kind, query):
+        try:
+            return self.data[kind][query]
+        except KeyError:
+            raise GeocodeException('ZERO_RESULTS', query)
+
+    def geocode(self, address):
+        return self._get('geocode', normalize_address(address))
+
+    def directions(self, waypoints):
+        return self._get('directions', _waypoints_key(waypoints))
+
+
+def get_provider():
+    """Returns instance of the ``OWS_GEO_PROVIDER`` class"""
+    path = settings.OWS_GEO_PROVIDER
+    if path not in _providers:
+        module, name = path.rsplit('.', 1)
+        _providers[path] = getattr(import_module(module), name)()
+    return _providers[path]
+
+
+def normalize_address(address):
+    """Makes trivially different ways of writing an address the same"""
+    address = re.sub(r'\s*,\s*', ', ', address.strip().lower())
+    return ' '.join(address.split()).strip(', ')
+
+
+def _waypoints_key(waypoints):
+    return '|'.join(normalize_address(w) for w in waypoints)
+
+
+def _lookup(kind, query, fetch):
+    """Returns cached response of geocoding service
+
+    Responses are kept forever in the ``GeoCache`` table and for a day
+    in memcached in front of it.  If several requests want the same
+    thing at once, only one of them asks the database or Google while
+    the rest wait for its answer.  Errors aren't cached.  Empty
+    responses aren't stored in the database and are only remembered
+    for ``MISS_TIMEOUT`` seconds, since Google might know the place
+    tomorrow.
+    """
+    digest = hashlib.sha1(smart_str(query)).hexdigest()
+
+    def compute():
+        try:
+            row = db.GeoCache.objects.get(kind=kind, digest=digest)
+            return (json.loads(row.response), time.time())
+        except db.GeoCache.DoesNotExist:
+            pass
+        res = fetch()
+        if res:
+            _store(kind, digest, query, res)
+        return (res, time.time())
+
+    def fresh(entry):
+        res, fetched = entry
+        return bool(res) or time.time() - fetched < MISS_TIMEOUT
+
+    return utils.cached('geo2:%s:%s' % (kind, digest), compute,
+                        CACHE_TIMEOUT, fresh=fresh,
+                        wait=settings.OWS_GEO_TIMEOUT)[0]
+
+
+def _store(kind, digest, query, res):
+    managed = transaction.is_managed()
+    if managed:
+        sid = transaction.savepoint()
+    try:
+        db.GeoCache.objects.create(kind=kind, digest=digest, query=query,
+                                   response=json.dumps(res))
+    except IntegrityError:
+        # someone else looked it up at the same time
+        if managed:
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.rollback_unless_managed()
+    else:
+        if managed:
+            transaction.savepoint_commit(sid)
+
+
 def directions(waypoints):
-    url = ('http://maps.googleapis.com/maps/api/directions/json?' +
-           urllib.urlencode({'origin': waypoints[0],
-                             'destination': waypoints[-1],
-                             'waypoints': '|'.join(waypoints[1:-1]),
-                             'sensor': 'false'}))
-    response = json.loads(urllib2.urlopen(url).read())
-    if response['status'] != "OK":
-        raise Exception(response['status'], waypoints)
-    for route in response['routes']:
-        route['overview_polyline']['points'] = \
-            polydecode(route['overview_polyline']['points'])
-    return response['routes']
+    """Returns driving directions between addresses
 
+    Each route's ``overview_polyline`` is left encoded.
+    """
+    return _lookup('directions', _waypoints_key(waypoints),
+                   lambda: get_provider().directions(waypoints))
 
-def polydecode(encoded):
-    """Decodes a polyline that was encoded using the Google Maps method.
 
-    See http://code.google.com/apis/maps/documentation/polylinealgorithm.html
+def polydecode(encoded):
+    """Decodes a polyline into a list of ``(lat, lng)`` tuples
 
-    This is a straightforward Python port of Mark McClure's JavaScript
-    polyline decoder (http://moourl.com/8hucs) and Peter Chng's PHP
-    polyline decode (http://moourl.com/5hddu)
+    See :py:mod:`occupywallst.polyline` for something faster.
     """
-    encoded_len = len(encoded)
-    index = 0
-    array = []
-    lat = 0
-    lng = 0
-    while index < encoded_len:
-        b = 0
-        shift = 0
-        result = 0
-        while True:
-            b = ord(encoded[index]) - 63
-            index = index + 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlat = ~(result >> 1) if result & 1 else result >> 1
-        lat += dlat
-        shift = 0
-        result = 0
-        while True:
-            b = ord(encoded[index]) - 63
-            index = index + 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if result & 1 else result >> 1
-        lng += dlng
-        array.append((lat * 1e-5, lng * 1e-5))
-    return array
+    coords = polyline.decode(encoded)
+    return zip(coords[0::2], coords[1::2])
 
 
 def geocode(address):
     """Get information about an address (like latitude/longitude)
     using Google's Maps API v3
     """
-    url = ('http://maps.googleapis.com/maps/api/geocode/json?' +
-           urllib.urlencode({'sensor': 'false',
-                             'address': address}))
-    response = json.loads(urllib2.urlopen(url).read())
-    if response['status'] != "OK":
-        raise GeocodeException(response['status'], address)
-    return response['results']
+    return _lookup('geocode', normalize_address(address),
+                   lambda: get_provider().geocode(address))
 
 
 def address_to_latlng(address):
@@ -99,18 +242,54 @@ def address_to_latlng(address):
 
 def haversine(lat1, lng1, lat2, lng2):
     """Calculate kilometer distance between two places on earth"""
-    # convert to radians
-    lng1 = float(lng1) * pi / 180
-    lng2 = float(lng2) * pi / 180
-    lat1 = float(lat1) * pi / 180
-    lat2 = float(lat2) * pi / 180
-    # haversine formula
-    dlng = lng2 - lng1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlng / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    km = 6367 * c
-    return km
+    lat1, lng1 = radians(float(lat1)), radians(float(lng1))
+    lat2, lng2 = radians(float(lat2)), radians(float(lng2))
+    a = (sin((lat2 - lat1) / 2) ** 2 +
+         cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_KM * asin(sqrt(min(a, 1.0)))
+
+
+def _haversine_arrays(lat1, lng1, lat2, lng2):
+    """Same as :py:func:`haversine` but on broadcastable NumPy arrays"""
+    lat1, lng1, lat2, lng2 = [numpy.radians(v)
+                              for v in (lat1, lng1, lat2, lng2)]
+    a = (numpy.sin((lat2 - lat1) / 2) ** 2 +
+         numpy.cos(lat1) * numpy.cos(lat2) *
+         numpy.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+def distances(lat, lng, lats, lngs):
+    """Returns kilometers from one place to each of many places
+
+    ``lats`` and ``lngs`` are sequences (or NumPy arrays) of the same
+    length.  Returns a NumPy array if NumPy is installed, otherwise a
+    list.
+    """
+    if numpy is None:
+        return [haversine(lat, lng, lat2, lng2)
+                for lat2, lng2 in zip(lats, lngs)]
+    return _haversine_arrays(float(lat), float(lng),
+                             numpy.asarray(lats, dtype=float),
+                             numpy.asarray(lngs, dtype=float))
+
+
+def distance_matrix(lats1, lngs1, lats2, lngs2):
+    """Returns kilometers between every pair of places in two lists
+
+    Row ``i`` column ``j`` of the result is the distance from the
+    ``i``th place in the first list to the ``j``th place in the
+    second.  Returns a 2d NumPy array if NumPy is installed, otherwise
+    a list of lists.
+    """
+    if numpy is None:
+        return [distances(lat, lng, lats2, lngs2)
+                for lat, lng in zip(lats1, lngs1)]
+    lats1 = numpy.asarray(lats1, dtype=float)[:, numpy.newaxis]
+    lngs1 = numpy.asarray(lngs1, dtype=float)[:, numpy.newaxis]
+    return _haversine_arrays(lats1, lngs1,
+                             numpy.asarray(lats2, dtype=float),
+                             numpy.asarray(lngs2, dtype=float))
 
 
 if __name__ == '__main__':
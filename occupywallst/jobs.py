@@ -0,0 +1,229 @@
+r"""
+
+    occupywallst.jobs
+    ~~~~~~~~~~~~~~~~~
+
+    Background jobs for slow side effects.
+
+    Stuff like asking Google for driving directions or notifying
+    everyone who asked for a seat on a ride doesn't need to happen
+    before we respond.  Decorate a function with :py:func:`task` and
+    call ``submit(func, *args)`` instead of ``func(*args)``.  The
+    arguments get stored as JSON so pass ids rather than objects.
+
+    If ``OWS_JOB_QUEUE`` is enabled, :py:func:`submit` pushes the job
+    onto a redis list and ``occupywallst jobworker`` pops them off and
+    runs each one in its own transaction.  Jobs that fail are retried
+    after ``RETRY_DELAY`` seconds, doubling each time, and end up on a
+    dead letter list after ``MAX_ATTEMPTS`` tries.  A job submitted
+    during a request may get picked up before the request commits, in
+    which case it should notice it doesn't see what it expects, raise
+    and get retried.
+
+    Workers move each job onto a processing list of their own while
+    running it.  If a worker dies, the next worker to notice its
+    heartbeat is gone puts those jobs back on the queue.  So jobs run
+    at least once and tasks should be safe to run more than once.
+
+    If ``OWS_JOB_QUEUE`` is false, or redis is down, jobs are run right
+    away in the current process.  That's what the tests use.
+
+    Queue depth and latency are shown in the admin under
+    ``/admin/queues/`` and by ``occupywallst jobworker --stats``.
+
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils.importlib import import_module
+
+
+logger = logging.getLogger(__name__)
+QUEUE_KEY = 'ows:jobs'
+RETRY_KEY = 'ows:jobs:retry'
+DEAD_KEY = 'ows:jobs:dead'
+STATS_KEY = 'ows:jobs:stats'
+WORKERS_KEY = 'ows:jobs:workers'
+HEARTBEAT = 60 * 5
+BATCH = 20
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis()
+    return _redis
+
+
+def task(func):
+    """Marks function as something :py:func:`submit` can queue"""
+    func.task_name = '%s.%s' % (func.__module__, func.__name__)
+    return func
+
+
+def _resolve(name):
+    module, attr = name.rsplit('.', 1)
+    func = getattr(import_module(module), attr, None)
+    if getattr(func, 'task_name', None) != name:
+        raise LookupError('not a task: %s' % (name))
+    return func
+
+
+def submit(func, *args):
+    """Runs ``func(*args)`` in the background"""
+    job = {'task': func.task_name,
+           'args': args,
+           'attempts': 0,
+           'queued': time.time()}
+    if settings.OWS_JOB_QUEUE:
+        try:
+            _get_redis().lpush(QUEUE_KEY, json.dumps(job))
+            return
+        except redis.ConnectionError:
+            logger.warning('job queue unavailable, running inline')
+    try:
+        _resolve(job['task'])(*job['args'])
+    except Exception:
+        logger.exception('job failed: %r', job)
+
+
+def _run(job, stats):
+    """Runs a job in its own transaction, returns true if it worked"""
+    start = time.time()
+    stats['wait_ms_total'] += int((start - job['queued']) * 1000)
+    stats['jobs'] += 1
+    try:
+        with transaction.commit_on_success():
+            _resolve(job['task'])(*job['args'])
+        return True
+    except Exception, e:
+        logger.warning('job failed: %r: %s', job, e)
+        stats['failed'] += 1
+        return False
+    finally:
+        stats['run_ms_total'] += int((time.time() - start) * 1000)
+
+
+def _processing_key():
+    return 'ows:jobs:processing:%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _requeue_due(conn):
+    """Atomically moves retries that are due to the front of the queue"""
+    with conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(RETRY_KEY)
+                due = pipe.zrangebyscore(RETRY_KEY, 0, time.time())
+                if not due:
+                    pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.zrem(RETRY_KEY, *due)
+                pipe.rpush(QUEUE_KEY, *due)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+
+
+def _beat(conn, mine):
+    """Tells other workers we're alive and where our jobs are"""
+    pipe = conn.pipeline()
+    pipe.set(mine + ':alive', 1)
+    pipe.expire(mine + ':alive', HEARTBEAT)
+    pipe.sadd(WORKERS_KEY, mine)
+    pipe.execute()
+
+
+def _recover(conn, mine):
+    """Puts jobs of dead workers back on the queue
+
+    Our own processing list only has something in it if we blew up
+    half way through a job last time.
+    """
+    for key in conn.smembers(WORKERS_KEY):
+        if key != mine and conn.exists(key + ':alive'):
+            continue
+        while conn.rpoplpush(key, QUEUE_KEY) is not None:
+            logger.warning('requeued job abandoned by %s', key)
+        if key != mine:
+            conn.srem(WORKERS_KEY, key)
+
+
+def _finish(conn, mine, job, ok):
+    pipe = conn.pipeline()
+    if not ok:
+        job['attempts'] += 1
+        if job['attempts'] >= MAX_ATTEMPTS:
+            logger.error('giving up on job: %r', job)
+            pipe.lpush(DEAD_KEY, json.dumps(job))
+        else:
+            when = time.time() + RETRY_DELAY * 2 ** (job['attempts'] - 1)
+            pipe.zadd(RETRY_KEY, **{json.dumps(job): when})
+            pipe.hincrby(STATS_KEY, 'retried', 1)
+    pipe.delete(mine)
+    pipe.execute()
+
+
+def work(batch=BATCH):
+    """Processes up to ``batch`` queued jobs
+
+    Retries that are due go to the front of the line.  Returns number
+    of jobs popped off the queue.
+    """
+    conn = _get_redis()
+    mine = _processing_key()
+    _beat(conn, mine)
+    _recover(conn, mine)
+    _requeue_due(conn)
+    stats = {'jobs': 0, 'failed': 0, 'wait_ms_total': 0, 'run_ms_total': 0}
+    count = 0
+    while count < batch:
+        _beat(conn, mine)
+        raw = conn.rpoplpush(QUEUE_KEY, mine)
+        if raw is None:
+            break
+        count += 1
+        job = json.loads(raw)
+        _finish(conn, mine, job, _run(job, stats))
+    if count:
+        pipe = conn.pipeline()
+        for key, val in stats.items():
+            pipe.hincrby(STATS_KEY, key, val)
+        pipe.execute()
+    return count
+
+
+def queue_stats():
+    """Returns metrics about the job queue
+
+    ``depth`` is how many jobs are waiting, ``running`` how many
+    workers are busy with right now, ``retrying`` how many
+    failed and are waiting to be tried again, ``wait_ms_avg`` how long
+    jobs sit in the queue before a worker gets to them and
+    ``run_ms_avg`` how long they take to run.
+    """
+    conn = _get_redis()
+    stats = dict((k, int(v)) for k, v in conn.hgetall(STATS_KEY).items())
+    for key in ('jobs', 'failed', 'retried', 'wait_ms_total',
+                'run_ms_total'):
+        stats.setdefault(key, 0)
+    stats['depth'] = conn.llen(QUEUE_KEY)
+    stats['running'] = sum(conn.llen(key)
+                           for key in conn.smembers(WORKERS_KEY))
+    stats['retrying'] = conn.zcard(RETRY_KEY)
+    stats['dead'] = conn.llen(DEAD_KEY)
+    stats['wait_ms_avg'] = stats['wait_ms_total'] / (stats['jobs'] or 1)
+    stats['run_ms_avg'] = stats['run_ms_total'] / (stats['jobs'] or 1)
+    return stats
@@ -0,0 +1,171 @@
+r"""
+
+    occupywallst.management.commands.benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measure throughput of the hot spots we've optimized.
+
+    Benchmarks:
+
+    - ``markdown``: renders the most recent comments serially, with
+      threads and with a process pool, reporting posts per second per
+      core.
+
+    - ``json``: encodes the most recent comments as an API response
+      the way we used to (``sanitize_json`` then ``json.dumps``) and
+      with :py:func:`occupywallst.utils.jsonify` and
+      :py:func:`occupywallst.utils.iterjson`.
+
+    - ``haversine``: measures distances from one place to ``--count``
+      random places calling :py:func:`occupywallst.geo.haversine` in a
+      loop versus :py:func:`occupywallst.geo.distances` (which uses
+      NumPy if it's installed).  Try ``--count=100000``.
+
+"""
+
+import sys
+import json
+import time
+import random
+import threading
+import multiprocessing
+from decimal import Decimal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from occupywallst import geo, utils, rendering, models as db
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def bench_markdown(options):
+    posts = list(db.Comment.objects
+                 .select_related('user')
+                 .order_by('-id')[:options['count']])
+    if not posts:
+        raise CommandError('need some comments to render')
+    procs = options['processes']
+    res = [('serial', len(posts), 1, timed(rendering.render_many, posts))]
+
+    def thread():
+        rendering.render_many(posts)
+    threads = [threading.Thread(target=thread) for n in range(procs)]
+
+    def run_threads():
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    res.append(('threads', len(posts) * procs, procs, timed(run_threads)))
+
+    pool = multiprocessing.Pool(procs)
+    try:
+        rendering.render_many(posts[:procs], pool)  # warm up workers
+        res.append(('pool', len(posts), procs,
+                    timed(rendering.render_many, posts, pool)))
+    finally:
+        pool.close()
+        pool.join()
+    return res
+
+
+def sanitize_json(value):
+    """How api responses were prepared before jsonify was single pass"""
+    if hasattr(value, 'as_dict'):
+        return sanitize_json(value.as_dict())
+    elif hasattr(value, 'timetuple'):
+        return utils.jstime(value)
+    elif isinstance(value, Decimal):
+        return str(value)
+    elif isinstance(value, basestring):
+        return value
+    elif isinstance(value, dict):
+        for k in value:
+            value[k] = sanitize_json(value[k])
+        return value
+    elif hasattr(value, '__iter__'):
+        return [sanitize_json(i) for i in value]
+    else:
+        return value
+
+
+def bench_json(options):
+    comments = list(db.Comment.objects
+                    .select_related('user')
+                    .order_by('-id')[:options['count']])
+    if not comments:
+        raise CommandError('need some comments to encode')
+    rounds = 10
+    payload = lambda: {'status': 'OK', 'message': 'success',
+                       'results': comments}
+
+    def legacy():
+        for n in range(rounds):
+            json.dumps(sanitize_json(payload()))
+
+    def single():
+        for n in range(rounds):
+            utils.jsonify(payload())
+
+    def stream():
+        for n in range(rounds):
+            for chunk in utils.iterjson(payload()):
+                pass
+
+    count = len(comments) * rounds
+    return [('legacy', count, 1, timed(legacy)),
+            ('jsonify', count, 1, timed(single)),
+            ('iterjson', count, 1, timed(stream))]
+
+
+def bench_haversine(options):
+    count = options['count']
+    lats = [random.uniform(-90, 90) for n in range(count)]
+    lngs = [random.uniform(-180, 180) for n in range(count)]
+
+    def scalar():
+        for lat, lng in zip(lats, lngs):
+            geo.haversine(40.71, -74.0, lat, lng)
+
+    label = 'numpy' if geo.numpy is not None else 'fallback'
+    return [('scalar', count, 1, timed(scalar)),
+            (label, count, 1, timed(geo.distances, 40.71, -74.0,
+                                    lats, lngs))]
+
+
+BENCHMARKS = {
+    'markdown': bench_markdown,
+    'json': bench_json,
+    'haversine': bench_haversine,
+}
+
+
+class Command(BaseCommand):
+    args = '[%s ...]' % ('|'.join(sorted(BENCHMARKS)))
+    help = __doc__
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--count', type='int', dest='count', default=1000,
+            help="Number of items per benchmark"),
+        make_option(
+            '--processes', type='int', dest='processes',
+            default=multiprocessing.cpu_count(),
+            help="Number of threads/processes for parallel runs"),
+    )
+
+    def handle(self, *args, **options):
+        for name in args:
+            if name not in BENCHMARKS:
+                raise CommandError('unknown benchmark: %s' % (name))
+        for name in args or sorted(BENCHMARKS):
+            for label, count, cores, secs in BENCHMARKS[name](options):
+                rate = count / secs if secs else 0
+                sys.stdout.write('%-10s %-10s %8d items %8.3fs %10.1f/s '
+                                 '%10.1f/s/core\n' % (
+                                     name, label, count, secs, rate,
+                                     rate / cores))
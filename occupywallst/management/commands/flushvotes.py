@@ -0,0 +1,54 @@
+r"""
+
+    occupywallst.management.commands.flushvotes
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Write buffered comment votes to the database.
+
+    This is only needed if ``OWS_VOTE_BUFFER`` is enabled.  Run it
+    with ``--loop 5`` under supervisord or whatever to flush every
+    five seconds.  ``--stats`` prints how well votes are being
+    coalesced.
+
+"""
+
+import sys
+import time
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from occupywallst import votes
+
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    args = ''
+    help = __doc__
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--loop', type='float', dest='loop', default=0,
+            help="Keep flushing every N seconds"),
+        make_option(
+            '--stats', action='store_true', dest='stats', default=False,
+            help="Print vote buffer metrics and exit"),
+    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = votes.buffer_stats()
+            for key in sorted(stats):
+                sys.stdout.write('%-16s %s\n' % (key, stats[key]))
+            return
+        while True:
+            try:
+                votes.flush()
+            except Exception:
+                if not options['loop']:
+                    raise
+                logger.exception('vote flush failed')
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
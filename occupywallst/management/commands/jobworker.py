@@ -0,0 +1,66 @@
+r"""
+
+    occupywallst.management.commands.jobworker
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Run queued background jobs.
+
+    This is only needed if ``OWS_JOB_QUEUE`` is enabled.  Run a few of
+    these with ``--loop 1`` under supervisord or whatever.  ``--stats``
+    prints queue depth and latency.
+
+    If the spam filter is local, one of them also applies training
+    and saves the model so other processes can load it.  Run this even
+    if ``OWS_JOB_QUEUE`` is off in that case.
+
+"""
+
+import sys
+import time
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from occupywallst import bayes, jobs, moderation
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = __doc__
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--loop', type='float', dest='loop', default=0,
+            help="Keep working, sleeping N seconds when queue is empty"),
+        make_option(
+            '--batch', type='int', dest='batch', default=jobs.BATCH,
+            help="Number of jobs to pop off the queue at once"),
+        make_option(
+            '--stats', action='store_true', dest='stats', default=False,
+            help="Print job queue metrics and exit"),
+    )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = jobs.queue_stats()
+            for key in sorted(stats):
+                sys.stdout.write('%-18s %s\n' % (key, stats[key]))
+            return
+        while True:
+            try:
+                count = jobs.work(options['batch'])
+                count += bayes.absorb(moderation.REDBAY)
+            except Exception:
+                if not options['loop']:
+                    raise
+                logger.exception('job worker failed')
+                count = 0
+            if not options['loop']:
+                if not count:
+                    break
+                continue
+            if not count:
+                time.sleep(options['loop'])
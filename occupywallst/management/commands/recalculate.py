@@ -0,0 +1,96 @@
+r"""
+
+    occupywallst.management.commands.recalculate
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Verify and fix denormalized counter fields.
+
+    By default this checks every comment, user and article and fixes
+    the ones that are wrong.  Pass ``--hours 25`` from a daily cron job
+    to only look at stuff touched recently.  Pass ``--dry-run`` to see
+    what's wrong without changing anything.
+    ``recalculate.sh`` passes the database name it was given on the
+    command line as ``--dbname``.
+
+"""
+
+import sys
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.db import connections
+from django.utils.timezone import utc
+from django.core.management.base import BaseCommand, CommandError
+
+from occupywallst import recalc, utils
+
+
+class Command(BaseCommand):
+    args = '[comments|users|articles ...]'
+    help = __doc__
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--since', dest='since', default=None,
+            help="Only rows touched since YYYY-MM-DD[ HH:MM:SS] (UTC)"),
+        make_option(
+            '--hours', type='int', dest='hours', default=0,
+            help="Only rows touched in the last N hours"),
+        make_option(
+            '--chunk', type='int', dest='chunk', default=recalc.CHUNK,
+            help="Number of primary keys to fix per transaction"),
+        make_option(
+            '--dry-run', action='store_true', dest='dry_run',
+            default=False, help="Report wrong counters but don't fix them"),
+        make_option(
+            '--quiet', action='store_true', dest='quiet', default=False,
+            help="Don't report progress"),
+        make_option(
+            '--dbname', dest='dbname', default=None,
+            help="Database name to use instead of the one in settings"),
+    )
+
+    def handle(self, *args, **options):
+        names = [c.name for c in recalc.COUNTERS]
+        for name in args:
+            if name not in names:
+                raise CommandError('unknown counter: %s' % (name))
+        if options['dbname']:
+            connection = connections['default']
+            connection.close()
+            connection.settings_dict['NAME'] = options['dbname']
+        since = None
+        if options['since']:
+            for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+                try:
+                    since = datetime.strptime(options['since'], fmt)
+                    break
+                except ValueError:
+                    pass
+            else:
+                raise CommandError('bad --since: %s' % (options['since']))
+            since = since.replace(tzinfo=utc)
+        elif options['hours']:
+            since = utils.now() - timedelta(hours=options['hours'])
+
+        def progress(name, hi, top, changed):
+            sys.stdout.write('%-10s %d/%d %s %d\n' % (
+                name, hi, top, 'wrong' if options['dry_run'] else 'fixed',
+                changed))
+
+        res = recalc.recalculate(args or None, since=since,
+                                 chunk=options['chunk'],
+                                 dry_run=options['dry_run'],
+                                 progress=None if options['quiet']
+                                 else progress)
+        for counter in recalc.COUNTERS:
+            if counter.name not in res:
+                continue
+            if options['dry_run']:
+                for id, diffs in res[counter.name]:
+                    sys.stdout.write('%s %d %s\n' % (
+                        counter.name, id, ' '.join(
+                            '%s=%s->%s' % (f, old, new)
+                            for f, (old, new) in sorted(diffs.items()))))
+            else:
+                sys.stdout.write('%s: fixed %d rows\n' % (
+                    counter.name, res[counter.name]))
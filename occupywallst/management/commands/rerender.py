@@ -0,0 +1,47 @@
+r"""
+
+    occupywallst.management.commands.rerender
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Re-render stored html of articles and comments.
+
+    Run this after deploying a change to ``rendering.VERSION``.  Only
+    rows rendered by an older version are touched so it's safe to
+    interrupt and run again.
+
+"""
+
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from occupywallst import rendering, models as db
+
+
+class Command(BaseCommand):
+    help = __doc__
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk', type='int', dest='chunk', default=rendering.CHUNK,
+            help="Number of rows to fetch at a time"),
+        make_option(
+            '--processes', type='int', dest='processes', default=1,
+            help="Number of worker processes to render with"),
+        make_option(
+            '--quiet', action='store_true', dest='quiet', default=False,
+            help="Don't report progress"),
+    )
+
+    def handle(self, *args, **options):
+        def progress(model, last, total):
+            sys.stdout.write('%-8s id %d rendered %d\n' % (
+                model.__name__.lower(), last, total))
+
+        for model in (db.Article, db.Comment):
+            total = rendering.rerender(model, chunk=options['chunk'],
+                                       processes=options['processes'],
+                                       progress=None if options['quiet']
+                                       else progress)
+            sys.stdout.write('%s: rendered %d rows\n' % (
+                model.__name__.lower(), total))
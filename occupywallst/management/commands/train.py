@@ -3,19 +3,38 @@ r"""
     occupywallst.management.commands.train
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    Train spam filter based on recent thread/comment moderation.
+    Train spam filter based on thread/comment moderation history.
+
+    With a local model (``OWS_SPAM_BAYES``) this trains on every post
+    in one pass and writes the snapshot.  With redis it only uses the
+    most recent posts because each one costs a bunch of round trips.
 
 """
 
 import os
+import sys
+import time
 import subprocess
 
 from whoosh import fields, index
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from occupywallst import models as db
-from occupywallst.api import REDBAY
+from occupywallst import bayes, models as db
+from occupywallst.moderation import REDBAY
+
+
+def history():
+    """Yields ``(category, text)`` for every post we have"""
+    for title, content, is_visible in (db.Article.objects
+                                       .values_list('title', 'content',
+                                                    'is_visible')
+                                       .iterator()):
+        yield ('good' if is_visible else 'bad', title + ' ' + content)
+    for content, is_removed in (db.Comment.objects
+                                .values_list('content', 'is_removed')
+                                .iterator()):
+        yield ('bad' if is_removed else 'good', content)
 
 
 class Command(BaseCommand):
@@ -24,6 +43,13 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         REDBAY.flush()
+        if isinstance(REDBAY, bayes.LocalBayes):
+            start = time.time()
+            REDBAY.train_many(history())
+            bayes.checkpoint(REDBAY)
+            sys.stdout.write('trained %d words in %.1fs\n' % (
+                len(REDBAY.words), time.time() - start))
+            return
         for post in (list(db.Article.objects.order_by('-published')[:1000]) +
                      list(db.Comment.objects.order_by('-published')[:2000])):
             bclass = 'bad' if post.is_removed else 'good'
@@ -72,7 +72,8 @@ var attendees_init;
         $("#loader").show();
         is_fetching = true;
         api("/api/safe/attendees/", {
-            "bounds": bounds_to_string(map.getBounds())
+            "bounds": bounds_to_string(map.getBounds()),
+            "zoom": map.getZoom()
         }, function(data) {
             if (data.status == "OK") {
                 attendees = data.results;
@@ -166,7 +167,26 @@ var attendees_init;
         });
     }
 
+    // when zoomed out the server gives us a count of people instead
+    function new_cluster_marker(pin) {
+        var count = pin.attendee.count;
+        var marker = new google.maps.Marker({
+            map: map,
+            position: pin.attendee.latlng,
+            label: "" + count,
+            title: count + (count == 1 ? " person" : " people")
+        });
+        google.maps.event.addListener(marker, "click", function() {
+            map.setCenter(pin.attendee.latlng);
+            map.setZoom(map.getZoom() + 2);
+        });
+        return marker;
+    }
+
     function new_marker(pin) {
+        if (pin.attendee.count) {
+            return new_cluster_marker(pin);
+        }
         var username = pin.attendee.username;
         var marker = new google.maps.Marker({
             map: map,
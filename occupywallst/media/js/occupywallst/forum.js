@@ -28,12 +28,14 @@ var forum_init;
         if (is_loading || is_done || !list.length)
             return;
         is_loading = true;
-        var count = $(".item", list).length;
-        api(url, {
-            "after": count,
-            "count": per_page
-        }, function(data) {
+        var args = {"count": per_page};
+        if (list.data("cursor"))
+            args.cursor = list.data("cursor");
+        else
+            args.after = $(".item", list).length;
+        api(url, args, function(data) {
             if (data.status == "OK") {
+                list.data("cursor", data.cursor);
                 $.each(data.results, function(k, html) {
                     var luv = $("<div>" + html + "</div>");
                     article_init(luv);
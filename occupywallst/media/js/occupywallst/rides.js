@@ -280,10 +280,8 @@ var rides_init;
         $.getJSON("/rides/api/safe/rides/", bounds, function(rides) {
             
             rides.results.forEach(function(ride, i) {
-                var line = happy_line(ride.route.map(function(p) {
-                    var point = new google.maps.LatLng(p[1],p[0]);
-                    return point;
-                }),ride.title,ride.address,ride.id );
+                var line = happy_line(decode_polyline(ride.polyline),
+                                      ride.title, ride.address, ride.id);
                 google.maps.event.addListener(line, 'click', function(e) {
                     window.location = "/rides/"+ride.id+"/";
                 });
@@ -293,6 +291,30 @@ var rides_init;
         });
     }
 
+    // turns google's encoded polyline format into a list of LatLngs
+    function decode_polyline(encoded) {
+        var path = [];
+        var values = [0, 0];
+        var n = 0, result = 0, shift = 0, b, i;
+        for (i = 0; i < encoded.length; i++) {
+            b = encoded.charCodeAt(i) - 63;
+            result |= (b & 0x1f) << shift;
+            if (b < 0x20) {
+                values[n] += (result & 1) ? ~(result >> 1) : (result >> 1);
+                if (n == 1) {
+                    path.push(new google.maps.LatLng(values[0] / 1e5,
+                                                     values[1] / 1e5));
+                }
+                n ^= 1;
+                result = 0;
+                shift = 0;
+            } else {
+                shift += 5;
+            }
+        }
+        return path;
+    }
+
     function happy_line(path,title,info,id) {
 		 var line = new google.maps.Polyline({
 				map: map,
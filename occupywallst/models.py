@@ -17,29 +17,35 @@ import socket
 import logging
 import functools
 from hashlib import sha256
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 
-from django.db.models import Q
+from django.db.models import Q, F
+from django.db import transaction, IntegrityError
 from django.conf import settings
 from django.core.cache import cache
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point, LineString
 from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils.encoding import smart_str
+from django.utils.safestring import mark_safe
+from django.utils.timezone import utc
 from django.template.defaultfilters import slugify
 
 from imagekit.models import ImageSpec
 from taggit.managers import TaggableManager
 
-from occupywallst.utils import jsonify
-from occupywallst import geo
+from occupywallst.utils import (jsonify, cached, cached_many, uncache,
+                                get_version, bump_version, LocalCache)
 
 
 logger = logging.getLogger(__name__)
 rng = open('/dev/urandom')
+_verbiage_memo = LocalCache(500, 60 * 5)
+_missing = object()
+_absent = object()
 
 
 def base36(amt=7):
@@ -47,25 +53,15 @@ def base36(amt=7):
     return ''.join([choices[ord(b) % 36] for b in rng.read(amt)])
 
 def mangle_comments(comments, user, ip=None, article=None):
+    from occupywallst import votes
     comments = comments[:]
+    if article:
+        myvotes = votes.lookup_article(user, article.id)
+    else:
+        myvotes = votes.lookup(user, comments)
     for c in comments:
-        c.upvoted = False
-        c.downvoted = False
-    if user and user.id:
-        comhash = dict([(c.id, c) for c in comments])
-        if article:
-            blah = (CommentVote.objects
-                    .filter(user=user, comment__article=article))
-        else:
-            blah = (CommentVote.objects
-                    .filter(user=user, comment__in=comments))
-        for vote in blah:
-            comid = vote.comment_id
-            if comid in comhash:
-                if vote.vote == 1:
-                    comhash[comid].upvoted = True
-                elif vote.vote == -1:
-                    comhash[comid].downvoted = True
+        c.upvoted = (myvotes.get(c.id) == 1)
+        c.downvoted = (myvotes.get(c.id) == -1)
     if user and user.id:
         for com in comments:
             if com.is_removed:
@@ -208,8 +204,9 @@ class Verbiage(models.Model):
 
     def save(self):
         super(Verbiage, self).save()
-        for language in [None] + [a for a, b in settings.LANGUAGES]:
-            cache.delete(Verbiage._make_key(self.name, language))
+        uncache(*[Verbiage._make_key(self.name, language)
+                  for language in [None] + [a for a, b in settings.LANGUAGES]])
+        bump_version('verbiage')
 
     def get_absolute_url(self):
         if self.name.startswith('/'):
@@ -224,25 +221,66 @@ class Verbiage(models.Model):
 
     @staticmethod
     def get(name, language=None):
-        key = Verbiage._make_key(name, language)
-        res = cache.get(key)
-        if res is None:
-            verb = Verbiage.objects.get(name=name)
-            try:
-                verb = verb.translations.get(language=language)
-            except ObjectDoesNotExist:
-                pass
-            if verb.use_markdown:
-                from occupywallst.templatetags.ows import markup_unsafe
-                res = markup_unsafe(verb.content)
-            elif verb.use_template:
-                from django.template import Template
-                res = Template(verb.content)
-            else:
-                res = verb.content
-            cache.set(key, res)
+        return cached(Verbiage._make_key(name, language),
+                      lambda: Verbiage._load(name, language), 60 * 60)
+
+    @staticmethod
+    def version():
+        return get_version('verbiage')
+
+    @staticmethod
+    def get_many(names, language=None, version=None):
+        """Returns dict of verbiage for the names that exist
+
+        Results are memoized in process for a few minutes keyed on the
+        ``verbiage`` version counter, which is bumped whenever verbiage
+        is saved.  Pass ``version`` if you already fetched it with
+        :py:meth:`version` so this doesn't have to touch memcached at
+        all.  Otherwise anything not memoized is fetched with a single
+        ``get_many``.
+        """
+        if version is None:
+            version = Verbiage.version()
+        res = {}
+        missing = []
+        for name in names:
+            val = _verbiage_memo.get((version, name, language), _missing)
+            if val is _missing:
+                missing.append(name)
+            elif val is not _absent:
+                res[name] = val
+        if not missing:
+            return res
+        keys = dict((Verbiage._make_key(name, language), name)
+                    for name in missing)
+        for key, val in cached_many(keys.keys()).items():
+            res[keys[key]] = val
+        for name in missing:
+            if name not in res:
+                try:
+                    res[name] = Verbiage.get(name, language)
+                except ObjectDoesNotExist:
+                    _verbiage_memo.set((version, name, language), _absent)
+                    continue
+            _verbiage_memo.set((version, name, language), res[name])
         return res
 
+    @staticmethod
+    def _load(name, language):
+        verb = Verbiage.objects.get(name=name)
+        try:
+            verb = verb.translations.get(language=language)
+        except ObjectDoesNotExist:
+            pass
+        if verb.use_markdown:
+            from occupywallst.templatetags.ows import markup_unsafe
+            return markup_unsafe(verb.content)
+        elif verb.use_template:
+            from django.template import Template
+            return Template(verb.content)
+        else:
+            return verb.content
+
 
 class VerbiageTranslation(models.Model):
     verbiage = models.ForeignKey(Verbiage, related_name='translations')
@@ -257,7 +295,8 @@ class VerbiageTranslation(models.Model):
 
     def save(self):
         super(VerbiageTranslation, self).save()
-        cache.delete(Verbiage._make_key(self.name, self.language))
+        uncache(Verbiage._make_key(self.name, self.language))
+        bump_version('verbiage')
 
 
 class UserInfo(models.Model):
@@ -423,7 +462,7 @@ class Article(models.Model):
     slug = models.SlugField(unique=True, help_text="""
         A label for this article to appear in the url.  DO NOT change
         this once the article has been published.""")
-    published = models.DateTimeField(help_text="""
+    published = models.DateTimeField(db_index=True, help_text="""
         When was article was published?""")
     killed = models.DateTimeField(auto_now_add=True, help_text="""
         When was the last comment made?""")
@@ -441,6 +480,14 @@ class Article(models.Model):
         Indicates this a thread on the message board forum.""")
     is_deleted = models.BooleanField(default=False, help_text="""
         Flag to indicate should no longer be shown on site.""")
+    html = models.TextField(blank=True, editable=False, help_text="""
+        Content rendered by markdown, see :py:mod:`rendering`.""")
+    html_version = models.IntegerField(default=0, editable=False,
+                                       help_text="""
+        Version of the renderer that produced ``html`` and
+        ``synopsis``.""")
+    synopsis = models.TextField(blank=True, editable=False, help_text="""
+        First few words of content as plain text.""")
     ip = models.CharField(max_length=255, blank=True)
 
     # hacks to make method naming more compatible with other models :(
@@ -463,6 +510,78 @@ class Article(models.Model):
             qset = qset.filter(is_visible=True)
         return qset
 
+    def __init__(self, *args, **kwargs):
+        super(Article, self).__init__(*args, **kwargs)
+        if self.pk is None:
+            self._archived = (None, None, False)  # not in the archive yet
+        else:
+            self._archived = self._archive_key()
+        self._title = self.title
+        self._source = self._render_key()
+
+    def _archive_key(self):
+        return (self.is_forum, self.published,
+                bool(self.is_visible and not self.is_deleted))
+
+    def _render_key(self):
+        return (self.content, self.allow_html, self.is_forum)
+
+    def save(self, *args, **kwargs):
+        """Saves article and keeps caches up to date
+
+        This renders the content if it changed, updates
+        :py:class:`ArchiveDay` and purges cached pages showing the
+        article.  Pages listing recent articles, and archive pages of
+        the month it's in, are only purged if the article appeared,
+        disappeared, moved, got renamed or was edited.
+        """
+        from occupywallst import pagecache, rendering
+        source = self._render_key()
+        edited = source != self._source
+        if self.html_version != rendering.VERSION or edited:
+            self.html = rendering.render_article(self)
+            self.synopsis = rendering.render_synopsis(self)
+            self.html_version = rendering.VERSION
+            self._source = source
+        super(Article, self).save(*args, **kwargs)
+        old, new = self._archived, self._archive_key()
+        tags = self.cache_tags()
+        listed = edited
+        if old != new:
+            if old[1] and old[2]:
+                ArchiveDay.adjust(old[0], old[1], -1)
+            if new[1] and new[2]:
+                ArchiveDay.adjust(new[0], new[1], +1)
+            self._archived = new
+            tags.append('recent')
+            listed = True
+        if self.title != self._title:
+            self._title = self.title
+            tags.append('recent')
+            listed = True
+        pagecache.purge(*set(tags))
+        if listed:
+            for published in set([old[1], new[1]]):
+                if published:
+                    ArchiveDay.bump_month(published)
+
+    @property
+    def content_html(self):
+        """Returns content rendered as html"""
+        from occupywallst import rendering
+        if self.html_version != rendering.VERSION:
+            return rendering.render_article(self)
+        return mark_safe(self.html)
+
+    def get_synopsis(self, max_words=10, max_chars=None):
+        from occupywallst import rendering
+        return rendering.synopsis(self, max_words, max_chars)
+
+    def cache_tags(self):
+        """Returns tags of cached pages showing this article"""
+        return ['article:%d' % (self.id),
+                'forum' if self.is_forum else 'index']
+
     def __unicode__(self):
         name = self.author.username if self.author else 'anonymous'
         if self.is_forum:
@@ -508,13 +627,10 @@ class Article(models.Model):
         return res
 
     @staticmethod
-    def recalculate():
-        for art in Article.objects.all():
-            art.comment_count = (art.comment_set
-                                 .filter(is_deleted=False,
-                                         is_removed=False)
-                                 .count())
-            art.save()
+    def recalculate(since=None):
+        """Fixes ``comment_count`` fields, see :py:mod:`recalc`"""
+        from occupywallst import recalc
+        return recalc.recalculate(['articles'], since=since)['articles']
 
     def comments_as_user(self, user, ip=None):
         """Return comments with respect to a user's votes
@@ -552,6 +668,7 @@ class Article(models.Model):
         else:
             self.content = trans.content
             self.title = trans.title
+            self.html_version = None  # stored stuff isn't translated
         self.__translated = True
 
     @property
@@ -561,6 +678,96 @@ class Article(models.Model):
         return self._taggies
 
 
+class ArchiveDay(models.Model):
+    """Number of visible articles published on each day (in UTC)
+
+    This lets the archive pages list months and days without scanning
+    the article table.  It's updated by :py:meth:`Article.save`.  If
+    you change ``is_visible`` with a bulk update, call
+    :py:meth:`recount` afterwards.
+    """
+    is_forum = models.BooleanField(default=False)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("is_forum", "day")
+
+    @staticmethod
+    def _day(published):
+        if published.tzinfo:
+            published = published.astimezone(utc)
+        return published.date()
+
+    @staticmethod
+    def _upsert(is_forum, day, count, initial):
+        """Updates ``count`` of a day, creating it with ``initial``"""
+        qset = ArchiveDay.objects.filter(is_forum=is_forum, day=day)
+        if qset.update(count=count):
+            return
+        # someone else might be creating the same day right now
+        managed = transaction.is_managed()
+        if managed:
+            sid = transaction.savepoint()
+        try:
+            ArchiveDay.objects.create(is_forum=is_forum, day=day,
+                                      count=initial)
+        except IntegrityError:
+            if managed:
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.rollback_unless_managed()
+            qset.update(count=count)
+        else:
+            if managed:
+                transaction.savepoint_commit(sid)
+
+    @staticmethod
+    def adjust(is_forum, published, delta):
+        day = ArchiveDay._day(published)
+        ArchiveDay._upsert(is_forum, day, F('count') + delta, max(delta, 0))
+        bump_version('archive')
+
+    @staticmethod
+    def recount(articles):
+        """Counts articles on the days of ``(is_forum, published)`` pairs"""
+        for is_forum, day in set((f, ArchiveDay._day(p))
+                                 for f, p in articles):
+            start = datetime(day.year, day.month, day.day, tzinfo=utc)
+            count = (Article.objects
+                     .filter(is_forum=is_forum, is_visible=True,
+                             is_deleted=False, published__gte=start,
+                             published__lt=start + timedelta(days=1))
+                     .count())
+            ArchiveDay._upsert(is_forum, day, count, count)
+            ArchiveDay.bump_month(start)
+        bump_version('archive')
+
+    @staticmethod
+    def days(is_forum):
+        """Returns list of days with articles, most recent first"""
+        key = 'archive:days:%d:%d' % (is_forum, get_version('archive'))
+        res = cache.get(key)
+        if res is None:
+            res = list(ArchiveDay.objects
+                       .filter(is_forum=is_forum, count__gt=0)
+                       .order_by('-day')
+                       .values_list('day', flat=True))
+            cache.set(key, res, 60 * 60 * 24)
+        return res
+
+    @staticmethod
+    def month_version(published):
+        """Version counter for caching archive pages of a month"""
+        day = ArchiveDay._day(published)
+        return get_version('archive:%d-%d' % (day.year, day.month))
+
+    @staticmethod
+    def bump_month(published):
+        day = ArchiveDay._day(published)
+        bump_version('archive:%d-%d' % (day.year, day.month))
+
+
 class ArticleTranslation(models.Model):
     article = models.ForeignKey(Article)
     language = models.CharField(max_length=255, choices=settings.LANGUAGES)
@@ -633,6 +840,14 @@ class Comment(models.Model):
         Flag to indicate a moderator removed the comment.""")
     is_deleted = models.BooleanField(default=False, help_text="""
         Flag to indicate user deleted thier comment.""")
+    html = models.TextField(blank=True, editable=False, help_text="""
+        Content rendered by markdown, see :py:mod:`rendering`.""")
+    html_version = models.IntegerField(default=0, editable=False,
+                                       help_text="""
+        Version of the renderer that produced ``html`` and
+        ``synopsis``.""")
+    synopsis = models.TextField(blank=True, editable=False, help_text="""
+        First few words of content as plain text.""")
     ip = models.CharField(max_length=255, blank=True)
 
     replies = ()
@@ -648,6 +863,13 @@ class Comment(models.Model):
             qset = qset.filter(is_removed=False)
         return qset
 
+    def __init__(self, *args, **kwargs):
+        super(Comment, self).__init__(*args, **kwargs)
+        self._source = self._render_key()
+
+    def _render_key(self):
+        return (self.content, self.user_id)
+
     def __unicode__(self):
         name = self.user.username if self.user else 'anonymous'
         return "%s's comment on %s" % (name, self.article.slug)
@@ -655,6 +877,32 @@ class Comment(models.Model):
     def full_text(self):
         return self.content
 
+    def save(self, *args, **kwargs):
+        """Saves comment, rendering it only if the content changed"""
+        from occupywallst import commenttree, pagecache, rendering
+        source = self._render_key()
+        if (self.html_version != rendering.VERSION or
+            source != self._source):
+            self.html = rendering.render_comment(self)
+            self.synopsis = rendering.render_synopsis(self)
+            self.html_version = rendering.VERSION
+            self._source = source
+        super(Comment, self).save(*args, **kwargs)
+        commenttree.invalidate(self.article_id)
+        pagecache.purge('forum')
+
+    @property
+    def content_html(self):
+        """Returns content rendered as html"""
+        from occupywallst import rendering
+        if self.html_version != rendering.VERSION:
+            return rendering.render_comment(self)
+        return mark_safe(self.html)
+
+    def get_synopsis(self, max_words=10, max_chars=None):
+        from occupywallst import rendering
+        return rendering.synopsis(self, max_words, max_chars)
+
     def delete(self):
         self.user = None
         self.content = ""
@@ -668,48 +916,49 @@ class Comment(models.Model):
         return "%s#comment-%d" % (self.article.get_forum_url(), self.id)
 
     def upvote(self, user):
-        if user and user.id:
-            try:
-                vote = CommentVote.objects.get(comment=self, user=user)
-            except ObjectDoesNotExist:
-                vote = CommentVote(comment=self, user=user)
-            if vote.vote == 1:
-                return vote
-            elif vote.vote == -1:
-                self.downs -= 1
-            vote.vote = 1
-            vote.save()
-        self.ups += 1
-        self.karma = self.ups - self.downs
-        self.save()
+        return self._vote(user, 1)
 
     def downvote(self, user):
+        return self._vote(user, -1)
+
+    def _vote(self, user, value):
+        """Records a vote and adjusts the karma counters
+
+        The counters are changed with a relative update (see
+        :py:func:`occupywallst.votes.tally`) rather than saving the
+        whole row so a burst of votes can't clobber each other.
+        """
+        from occupywallst import votes
+        dups, ddowns = 0, 0
         if user and user.id:
             try:
                 vote = CommentVote.objects.get(comment=self, user=user)
             except ObjectDoesNotExist:
                 vote = CommentVote(comment=self, user=user)
-            if vote.vote == 1:
-                self.ups -= 1
-            elif vote.vote == -1:
+            if vote.vote == value:
                 return vote
-            vote.vote = -1
+            elif vote.vote == 1:
+                dups -= 1
+            elif vote.vote == -1:
+                ddowns -= 1
+            vote.vote = value
             vote.save()
-        self.downs += 1
-        self.karma = self.ups - self.downs
-        self.save()
+            votes.record(user.id, self.article_id, self.id, value)
+        if value == 1:
+            dups += 1
+        else:
+            ddowns += 1
+        votes.tally(self, dups, ddowns)
 
     @property
     def is_worthless(self):
         return self.karma <= settings.OWS_WORTHLESS_COMMENT_THRESHOLD
 
     @staticmethod
-    def recalculate():
-        for ct in Comment.objects.all():
-            ct.ups = CommentVote.objects.filter(comment=ct, vote=1).count()
-            ct.downs = CommentVote.objects.filter(comment=ct, vote=-1).count()
-            ct.karma = ct.ups - ct.downs
-            ct.save()
+    def recalculate(since=None):
+        """Fixes vote counter fields, see :py:mod:`recalc`"""
+        from occupywallst import recalc
+        return recalc.recalculate(['comments'], since=since)['comments']
 
     def as_dict(self, moar={}):
         res = {'id': self.id,
@@ -755,11 +1004,14 @@ class CommentVote(models.Model):
         except ObjectDoesNotExist:
             return None
 
+    KEEP_DAYS = 30
+
     @staticmethod
-    def prune(days_old=30):
+    def prune(days_old=KEEP_DAYS):
         """Removes old records to speed up database
 
-        This does not affect karma fields in Comment table.
+        This does not affect karma fields in Comment table, which is
+        why :py:mod:`occupywallst.recalc` leaves old comments alone.
         """
         cutoff = date.today() - timedelta(days=days_old)
         CommentVote.objects.filter(time__lte=cutoff).delete()
@@ -774,6 +1026,25 @@ class CommentVote(models.Model):
         return res
 
 
+class VoteFlush(models.Model):
+    """Records batches of buffered votes that were written out
+
+    See :py:func:`occupywallst.votes.flush`.  A row is inserted in the
+    same transaction that applies the batch, so if we die before
+    telling redis it's done, the next flush knows not to apply it
+    again.  Rows are only needed for a little while.
+    """
+    batch = models.CharField(max_length=32, unique=True, help_text="""
+        Random id given to the batch when it was taken off the
+        buffer.""")
+    created = models.DateTimeField(auto_now_add=True)
+
+    KEEP_DAYS = 1
+
+    def __unicode__(self):
+        return self.batch
+
+
 class Message(models.Model):
     """One user sending a message to another"""
     from_user = models.ForeignKey(User, editable=False,
@@ -822,6 +1093,10 @@ class SpamText(models.Model):
     is_regex = models.BooleanField(default=False, help_text="""
          Should text be interpreted as a perl-compatible regular
          expression?""")
+    hits = models.IntegerField(default=0, editable=False, help_text="""
+         Number of times this rule matched something a user posted,
+         including edits.""")
+    last_hit = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __unicode__(self):
         return "%s%s" % (self.text, ' (regex)' if self.is_regex else '')
@@ -835,10 +1110,21 @@ class SpamText(models.Model):
 
     @staticmethod
     def is_spam(msg):
-        for spamtext in SpamText.objects.all():
-            if spamtext.match(msg):
-                return True
-        return False
+        return SpamText.check(msg) is not None
+
+    @staticmethod
+    def check(msg):
+        """Returns id of spam rule matching msg, or ``None``"""
+        from occupywallst import spam
+        return spam.check(msg)
+
+
+@receiver(post_save, sender=SpamText)
+@receiver(post_delete, sender=SpamText)
+def _spamtext_changed(sender, **kwargs):
+    from occupywallst import spam
+    spam.invalidate()
+
 
 class Pledge(models.Model):
     name = models.CharField(max_length=40)
@@ -884,3 +1170,26 @@ class Pledge(models.Model):
             return ' and '.join(res)
         else:
             return '%s, and %s' % (", ".join(res[:-1]), res[-1])
+
+
+class GeoCache(models.Model):
+    """Responses from the geocoding service, see :py:mod:`occupywallst.geo`
+    """
+    KIND_CHOICES = (
+        ('geocode', 'Geocode'),
+        ('directions', 'Directions'),
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    digest = models.CharField(max_length=40, help_text="""
+        SHA1 of query.""")
+    query = models.TextField(help_text="""
+        Normalized address, or waypoints separated by pipes.""")
+    response = models.TextField(help_text="""
+        What the service said, as JSON.""")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("kind", "digest")
+
+    def __unicode__(self):
+        return "%s: %s" % (self.kind, self.query)
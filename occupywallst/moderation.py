@@ -0,0 +1,175 @@
+r"""
+
+    occupywallst.moderation
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Background spam classification of forum posts.
+
+    Asking the bayesian filter about a post means a bunch of redis
+    round trips per word, so we don't want it on the request path.
+    When a post is saved, :py:func:`submit` queues a :py:mod:`jobs`
+    task that runs the title heuristics and the classifier.  If it
+    thinks the post is spam, the post gets removed after the fact.
+    Training the filter when moderators remove or unremove stuff goes
+    through the same queue.
+
+    Retries, dead letters and crash recovery are handled by
+    :py:mod:`jobs`, so this only needs ``OWS_JOB_QUEUE`` and
+    ``occupywallst jobworker``.  A classify job for a post that isn't
+    committed yet raises and gets retried.  If the queue is disabled
+    the jobs run right away in the current process.  That's what the
+    tests use.
+
+"""
+
+import re
+import time
+import logging
+
+import redis
+from django.conf import settings
+from django.db.models import F
+
+from occupywallst import bayes, commenttree, jobs, pagecache, models as db
+
+
+logger = logging.getLogger(__name__)
+REDBAY = bayes.get_backend()
+STATS_KEY = 'ows:spam:stats'
+MODELS = {'article': db.Article, 'comment': db.Comment}
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis()
+    return _redis
+
+
+def is_spammy_title(title):
+    """Heuristics for stuff like pirated tv show links"""
+    letters = re.sub('[^a-z]', '', title.lower())
+    for word in ('watch', 'episode', 'streaming', 'download'):
+        if word in letters:
+            return True
+    if re.match(r's\d\de\d\d', title.lower()):
+        return True
+    if ' HD ' in title:
+        return True
+    return False
+
+
+def submit(op, post):
+    """Queues ``'classify'``, ``'train'`` or ``'untrain'`` for a post
+
+    Training jobs carry the text as it is right now so the filter
+    learns what the moderator actually saw.
+    """
+    model = 'article' if isinstance(post, db.Article) else 'comment'
+    if op == 'classify':
+        jobs.submit(classify, model, post.id)
+    else:
+        jobs.submit(train, 'bad' if op == 'train' else 'good',
+                    post.full_text())
+
+
+def _remove(post):
+    """Removes post without clobbering concurrent edits"""
+    if isinstance(post, db.Article):
+        db.Article.objects.filter(id=post.id).update(is_visible=False)
+        db.ArchiveDay.recount([(post.is_forum, post.published)])
+        pagecache.purge('recent', *post.cache_tags())
+        return
+    if not (db.Comment.objects
+            .filter(id=post.id, is_removed=False)
+            .update(is_removed=True)):
+        return
+    if not post.is_deleted:
+        (db.Article.objects
+         .filter(id=post.article_id)
+         .update(comment_count=F('comment_count') - 1))
+    commenttree.invalidate(post.article_id)
+    pagecache.purge('forum')
+
+
+def _classify(post, stats):
+    """Removes post if it looks like spam
+
+    Returns true if the post was removed.
+    """
+    if post.is_removed or post.is_deleted or not post.user:
+        return False
+    userinfo = post.user.userinfo
+    if userinfo.can_moderate():
+        return False
+    if hasattr(post, 'title') and is_spammy_title(post.title):
+        _remove(post)
+        _train('bad', post.full_text())
+        return True
+    bayes.refresh(REDBAY)
+    start = time.time()
+    try:
+        bclass = REDBAY.classify(post.full_text())
+    except redis.ConnectionError:
+        bclass = 'good'
+    stats['classified'] += 1
+    stats['classify_ms_total'] += int((time.time() - start) * 1000)
+    if bclass == 'bad' and userinfo.karma < settings.OWS_KARMA_THRESHOLD:
+        _remove(post)
+        return True
+    return False
+
+
+def _train(bclass, text):
+    bayes.learn(REDBAY, bclass, text)
+
+
+def _record(stats):
+    if not settings.OWS_JOB_QUEUE:
+        return
+    try:
+        pipe = _get_redis().pipeline()
+        for key, val in stats.items():
+            pipe.hincrby(STATS_KEY, key, val)
+        pipe.execute()
+    except redis.ConnectionError:
+        pass
+
+
+@jobs.task
+def classify(model, post_id):
+    """Runs the spam filter on a post and removes it if it's spam"""
+    cls = MODELS[model]
+    related = 'author__userinfo' if cls is db.Article else 'user__userinfo'
+    try:
+        post = cls.objects.select_related(related).get(id=post_id)
+    except cls.DoesNotExist:
+        raise LookupError('%s %d missing' % (model, post_id))
+    stats = {'classified': 0, 'classify_ms_total': 0, 'removed': 0}
+    if _classify(post, stats):
+        stats['removed'] += 1
+        logger.info('auto-removed %s %d', model, post_id)
+    _record(stats)
+
+
+@jobs.task
+def train(bclass, text):
+    """Teaches the spam filter that ``text`` is ``bclass``"""
+    _train(bclass, text)
+
+
+def filter_stats():
+    """Returns metrics about the spam filter
+
+    ``classify_ms_avg`` is how long the bayesian filter takes per post
+    and ``removed`` how many posts it took down.  Queue depth and
+    latency are in :py:func:`jobs.queue_stats`.
+    """
+    conn = _get_redis()
+    stats = dict((k, int(v)) for k, v in conn.hgetall(STATS_KEY).items())
+    for key in ('classified', 'classify_ms_total', 'removed'):
+        stats.setdefault(key, 0)
+    stats['classify_ms_avg'] = (stats['classify_ms_total'] /
+                                (stats['classified'] or 1))
+    return stats
@@ -0,0 +1,96 @@
+r"""
+
+    occupywallst.pagecache
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Caching of whole pages for anonymous users.
+
+    Each cached page depends on some tags like ``article:123``,
+    ``forum``, ``index`` or ``rides``.  When something changes, call
+    :py:func:`purge` with its tags and every page depending on them
+    gets re-rendered on the next hit, while other workers serve the
+    old copy for the moment that takes.  This means pages can stay in
+    the cache for hours without going stale.
+
+    Tags are version counters in memcached (see
+    :py:func:`utils.get_version`) and each entry remembers which
+    versions it was rendered with.  A hit costs one extra
+    ``get_many`` to check they're still current.
+
+    Views can add tags they only learn while rendering, like the id
+    of an article looked up by slug, to ``request.cache_tags``.
+
+"""
+
+from hashlib import sha256
+from functools import wraps
+
+from django.core.cache import cache
+
+from occupywallst import utils
+
+
+TIMEOUT = 60 * 60 * 6
+
+
+def _tag(tag):
+    return 'tag:' + tag
+
+
+def purge(*tags):
+    """Invalidates all pages depending on any of these tags"""
+    for tag in tags:
+        utils.bump_version(_tag(tag))
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def _fresh(entry):
+    response, versions = entry
+    return utils.get_versions(versions.keys()) == versions
+
+
+def cache_page(mkkey, tags=(), seconds=TIMEOUT, early=False):
+    """Decorator that caches a view for anonymous users
+
+    ``mkkey`` and ``tags`` (if callable) get the same arguments as the
+    view.  Only successful responses are cached.  If a page is stale,
+    one worker re-renders it while the others keep serving the old
+    copy, see :py:func:`utils.cached`.  ``early`` enables refreshing
+    hot pages before they expire.
+    """
+    def _cache_page(function):
+        @wraps(function)
+        def __cache_page(request, *args, **kwargs):
+            if callable(tags):
+                request.cache_tags = set(tags(request, *args, **kwargs))
+            else:
+                request.cache_tags = set(tags)
+            if request.user.is_authenticated():
+                return function(request, *args, **kwargs)
+
+            def render():
+                # read versions before rendering so a purge that
+                # happens while we render isn't lost
+                versions = utils.get_versions(
+                    [_tag(tag) for tag in request.cache_tags])
+                response = function(request, *args, **kwargs)
+                if response.status_code != 200:
+                    raise _Uncacheable(response)
+                added = [_tag(tag) for tag in request.cache_tags
+                         if _tag(tag) not in versions]
+                versions.update(utils.get_versions(added))
+                return (response, versions)
+
+            key = 'page:' + sha256(mkkey(request, *args, **kwargs) + ':' +
+                                   request.LANGUAGE_CODE).hexdigest()
+            try:
+                return utils.cached(key, render, seconds, early=early,
+                                    fresh=_fresh)[0]
+            except _Uncacheable, exc:
+                return exc.response
+        return __cache_page
+    return _cache_page
@@ -0,0 +1,111 @@
+r"""
+
+    occupywallst.polyline
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Google's encoded polyline format.
+
+    See http://code.google.com/apis/maps/documentation/polylinealgorithm.html
+
+    Each coordinate is rounded to five decimal places, delta encoded
+    against the previous one and written as a base64-ish varint, so a
+    driving route takes a few bytes per point instead of the forty or
+    so it takes as JSON.  This is how Google gives us routes and it's
+    what we send browsers in ``rides_get``.
+
+    Decoded coordinates are flat ``array('d')`` buffers in the order
+    they appear in the encoding, i.e. ``[lat, lng, lat, lng, ...]``.
+    :py:func:`linestring` turns one into a GEOS geometry by way of WKB
+    so we never build a tuple per point.
+
+"""
+
+import sys
+import struct
+from array import array
+
+from django.contrib.gis.geos import GEOSGeometry
+
+
+PRECISION = 1e5
+WKB_ORDER = 1 if sys.byteorder == 'little' else 0
+
+
+def decode(encoded, coords=None):
+    """Decodes polyline into flat array of lat/lng floats
+
+    If ``coords`` is an array the values are appended to it instead.
+    ``encoded`` may be unicode, which is what we get out of JSON.
+    """
+    if isinstance(encoded, unicode):
+        encoded = encoded.encode('ascii')
+    if coords is None:
+        coords = array('d')
+    append = coords.append
+    values = [0, 0]
+    n = 0
+    result = 0
+    shift = 0
+    for b in bytearray(encoded):
+        b -= 63
+        result |= (b & 0x1f) << shift
+        if b < 0x20:
+            values[n] += ~(result >> 1) if result & 1 else result >> 1
+            append(values[n] / PRECISION)
+            n ^= 1
+            result = 0
+            shift = 0
+        else:
+            shift += 5
+    return coords
+
+
+def decode_many(encodeds):
+    """Decodes list of polylines into one array
+
+    Returns ``(coords, offsets)`` where the points of the ``i``th
+    polyline are ``coords[offsets[i]:offsets[i + 1]]``.
+    """
+    coords = array('d')
+    offsets = array('l', [0])
+    for encoded in encodeds:
+        decode(encoded, coords)
+        offsets.append(len(coords))
+    return coords, offsets
+
+
+def encode(coords):
+    """Encodes flat sequence of lat/lng floats as a polyline"""
+    res = []
+    prev = [0, 0]
+    for n, value in enumerate(coords):
+        value = int(round(value * PRECISION))
+        delta = value - prev[n & 1]
+        prev[n & 1] = value
+        delta = ~(delta << 1) if delta < 0 else delta << 1
+        while delta >= 0x20:
+            res.append(chr((0x20 | (delta & 0x1f)) + 63))
+            delta >>= 5
+        res.append(chr(delta + 63))
+    return ''.join(res)
+
+
+def encode_linestring(line):
+    """Encodes a GEOS LineString (which is lng/lat) as a polyline"""
+    coords = array('d')
+    for lng, lat in line.coords:
+        coords.append(lat)
+        coords.append(lng)
+    return encode(coords)
+
+
+def linestring(coords, srid=4326):
+    """Returns GEOS LineString of a flat lat/lng array
+
+    GEOS wants lng/lat so we swap each pair in place on a copy and
+    hand the buffer over as well-known binary.
+    """
+    xy = array('d', coords)
+    xy[0::2], xy[1::2] = xy[1::2], xy[0::2]
+    wkb = struct.pack('=BII', WKB_ORDER, 2, len(xy) // 2) + xy.tostring()
+    return GEOSGeometry(buffer(wkb), srid=srid)
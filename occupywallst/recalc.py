@@ -0,0 +1,226 @@
+r"""
+
+    occupywallst.recalc
+    ~~~~~~~~~~~~~~~~~~~
+
+    Set-based recalculation of denormalized counter fields.
+
+    We store a few counters so listing pages don't have to count
+    stuff: ``Article.comment_count``, ``Comment.ups/downs/karma`` and
+    ``UserInfo.karma``.  These can drift if users get purged or a bug
+    happens.  This module recomputes them with one aggregate ``UPDATE
+    ... FROM (SELECT ... GROUP BY)`` per chunk of rows rather than a
+    ``COUNT`` and ``save()`` per row.  Only rows whose counters are
+    actually wrong get written.
+
+    Votes older than ``CommentVote.KEEP_DAYS`` get pruned, so we can
+    only recount the votes of comments newer than that.  Older
+    comments keep the counters they have.
+
+    If you pass ``since`` then only rows touched since that time are
+    considered, which is what you want from cron:
+
+    - comments published or voted on since then.
+    - users who wrote one of those comments.
+    - articles published or commented on since then.
+
+    Use ``occupywallst recalculate`` to run this from the command line.
+
+"""
+
+from django.db import connection, transaction
+
+from occupywallst import models as db
+
+
+CHUNK = 5000
+
+
+class Counter(object):
+    """Describes how to recompute counter fields on a table
+
+    ``real`` is a query selecting the primary key and correct value of
+    each field for rows with a primary key in some range.  It must
+    contain ``{touched}`` which gets replaced with ``touched`` when
+    we're running incrementally.  ``touched`` refers to the table as
+    ``alias`` and must use ``%(since)s`` for its placeholders.
+    """
+
+    def __init__(self, name, model, alias, fields, real, touched):
+        self.name = name
+        self.model = model
+        self.alias = alias
+        self.fields = fields
+        self.real = real
+        self.touched = touched
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    def _real(self, since):
+        touched = self.touched if since else ''
+        return self.real.format(touched=touched)
+
+    def _params(self, since, *args):
+        res = list(args)
+        if since:
+            res += [since] * self.touched.count('%(since)s')
+        return res
+
+    def _differs(self):
+        return " OR ".join("t.%s != v.%s" % (f, f) for f in self.fields)
+
+    def bounds(self, since=None):
+        """Returns lowest and highest primary key we need to look at"""
+        sql = "SELECT min(%s.id), max(%s.id) FROM %s AS %s WHERE TRUE %s" % (
+            self.alias, self.alias, self.table, self.alias,
+            self.touched if since else '')
+        cursor = connection.cursor()
+        cursor.execute(sql.replace('%(since)s', '%s'), self._params(since))
+        return cursor.fetchone()
+
+    def diff(self, lo, hi, since=None):
+        """Returns list of ``(id, {field: (old, new)})`` for wrong rows"""
+        sql = """
+            SELECT t.id, %s, %s
+              FROM %s AS t
+              JOIN (%s) AS v ON t.id = v.id
+             WHERE %s
+             ORDER BY t.id
+        """ % (", ".join("t." + f for f in self.fields),
+               ", ".join("v." + f for f in self.fields),
+               self.table, self._real(since), self._differs())
+        cursor = connection.cursor()
+        cursor.execute(sql.replace('%(since)s', '%s'),
+                       self._params(since, lo, hi))
+        res = []
+        n = len(self.fields)
+        for row in cursor.fetchall():
+            old, new = row[1:n + 1], row[n + 1:]
+            res.append((row[0], dict((f, (a, b)) for f, a, b
+                                     in zip(self.fields, old, new)
+                                     if a != b)))
+        return res
+
+    def fix(self, lo, hi, since=None):
+        """Corrects wrong rows and returns how many were changed"""
+        sql = """
+            UPDATE %s AS t
+               SET %s
+              FROM (%s) AS v
+             WHERE t.id = v.id AND (%s)
+        """ % (self.table,
+               ", ".join("%s = v.%s" % (f, f) for f in self.fields),
+               self._real(since), self._differs())
+        cursor = connection.cursor()
+        cursor.execute(sql.replace('%(since)s', '%s'),
+                       self._params(since, lo, hi))
+        transaction.set_dirty()
+        return cursor.rowcount
+
+
+# a day less than votes are kept, in case prune runs while we do
+VOTES_INTACT = "now() - interval '%d days'" % (db.CommentVote.KEEP_DAYS - 1)
+
+COMMENTS = Counter(
+    'comments', db.Comment, 'c', ['ups', 'downs', 'karma'], """
+        SELECT c.id,
+               count(CASE WHEN cv.vote = 1 THEN 1 END) AS ups,
+               count(CASE WHEN cv.vote = -1 THEN 1 END) AS downs,
+               coalesce(sum(cv.vote), 0) AS karma
+          FROM occupywallst_comment AS c
+     LEFT JOIN (occupywallst_commentvote AS cv
+                INNER JOIN occupywallst_userinfo AS ui
+                        ON ui.user_id = cv.user_id
+                       AND NOT ui.is_shadow_banned)
+            ON cv.comment_id = c.id
+         WHERE c.id BETWEEN %s AND %s
+           AND c.published >= """ + VOTES_INTACT + """ {touched}
+      GROUP BY c.id
+    """, """
+        AND (c.published >= %(since)s OR
+             EXISTS (SELECT 1 FROM occupywallst_commentvote AS tv
+                      WHERE tv.comment_id = c.id
+                        AND tv.time >= %(since)s))
+    """)
+
+USERS = Counter(
+    'users', db.UserInfo, 'u', ['karma'], """
+        SELECT u.id, coalesce(sum(c.karma), 0) AS karma
+          FROM occupywallst_userinfo AS u
+     LEFT JOIN occupywallst_comment AS c
+            ON c.user_id = u.user_id
+           AND NOT c.is_removed
+           AND NOT c.is_deleted
+         WHERE u.id BETWEEN %s AND %s {touched}
+      GROUP BY u.id
+    """, """
+        AND EXISTS (SELECT 1 FROM occupywallst_comment AS tc
+                     WHERE tc.user_id = u.user_id
+                       AND (tc.published >= %(since)s OR
+                            EXISTS (SELECT 1
+                                      FROM occupywallst_commentvote AS tv
+                                     WHERE tv.comment_id = tc.id
+                                       AND tv.time >= %(since)s)))
+    """)
+
+ARTICLES = Counter(
+    'articles', db.Article, 'a', ['comment_count'], """
+        SELECT a.id, count(c.id) AS comment_count
+          FROM occupywallst_article AS a
+     LEFT JOIN occupywallst_comment AS c
+            ON c.article_id = a.id
+           AND NOT c.is_removed
+           AND NOT c.is_deleted
+         WHERE a.id BETWEEN %s AND %s {touched}
+      GROUP BY a.id
+    """, """
+        AND (a.published >= %(since)s OR
+             EXISTS (SELECT 1 FROM occupywallst_comment AS tc
+                      WHERE tc.article_id = a.id
+                        AND tc.published >= %(since)s))
+    """)
+
+# order matters because user karma is the sum of comment karma
+COUNTERS = [COMMENTS, USERS, ARTICLES]
+
+
+def recalculate(names=None, since=None, chunk=CHUNK, dry_run=False,
+                progress=None):
+    """Recomputes counter fields, optionally only for recent rows
+
+    ``names`` is a list of counters to check, which may contain
+    ``'comments'``, ``'users'`` and ``'articles'``.  The default is
+    all of them.
+
+    Each chunk of ``chunk`` primary keys is fixed in its own
+    transaction.  If ``progress`` is specified it's called after each
+    chunk as ``progress(name, hi, max_id, changed)``.
+
+    If ``dry_run`` is true nothing gets written and the result maps
+    counter names to lists of ``(id, {field: (old, new)})``.
+    Otherwise it maps counter names to the number of rows fixed.
+    """
+    res = {}
+    for counter in COUNTERS:
+        if names and counter.name not in names:
+            continue
+        res[counter.name] = [] if dry_run else 0
+        lo, top = counter.bounds(since)
+        if lo is None:
+            continue
+        while lo <= top:
+            hi = lo + chunk - 1
+            if dry_run:
+                changed = counter.diff(lo, hi, since)
+                res[counter.name] += changed
+                changed = len(changed)
+            else:
+                with transaction.commit_on_success():
+                    changed = counter.fix(lo, hi, since)
+                res[counter.name] += changed
+            if progress:
+                progress(counter.name, min(hi, top), top, changed)
+            lo = hi + 1
+    return res
@@ -0,0 +1,158 @@
+r"""
+
+    occupywallst.rendering
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Stored markdown rendering of articles and comments.
+
+    Running markdown plus our regex hacks for every comment on every
+    page view adds up, so we render posts when they're saved and keep
+    the html in the ``html`` column.  Templates use the
+    ``content_html`` property which returns the stored html.  A plain
+    text synopsis for listings gets stored the same way, see
+    :py:func:`synopsis`.
+
+    Each row remembers which ``VERSION`` of the renderer produced its
+    html.  If you change how markup gets rendered (including
+    :py:func:`occupywallst.templatetags.ows._markup`) bump ``VERSION``
+    and run ``occupywallst rerender`` after deploying.  Until a row
+    gets re-rendered its html is ignored and rendered on the fly, so
+    nothing looks wrong in the meantime.  Pass ``--processes`` to
+    spread the work over several cores.  ``occupywallst benchmark
+    markdown`` shows how much that buys you.
+
+"""
+
+import multiprocessing
+
+from django.utils.safestring import mark_safe
+
+from occupywallst import utils, commenttree, pagecache, models as db
+from occupywallst.templatetags.ows import (markup, markup_unsafe, nofollow,
+                                           strip_annoying_html, excerpt,
+                                           truncate_words)
+
+
+VERSION = 2
+CHUNK = 500
+SYNOPSIS_WORDS = 30
+synopses = utils.LocalCache(5000, 60 * 60)
+
+
+def render_article(article):
+    return _render(_article_args(article))
+
+
+def render_comment(comment):
+    return _render(_comment_args(comment))
+
+
+def render_synopsis(post):
+    """Returns the longest synopsis anyone asks for"""
+    return truncate_words(excerpt(post.content), SYNOPSIS_WORDS, 0)
+
+
+def synopsis(post, max_words=10, max_chars=None):
+    """Returns synopsis of article or comment
+
+    This uses the ``synopsis`` column if it's current.  Otherwise we
+    extract it and keep it in memory for a while keyed by the id of
+    the post and the renderer version.
+    """
+    if max_words > SYNOPSIS_WORDS:
+        text = excerpt(post.content)
+    elif post.html_version == VERSION:
+        text = post.synopsis
+    elif post.id is None or post.html_version is None:
+        text = render_synopsis(post)
+    else:
+        key = (post._meta.db_table, post.id, VERSION)
+        text = synopses.get(key)
+        if text is None:
+            text = render_synopsis(post)
+            synopses.set(key, text)
+    return truncate_words(text, max_words, max_chars)
+
+
+def _article_args(article):
+    if article.allow_html:
+        return (article.content, False, False, False)
+    return (article.content, True, article.is_forum, False)
+
+
+def _comment_args(comment):
+    if comment.user and comment.user.username == 'jart':
+        return (comment.content, False, True, False)
+    return (comment.content, True, True, True)
+
+
+def _render(args):
+    content, safe, follow, strip = args
+    res = markup(content) if safe else markup_unsafe(content)
+    if strip:
+        res = strip_annoying_html(res)
+    if follow:
+        res = nofollow(res)
+    return res
+
+
+def render_many(posts, pool=None):
+    """Renders list of articles or comments, returns list of html
+
+    If ``pool`` is a ``multiprocessing.Pool`` the work gets fanned out
+    to it, which is what you want for re-rendering the whole database.
+    Posts are turned into plain tuples first so workers don't need to
+    touch the database.
+    """
+    args = [_article_args(p) if isinstance(p, db.Article)
+            else _comment_args(p) for p in posts]
+    if pool is None:
+        return [_render(a) for a in args]
+    return [mark_safe(html) for html in pool.map(_render, args)]
+
+
+def rerender(model, chunk=CHUNK, processes=1, progress=None):
+    """Renders rows whose html came from an older renderer
+
+    Rows are updated directly rather than saved so nothing else about
+    them changes.  If ``progress`` is specified it's called after each
+    chunk as ``progress(model, last_id, count)``.  Returns the number
+    of rows rendered.  If ``processes`` is more than one, rendering
+    is spread over that many worker processes.
+    """
+    related = 'author' if model is db.Article else 'user'
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        return _rerender(model, related, chunk, pool, progress)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _rerender(model, related, chunk, pool, progress):
+    total = 0
+    last = 0
+    while True:
+        posts = list(model.objects
+                     .select_related(related)
+                     .filter(id__gt=last)
+                     .exclude(html_version=VERSION)
+                     .order_by('id')[:chunk])
+        if not posts:
+            break
+        for post, html in zip(posts, render_many(posts, pool)):
+            (model.objects
+             .filter(id=post.id)
+             .update(html=html, synopsis=render_synopsis(post),
+                     html_version=VERSION))
+        last = posts[-1].id
+        total += len(posts)
+        if model is db.Comment:
+            for article_id in set(c.article_id for c in posts):
+                commenttree.invalidate(article_id)
+        else:
+            pagecache.purge(*set(t for a in posts for t in a.cache_tags()))
+        if progress:
+            progress(model, last, total)
+    return total
@@ -0,0 +1,133 @@
+r"""
+
+    occupywallst.routers
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Send read-only traffic to database replicas.
+
+    List replica aliases from ``DATABASES`` in ``OWS_DB_REPLICAS``.
+    :py:class:`ReplicaMiddleware` decides per request whether reads
+    may go to a replica, which is the case for ``GET`` and ``HEAD``
+    requests, and picks one so the whole page sees the same snapshot.
+    Writes always go to the primary, and once a request has written
+    something its remaining reads do too.
+
+    Replicas lag behind a bit, so if you post a comment and get sent
+    back to the thread, the thread might not have it yet.  To avoid
+    this, any request that wrote to the database (or wasn't a ``GET``
+    or ``HEAD``) sets a cookie which pins the user to the primary for
+    ``OWS_DB_PIN`` seconds.
+
+    We also ask each replica how far behind it is every few seconds.
+    A replica that has replayed everything it received counts as
+    caught up, even if the primary hasn't written anything for a
+    while.  Ones more than ``OWS_DB_MAX_LAG`` seconds behind, or that can't
+    be reached, aren't used until they catch up.  If none are usable
+    we read from the primary.
+
+    To try this locally, copy ``DATABASES['default']`` to another
+    alias (pointing at the same or a different database) with
+    ``'TEST_MIRROR': 'default'`` and add that alias to
+    ``OWS_DB_REPLICAS``.
+
+"""
+
+import time
+import random
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction, DatabaseError
+
+
+logger = logging.getLogger(__name__)
+PIN_COOKIE = 'dbpin'
+LAG_CHECK_INTERVAL = 5.0
+_state = threading.local()
+_lag = {}
+
+
+def use_replica(flag):
+    """Says whether reads in this thread may go to a replica
+
+    This picks the replica for the rest of the request and returns
+    its alias, or ``None`` if we'll read from the primary.
+    """
+    _state.wrote = False
+    _state.replica = pick_replica() if flag else None
+    return _state.replica
+
+
+def replica_lag(alias):
+    """Returns how many seconds a replica is behind, ``None`` if broken
+
+    This is only checked every ``LAG_CHECK_INTERVAL`` seconds.  A
+    database that isn't a replica has no lag.
+    """
+    now = time.time()
+    checked, lag = _lag.get(alias, (0, None))
+    if now - checked < LAG_CHECK_INTERVAL:
+        return lag
+    try:
+        cursor = connections[alias].cursor()
+        cursor.execute("SELECT CASE WHEN pg_last_xlog_receive_location() ="
+                       "                 pg_last_xlog_replay_location()"
+                       "            THEN 0"
+                       "            ELSE extract(epoch FROM now() -"
+                       "                 pg_last_xact_replay_timestamp())"
+                       "        END")
+        lag = cursor.fetchone()[0] or 0.0
+    except DatabaseError, exc:
+        logger.warning('replica %s unavailable: %s', alias, exc)
+        transaction.rollback_unless_managed(using=alias)
+        lag = None
+    _lag[alias] = (now, lag)
+    return lag
+
+
+def pick_replica():
+    """Returns alias of a usable replica or ``None``"""
+    healthy = []
+    if not settings.OWS_DB_REPLICAS:
+        return None
+    for alias in settings.OWS_DB_REPLICAS:
+        lag = replica_lag(alias)
+        if lag is not None and lag <= settings.OWS_DB_MAX_LAG:
+            healthy.append(alias)
+    if healthy:
+        return random.choice(healthy)
+    return None
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'wrote', False):
+            return None
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_syncdb(self, db, model):
+        return db not in settings.OWS_DB_REPLICAS
+
+
+class ReplicaMiddleware(object):
+    """Lets safe requests read from replicas, pins users who write"""
+
+    def process_request(self, request):
+        use_replica(request.method in ('GET', 'HEAD') and
+                    PIN_COOKIE not in request.COOKIES)
+
+    def process_response(self, request, response):
+        if (getattr(_state, 'wrote', False) or
+            request.method not in ('GET', 'HEAD', 'OPTIONS')):
+            response.set_cookie(PIN_COOKIE, '1',
+                                max_age=settings.OWS_DB_PIN,
+                                httponly=True)
+        return response
@@ -44,6 +44,16 @@ OWS_NOTIFY_PUB_ADDR = ('127.0.0.1', 9010)
 OWS_KARMA_THRESHOLD = 10
 OWS_WORTHLESS_COMMENT_THRESHOLD = -4
 OWS_MAX_SUBSCRIBES = 3
+OWS_COMMENT_TREE_CACHE = 60 * 5  # bounds staleness of "x minutes ago"
+OWS_VOTE_BUFFER = False  # buffer karma in redis, see "occupywallst flushvotes"
+OWS_SPAM_BAYES = None  # path of local spam filter model, None to use redis
+OWS_JOB_QUEUE = False  # run slow side effects in "occupywallst jobworker"
+OWS_DB_REPLICAS = []  # aliases in DATABASES to read from, see routers.py
+OWS_DB_PIN = 5  # seconds to read from primary after a user writes
+OWS_DB_MAX_LAG = 10  # seconds a replica may fall behind before we skip it
+OWS_GEO_PROVIDER = 'occupywallst.geo.GoogleProvider'  # or geo.FixtureProvider
+OWS_GEO_TIMEOUT = 5.0  # seconds to wait for google
+OWS_GEO_FIXTURES = join(project_root, 'data/geo_fixtures.json')
 
 OWS_SCRIPTS = ['js/occupywallst/' + fname
                for fname in os.listdir(join(MEDIA_ROOT, 'js/occupywallst'))]
@@ -70,6 +80,7 @@ DATABASES = {
         'NAME': 'occupywallst',
     },
 }
+DATABASE_ROUTERS = ['occupywallst.routers.ReplicaRouter']
 
 # store cache entries as json so node.js can read them.  also we don't
 # need no goofy key prefixes
@@ -162,6 +173,7 @@ TEMPLATE_CONTEXT_PROCESSORS = [
 MIDDLEWARE_CLASSES = [
     'occupywallst.middleware.XForwardedForMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'occupywallst.routers.ReplicaMiddleware',
     'django.middleware.transaction.TransactionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
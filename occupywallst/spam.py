@@ -0,0 +1,108 @@
+r"""
+
+    occupywallst.spam
+    ~~~~~~~~~~~~~~~~~
+
+    Fast matching of posts against the ``SpamText`` table.
+
+    Every post gets checked against every spam rule, sometimes twice.
+    Rather than loading the table and compiling a regex per row each
+    time, we compile all the literal phrases into one big alternation
+    regex and keep the regex rules precompiled in a list.  The result
+    is kept in process memory and thrown away when the ``spamtext``
+    version counter in memcached changes, which happens whenever a
+    ``SpamText`` row is saved or deleted.
+
+    Each match tells us which rule fired so we can log it for the
+    moderators and count hits per rule.
+
+"""
+
+import re
+import logging
+
+from django.db.models import F
+
+from occupywallst import utils, models as db
+
+
+logger = logging.getLogger(__name__)
+VERSION = 'spamtext'
+_matcher = None
+
+
+class Matcher(object):
+    """All spam rules compiled together
+
+    ``rules`` is an iterable of ``(id, text, is_regex)`` tuples.  Regex
+    rules that don't compile are logged and skipped so one typo in the
+    admin doesn't break posting.
+    """
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.literals = {}
+        self.regexes = []
+        for id, text, is_regex in rules:
+            if is_regex:
+                try:
+                    self.regexes.append((id, re.compile(text, re.I | re.S)))
+                except re.error, e:
+                    logger.error('bad spam regex #%d %r: %s', id, text, e)
+            elif text:
+                self.literals.setdefault(text.lower(), id)
+        if self.literals:
+            # longest first so attribution goes to the most specific
+            phrases = sorted(self.literals, key=len, reverse=True)
+            self.alternation = re.compile(
+                '|'.join(re.escape(p) for p in phrases), re.I)
+        else:
+            self.alternation = None
+
+    def match(self, msg):
+        """Returns id of first rule matching msg, or ``None``"""
+        if not msg:
+            return None
+        if self.alternation is not None:
+            mat = self.alternation.search(msg)
+            if mat:
+                id = self.literals.get(mat.group(0).lower())
+                if id is None:
+                    # case folding disagrees with lower() on this one
+                    lmsg = msg.lower()
+                    id = next((i for p, i in self.literals.items()
+                               if p in lmsg), None)
+                if id is not None:
+                    return id
+        for id, expr in self.regexes:
+            if expr.search(msg):
+                return id
+        return None
+
+
+def get_matcher():
+    """Returns matcher for current spam rules, compiling if needed"""
+    global _matcher
+    version = utils.get_version(VERSION)
+    if _matcher is None or _matcher.version != version:
+        rules = db.SpamText.objects.values_list('id', 'text', 'is_regex')
+        _matcher = Matcher(rules, version)
+    return _matcher
+
+
+def invalidate():
+    utils.bump_version(VERSION)
+
+
+def check(msg):
+    """Returns id of spam rule matching msg and counts the hit
+
+    Every match counts, whether or not the post ends up removed.
+    """
+    id = get_matcher().match(msg)
+    if id is not None:
+        logger.info('spam rule #%d matched: %r', id, msg[:200])
+        (db.SpamText.objects
+         .filter(id=id)
+         .update(hits=F('hits') + 1, last_hit=utils.now()))
+    return id
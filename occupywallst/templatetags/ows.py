@@ -9,13 +9,12 @@ r"""
 
 import re
 import pytz
-import hashlib
 import datetime
+import threading
 import markdown
 
 from django import template
 from django.conf import settings
-from django.core.cache import cache
 from django.utils.html import strip_tags
 from django.template import Template, Context
 from django.utils.safestring import mark_safe
@@ -52,9 +51,16 @@ pat_readmore = [
     re.compile(r'<!-- ?begin synopsis ?-->(.+?)<!-- ?end synopsis ?-->',
                re.I | re.S),
 ]
+pat_plaintext = [
+    (re.compile(r'!\[([^\]]*)\]\([^)]*\)'), r'\1'),
+    (re.compile(r'\[([^\]]*)\](?:\([^)]*\)|\[[^\]]*\])'), r'\1'),
+    (re.compile(r'^ {0,3}\[[^\]]+\]:.*$', re.M), ''),
+    (re.compile(r'^[ \t]*(?:#+|>+|[-*+]|\d+\.)[ \t]+', re.M), ''),
+    (re.compile(r'(?<![\w\\])[*_]+|(?<!\\)[*_]+(?!\w)|`+'), ''),
+    (re.compile(r'\\([\\`*_{}\[\]()#+.!-])'), r'\1'),
+]
 
-markdown_safe = markdown.Markdown(safe_mode='escape')
-markdown_unsafe = markdown.Markdown()
+markdowns = threading.local()
 
 
 @register.filter
@@ -93,7 +99,8 @@ def synopsis(text, max_words=10, max_chars=None):
     First we try to extract a manually specified synopsis (see
     :py:func:`read_more()`).  If that doesn't work then we extract the
     first paragraph.  Markdown quotations are excluded unless the
-    whole thing is a quote.
+    whole thing is a quote.  Then :py:func:`plaintext` gets rid of
+    the markup.
 
     The result will be truncated after ``max_words``.  ``max_chars``
     is a fail-safe in case there are super long words.  It defaults to
@@ -101,14 +108,17 @@ def synopsis(text, max_words=10, max_chars=None):
     letters in English words.  If ``max_chars <= 0`` then this feature
     is disabled.
 
-    Then we strip html tags, run it through markdown, strip html again
-    and turn html entities back into plain text.  The result should be
-    considered unsafe.
+    You can also pass an article or comment instead of text, in which
+    case we use the synopsis stored when it was saved.  The result
+    should be considered unsafe.
     """
-    key = hashlib.sha256(text.encode('utf8')).hexdigest()
-    res = cache.get(key)
-    if res is not None:
-        return res
+    if hasattr(text, 'get_synopsis'):
+        return text.get_synopsis(max_words, max_chars)
+    return truncate_words(excerpt(text), max_words, max_chars)
+
+
+def excerpt(text):
+    """Returns plain text of the synopsis part of markdown text"""
     for pat in pat_readmore:
         mat = pat.search(text)
         if mat:
@@ -122,18 +132,34 @@ def synopsis(text, max_words=10, max_chars=None):
             return 'BLANK'
         paragraphs = res.split('\n\n')
         res = paragraphs[0]
-    res = unicode(strip_tags(markup(strip_tags(res)))
-                  .replace('&gt;', '>')
-                  .replace('&lt;', '<')
-                  .replace('&amp;', '&')
-                  .replace('&quot;', '"'))
-    words = res.split()
-    res = " ".join(words[:max_words])
+    return plaintext(res)
+
+
+def plaintext(text):
+    """Strips markdown syntax and html from text
+
+    This is a lot cheaper than running markdown and then stripping the
+    html.  It only knows about the common stuff (links, images,
+    emphasis, code, headers, quotes and lists) which is good enough
+    for a one-line description.
+    """
+    text = strip_tags(text)
+    for pat, repl in pat_plaintext:
+        text = pat.sub(repl, text)
+    return unicode(text
+                   .replace('&gt;', '>')
+                   .replace('&lt;', '<')
+                   .replace('&quot;', '"')
+                   .replace('&nbsp;', ' ')
+                   .replace('&amp;', '&'))
+
+
+def truncate_words(text, max_words=10, max_chars=None):
+    res = " ".join(text.split()[:max_words])
     if max_chars is None:
         max_chars = max_words * 6
     if max_chars > 0:
         res = res[:max_chars]
-    cache.set(key, res, 60 * 60)
     return res
 
 
@@ -174,7 +200,33 @@ def strip_annoying_html(html):
 strip_annoying_html.is_safe = True
 
 
-def _markup(text, convert):
+def get_markdown(safe=True):
+    """Returns markdown converter for the current thread
+
+    ``markdown.Markdown`` objects keep state between conversions so
+    they can't be shared by threads.  Making one is slow-ish so we
+    keep one of each kind per thread.
+    """
+    key = 'safe' if safe else 'unsafe'
+    res = getattr(markdowns, key, None)
+    if res is None:
+        if safe:
+            res = markdown.Markdown(safe_mode='escape')
+        else:
+            res = markdown.Markdown()
+        setattr(markdowns, key, res)
+    return res
+
+
+def _convert(text, safe):
+    md = get_markdown(safe)
+    try:
+        return md.convert(text)
+    finally:
+        md.reset()
+
+
+def _markup(text, safe):
     """Turn markdown text into HTML with additional hacks
 
     - HTML comments are removed.
@@ -190,7 +242,7 @@ def _markup(text, convert):
     text = pat_url.sub(r'<\1>', text)
     text = pat_url_www.sub(r'[\1](http://\1)', text)
     text = pat_comment.sub('', text)
-    html = convert(text)
+    html = _convert(text, safe)
     html = html.replace('src="/media/', 'src="' + settings.MEDIA_URL)
     return mark_safe(html)
 
@@ -198,14 +250,14 @@ def _markup(text, convert):
 @register.filter
 def markup(text):
     """Runs text through markdown, no html allowed"""
-    return _markup(text, markdown_safe.convert)
+    return _markup(text, True)
 markup.is_safe = True
 
 
 @register.filter
 def markup_unsafe(text):
     """Runs text through markdown, html allowed"""
-    return _markup(text, markdown_unsafe.convert)
+    return _markup(text, False)
 markup_unsafe.is_safe = True
 
 
@@ -255,5 +307,6 @@ def show_comments(context, user, comments):
                                     {'comment': comment,
                                      'user': user,
                                      'depth': depth,
-                                     'can_reply': can_reply}))
+                                     'can_reply': can_reply,
+                                     'overlay': context.get('overlay')}))
     return "".join(res)
@@ -9,12 +9,14 @@ r"""
 """
 
 import json
+import time
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 from itertools import product
 
 import redisbayes
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 from django.contrib.gis.geos import Point
 from django.core.urlresolvers import reverse
@@ -221,6 +223,7 @@ class OWS(TestCase):
         settings.OWS_LIMIT_THREAD = -1
         settings.OWS_LIMIT_COMMENT = -1
         settings.OWS_LIMIT_MSG_DAY = 999999
+        settings.OWS_GEO_PROVIDER = 'occupywallst.geo.FixtureProvider'
         self.create_users()
         self.article = db.Article(author=self.red_user,
                                   published=utils.now(),
@@ -268,6 +271,83 @@ class OWS(TestCase):
         vt.save()
         assert 'ello-hay' in db.Verbiage.get('test', 'piglatin')
 
+    def test_stored_html(self):
+        from occupywallst import rendering
+        a = new_article(self.red_user, content='hello *there*')
+        c = new_comment(a, self.blue_user, content='nice **post**')
+        assert '<em>there</em>' in fresh(a).html
+        assert '<strong>post</strong>' in fresh(c).content_html
+        db.Article.objects.filter(id=a.id).update(html='cached')
+        a = fresh(a)
+        a.comment_count += 1
+        a.save()
+        assert fresh(a).html == 'cached', 'only render when content changes'
+        update(a, content='hello *again*')
+        assert '<em>again</em>' in fresh(a).html
+        db.Comment.objects.filter(id=c.id).update(html='cached')
+        update(fresh(c), is_removed=True)
+        assert fresh(c).html == 'cached', 'only render when content changes'
+        update(c, content='edited')
+        assert 'edited' in fresh(c).html
+        db.Comment.objects.filter(id=c.id).update(html='', html_version=0)
+        assert 'edited' in fresh(c).content_html, 'should render stale rows'
+        assert rendering.rerender(db.Comment) >= 1
+        assert 'edited' in fresh(c).html
+
+    def test_synopsis(self):
+        assert ows.plaintext('## *Hi* [there](/x) `you`') == 'Hi there you'
+        assert ows.synopsis('> quote\n\nhello **world**\n\nmore') == \
+            'hello world'
+        assert ows.synopsis('one two three', 2) == 'one two'
+        a = new_article(self.red_user, content='hello _big_ world')
+        assert fresh(a).synopsis == 'hello big world'
+        assert ows.synopsis(fresh(a), 2) == 'hello big'
+        db.Article.objects.filter(id=a.id).update(synopsis='',
+                                                  html_version=0)
+        assert ows.synopsis(fresh(a)) == 'hello big world'
+
+    def test_markdown_threads(self):
+        import threading
+        from occupywallst import rendering
+        a = new_article(self.red_user)
+        posts = [new_comment(a, self.blue_user,
+                             content='[%d][x]\n\n[x]: /%d' % (n, n))
+                 for n in range(20)]
+        expect = rendering.render_many(posts)
+        for n, html in enumerate(expect):
+            assert 'href="/%d"' % (n) in html, 'references must not leak'
+        res = []
+        threads = [threading.Thread(
+            target=lambda: res.append(rendering.render_many(posts)))
+            for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert res == [expect] * 4
+
+    def test_verbiage_get_many(self):
+        res = db.Verbiage.get_many(['title', 'footer', 'nonexistent'])
+        assert set(res) == set(['title', 'footer'])
+        v = db.Verbiage(name='test', content='hello, world')
+        v.save()
+        assert db.Verbiage.get_many(['test'])['test'] == 'hello, world'
+        v.content = 'goodbye, world'
+        v.save()
+        assert db.Verbiage.get_many(['test'])['test'] == 'goodbye, world'
+
+    def test_local_cache(self):
+        lru = utils.LocalCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        assert lru.get('a') == 1
+        lru.set('c', 3)
+        assert lru.get('b') is None, 'least recently used should go'
+        assert lru.get('a') == 1 and lru.get('c') == 3
+        lru.timeout = -1
+        lru.set('a', 1)
+        assert lru.get('a') is None, 'should expire'
+
     def test_user_info_wo_geodata(self):
         ui = db.UserInfo(user=self.red_user)
         assert str(ui) != ''
@@ -334,6 +414,83 @@ class OWS(TestCase):
         db.Article.recalculate()
         # TODO: check that the comment count for the article is correct
 
+    def test_archive_days(self):
+        from django.utils.timezone import utc
+        when = datetime(2011, 10, 5, 12, tzinfo=utc)
+        a = new_article(self.red_user, published=when)
+        b = new_article(self.red_user, published=when)
+        assert db.ArchiveDay.days(True) == [when.date()]
+        assert db.ArchiveDay.objects.get(is_forum=True).count == 2
+        update(a, is_visible=False)
+        b.delete()
+        assert db.ArchiveDay.days(True) == []
+        update(a, is_visible=True)
+        db.ArchiveDay.recount([(True, when)])
+        assert db.ArchiveDay.objects.get(is_forum=True).count == 1
+        db.ArchiveDay.recount([(True, when)])
+        assert db.ArchiveDay.objects.get(is_forum=True).count == 1
+        version = db.ArchiveDay.month_version(when)
+        update(a, comment_count=a.comment_count + 1)
+        assert db.ArchiveDay.month_version(when) == version
+        update(a, title='renamed')
+        assert db.ArchiveDay.month_version(when) != version
+        for path in ('/forum/archive/', '/forum/archive/Oct-2011/',
+                     '/forum/archive/Oct-5-2011/'):
+            response = self.client.get(path)
+            assert response.status_code == 200
+            assert a.title in response.content
+
+    def test_page_cache_purge(self):
+        a = new_article(self.red_user)
+        self.client.get('/forum/')
+        response = self.client.get('/forum/%s/' % (a.slug))
+        assert response.status_code == 200
+        c = new_comment(a, self.blue_user, content='fresh cache test')
+        assert c.content in self.client.get('/forum/').content
+        assert c.content in self.client.get('/forum/%s/' % (a.slug)).content
+        update(a, title='a brand new title')
+        assert a.title in self.client.get('/forum/').content
+
+    def test_jsonify(self):
+        from decimal import Decimal
+        a = new_article(self.red_user)
+        data = {'status': 'OK',
+                'results': [a, Decimal('1.5'), a.published, set([1])]}
+        res = json.loads(utils.jsonify(data))
+        assert res['results'][0]['slug'] == a.slug
+        assert res['results'][1:] == ['1.5', utils.jstime(a.published), [1]]
+        assert json.loads(''.join(utils.iterjson(data, batch=3))) == res
+        assert json.loads(''.join(utils.iterjson({'results': []}))) == \
+            {'results': []}
+
+    def test_cached(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        key = 'test:cached:%d' % random.randint(0, 2 ** 31)
+        before = utils.cache_stats()
+        assert utils.cached(key, compute, 60) == 1
+        assert utils.cached(key, compute, 60) == 1
+        assert utils.cached(key, compute, 60, fresh=lambda v: v > 1) == 2
+        assert utils.cached(key, compute, 60) == 2
+        after = utils.cache_stats()
+        assert after['miss'] == before['miss'] + 1
+        assert after['refresh'] == before['refresh'] + 1
+        assert after['hit'] == before['hit'] + 2
+        assert utils.cached_many([key]) == {key: 2}
+        utils.uncache(key)
+        cache.set(key, 'plain value')
+        assert utils.cached(key, compute, 60) == 3
+        assert cache.get(key) == 'plain value'
+        cache.set(utils._cached_key(key), 'old format')
+        assert utils.cached_many([key]) == {}
+        assert utils.cached(key, compute, 60) == 4
+        utils.uncache(key)
+        cache.delete(key)
+
     def test_article_comments_as_user(self):
         a = db.Article(author=self.red_user, title='test title', slug='test',
                        published=utils.now(),
@@ -349,6 +506,35 @@ class OWS(TestCase):
 
         # TODO: check that this has the intended effects
 
+    def test_comment_tree_cache(self):
+        from occupywallst import commenttree
+        html = commenttree.render(self.article, self.blue_user)
+        assert '<!--ows:' not in html
+        assert 'upvoted' in html, 'comment_new should upvote own comment'
+        assert 'class="delete"' in html
+        html = commenttree.render(self.article, self.red_user)
+        assert 'upvoted' not in html
+        assert 'class="delete"' not in html
+
+        # cached tree should notice new votes and removals
+        api.comment_upvote(self.red_user, self.comment)
+        html = commenttree.render(self.article, self.red_user)
+        assert 'upvoted' in html
+        self.comment.is_removed = True
+        self.comment.save()
+        html = commenttree.render(self.article, self.red_user)
+        assert '[Removed]' in html
+        html = commenttree.render(self.article, self.blue_user)
+        assert '[Removed]' not in html
+
+        # shadow banning changes what moderators see
+        version = commenttree.version(self.article)
+        api.shadowban(self.mod_user, self.blue_user.username, 'ban')
+        assert commenttree.version(self.article) != version
+        version = commenttree.version(self.article)
+        api.shadowban(self.mod_user, self.blue_user.username, 'ban')
+        assert commenttree.version(self.article) == version
+
     def test_article_translation(self):
         a = db.Article(author=self.red_user, title='test title', slug='test',
                        published=utils.now(),
@@ -402,6 +588,241 @@ class OWS(TestCase):
         c = db.Comment.objects.get(content='nice test')
         assert c.karma == 0
 
+    def test_recalc(self):
+        from occupywallst import recalc
+        c = db.Comment(article=self.article, user=self.blue_user,
+                       content='nice test')
+        c.save()
+        c.upvote(self.green_user)
+        db.Comment.objects.filter(id=c.id).update(ups=5, karma=5)
+        since = utils.now() - timedelta(hours=1)
+        res = recalc.recalculate(['comments'], since=since, dry_run=True)
+        assert res['comments'] == [(c.id, {'ups': (5, 1), 'karma': (5, 1)})]
+        assert db.Comment.objects.get(id=c.id).karma == 5
+        assert recalc.recalculate(['comments'], since=since) == \
+            {'comments': 1}
+        assert db.Comment.objects.get(id=c.id).karma == 1
+        res = recalc.recalculate(dry_run=True)
+        assert res['comments'] == []
+        # votes on old comments were pruned so their counters stay put
+        old = db.Comment(article=self.article, user=self.blue_user,
+                         content='old test')
+        old.save()
+        db.Comment.objects.filter(id=old.id).update(
+            ups=7, karma=7, published=utils.now() - timedelta(days=60))
+        old.upvote(self.green_user)
+        assert db.Comment.objects.get(id=old.id).karma == 8
+        assert recalc.recalculate(['comments'], since=since) == \
+            {'comments': 0}
+        assert db.Comment.objects.get(id=old.id).karma == 8
+
+    def test_spam_matcher(self):
+        from occupywallst import spam
+        lit = db.SpamText.objects.create(text='Cheap Pills')
+        rex = db.SpamText.objects.create(text=r'v[i1]agra', is_regex=True)
+        db.SpamText.objects.create(text='(unbalanced', is_regex=True)
+        assert spam.check('buy CHEAP pills now') == lit.id
+        assert spam.check('buy v1agra now') == rex.id
+        assert spam.check('nothing to see here') is None
+        assert db.SpamText.objects.get(id=lit.id).hits == 1
+        lit.delete()
+        assert spam.check('buy cheap pills now') is None
+
+    def test_vote_index(self):
+        from occupywallst import votes
+        c = db.Comment(article=self.article, user=self.blue_user,
+                       content='nice test')
+        c.save()
+        assert votes.lookup(self.green_user, [c]) == {}
+        c.upvote(self.green_user)
+        assert votes.lookup(self.green_user, [c]) == {c.id: 1}
+        c.downvote(self.green_user)
+        assert votes.lookup(self.green_user, [c]) == {c.id: -1}
+        assert votes.lookup_article(self.green_user, self.article.id) == \
+            {c.id: -1}
+
+        # voting drops the index rather than editing it
+        c.upvote(self.green_user)
+        assert cache.get(votes._key(self.green_user.id,
+                                    self.article.id)) is None
+        assert votes.lookup(self.green_user, [c]) == {c.id: 1}
+        c.downvote(self.green_user)
+        votes.rebuild(self.green_user.id, [self.article.id])
+        assert votes.lookup(self.green_user, [c]) == {c.id: -1}
+        assert votes.lookup(self.red_user, [c, self.comment]) == {}
+
+    def test_vote_buffer(self):
+        from occupywallst import votes
+        votes.flush()
+        settings.OWS_VOTE_BUFFER = True
+        try:
+            c = new_comment(self.article, self.blue_user)
+            c.upvote(self.green_user)
+            c.downvote(self.red_user)
+            c.upvote(self.red_user)
+            assert (c.karma, c.ups, c.downs) == (2, 2, 0)
+            assert fresh(c).karma == 0, 'votes should be buffered'
+            stats = votes.buffer_stats()
+            votes._get_redis().set(votes.LOCK_KEY, 'other')
+            assert votes.flush() == 0, 'another flush is running'
+            assert fresh(c).karma == 0
+            votes._get_redis().delete(votes.LOCK_KEY)
+            assert votes.flush() == 1
+            assert votes.flush() == 0
+            c = fresh(c)
+            assert (c.karma, c.ups, c.downs) == (2, 2, 0)
+            # pretend we died before deleting the batch from redis
+            batch = db.VoteFlush.objects.latest('id').batch
+            conn = votes._get_redis()
+            conn.hset(votes.FLUSHING_KEY, 'batch', batch)
+            conn.hset(votes.FLUSHING_KEY, '%d:u' % (c.id), 2)
+            assert votes.flush() == 0, 'batch was already applied'
+            assert not conn.exists(votes.FLUSHING_KEY)
+            assert fresh(c).karma == 2
+            assert votes.buffer_stats()['votes'] == stats['votes'] + 3
+        finally:
+            settings.OWS_VOTE_BUFFER = False
+
+    def test_spam_queue(self):
+        from occupywallst import jobs, moderation
+        while jobs.work():
+            pass
+        api.article_new(user=self.blue_user, title='watch s01e01 online',
+                        content='some content', is_forum=True)
+        a = db.Article.objects.get(slug='watch-s01e01-online')
+        assert not a.is_visible
+        settings.OWS_JOB_QUEUE = True
+        try:
+            api.article_new(user=self.blue_user, title='watch s01e02 online',
+                            content='some content', is_forum=True)
+            a = db.Article.objects.get(slug='watch-s01e02-online')
+            assert a.is_visible, 'classification should be queued'
+            assert jobs.queue_stats()['depth'] == 1
+            assert jobs.work() == 1
+            assert not fresh(a).is_visible
+            assert jobs.queue_stats()['depth'] == 0
+            assert moderation.filter_stats()['removed'] >= 1
+        finally:
+            settings.OWS_JOB_QUEUE = False
+
+    def test_spam_comment_not_notified(self):
+        from occupywallst import bayes, moderation
+        a = new_article(self.red_user)
+        self.blue_user.userinfo.karma = 0
+        self.blue_user.userinfo.save()
+        notified = self.red_user.notification_set.count()
+        old = moderation.REDBAY
+        moderation.REDBAY = bayes.LocalBayes()
+        moderation.REDBAY.train('bad', 'cheap pills online now')
+        moderation.REDBAY.train('good', 'general strike tomorrow')
+        try:
+            api.comment_new(user=self.blue_user, article_slug=a.slug,
+                            parent_id=None, content='cheap pills online')
+        finally:
+            moderation.REDBAY = old
+        assert fresh(a).comment_count == 0
+        assert self.red_user.notification_set.count() == notified
+
+    def test_jobs(self):
+        from occupywallst import jobs
+        from rideshare import tasks, models as rdb
+        while jobs.work():
+            pass
+        self.assertRaises(LookupError, jobs._resolve, 'os.path.join')
+        user = new_user()
+        jobs.submit(tasks.notify, [user.id], '/rides/', 'hello')
+        assert user.notification_set.filter(message='hello').count() == 1
+        ride = rdb.Ride.objects.create(
+            user=user, title='ride', waypoints='Philadelphia, PA\nNew York')
+        settings.OWS_JOB_QUEUE = True
+        try:
+            jobs.submit(tasks.route_ride, ride.id, ride.waypoints)
+            jobs.submit(tasks.route_ride, -1, '')
+            assert fresh(ride).route is None, 'routing should be queued'
+            assert jobs.queue_stats()['depth'] == 2
+            assert jobs.work() == 2
+            assert fresh(ride).route is None, 'new york is not in fixtures'
+            ride.waypoints = 'Philadelphia, PA\nNew York, NY'
+            jobs.submit(tasks.route_ride, ride.id, ride.waypoints)
+            assert jobs.work() == 1
+            assert fresh(ride).route is None, 'edit not committed yet'
+            ride.save()
+            jobs.submit(tasks.route_ride, ride.id, ride.waypoints)
+            assert jobs.work() == 1
+            assert fresh(ride).route_data == 'cezrFtlwiM{}iBus`Cuzh@un_B'
+            stats = jobs.queue_stats()
+            assert stats['depth'] == 0
+            assert stats['running'] == 0
+            assert stats['retrying'] >= 3
+            # a worker died in the middle of a job
+            crashed = 'ows:jobs:processing:crashed:1'
+            jobs._get_redis().lpush(crashed, json.dumps({
+                'task': tasks.notify.task_name, 'args': [[user.id], '/', 'hi'],
+                'attempts': 0, 'queued': time.time()}))
+            jobs._get_redis().sadd(jobs.WORKERS_KEY, crashed)
+            assert jobs.work() == 1
+            assert user.notification_set.filter(message='hi').count() == 1
+            assert not jobs._get_redis().exists(crashed)
+        finally:
+            settings.OWS_JOB_QUEUE = False
+
+    def test_local_bayes(self):
+        import os
+        import tempfile
+        from occupywallst import bayes
+        lb = bayes.LocalBayes()
+        lb.train_many([('bad', 'buy cheap pills online'),
+                       ('good', 'general strike on may day'),
+                       ('bad', 'cheap pills no prescription')])
+        assert lb.classify('cheap pills') == 'bad'
+        assert lb.classify('may day general strike') == 'good'
+        tally = lb.tally('bad')
+        lb.untrain('bad', 'buy cheap pills online')
+        assert 0 < lb.tally('bad') < tally
+        path = tempfile.mktemp()
+        try:
+            lb.save(path)
+            lb2 = bayes.LocalBayes()
+            lb2.load(path)
+            assert lb2.score('cheap strike') == lb.score('cheap strike')
+            assert not lb2.reload(path), 'snapshot unchanged'
+            lb.train('good', 'strike strike strike')
+            lb.save(path)
+            os.utime(path, (lb.mtime + 1, lb.mtime + 1))
+            assert lb2.reload(path)
+            assert lb2.score('cheap strike') == lb.score('cheap strike')
+            lb2.train('bad', 'strike')
+            os.utime(path, (lb.mtime + 2, lb.mtime + 2))
+            assert not lb2.reload(path), 'would lose training'
+        finally:
+            os.unlink(path)
+
+    def test_bayes_trainer(self):
+        import os
+        import tempfile
+        from occupywallst import bayes
+        conn = bayes._get_redis()
+        conn.delete(bayes.TRAIN_KEY, bayes.TRAINER_KEY)
+        path = tempfile.mktemp()
+        settings.OWS_SPAM_BAYES = path
+        try:
+            web, worker = bayes.LocalBayes(), bayes.LocalBayes()
+            bayes.learn(web, 'bad', 'cheap pills online')
+            bayes.learn(web, 'good', 'general strike')
+            assert not web.tally('bad'), 'web processes should not train'
+            assert bayes.absorb(worker) == 2
+            assert worker.tally('bad') and worker.tally('good')
+            assert bayes.absorb(worker) == 0
+            conn.set(bayes.TRAINER_KEY, 'someone-else')
+            bayes.learn(web, 'bad', 'more pills')
+            assert bayes.absorb(web) == 0, 'only one trainer'
+            bayes.refresh(web)
+            assert web.score('cheap strike') == worker.score('cheap strike')
+        finally:
+            settings.OWS_SPAM_BAYES = None
+            conn.delete(bayes.TRAIN_KEY, bayes.TRAINER_KEY)
+            os.unlink(path)
+
     def test_comment_vote_prune(self):
         c = db.Comment(article=self.article, user=self.blue_user,
                        content='nice test')
@@ -584,6 +1005,173 @@ class OWS(TestCase):
 
         # TODO: test that users appear in bounds when they are supposed to
 
+    def test_api_stream(self):
+        from django.test.client import RequestFactory
+
+        def gen(fail=False, **kwargs):
+            yield {'n': 1}
+            yield {'n': 2}
+            if fail:
+                raise utils.APIException('oh no')
+
+        view = utils.api_view(gen, stream=True)
+        for fail, status in (('', 'OK'), ('1', 'ERROR')):
+            request = RequestFactory().get('/', {'fail': fail})
+            request.user = self.red_user
+            j = json.loads(''.join(view(request)))
+            assert j['status'] == status, jdump(j)
+            assert j['results'] == [{'n': 1}, {'n': 2}], jdump(j)
+
+    def test_api_readonly(self):
+        a = new_article(self.red_user)
+        before = utils.api_stats().get('article_get', {}).get('calls', 0)
+        response = self.client.get('/api/safe/article_get/',
+                                   {'article_slug': a.slug})
+        assert json.loads(response.content)['status'] == 'OK'
+        stats = utils.api_stats()['article_get']
+        assert stats['readonly']
+        assert stats['calls'] == before + 1
+
+    def test_replica_router(self):
+        from occupywallst import routers
+        router = routers.ReplicaRouter()
+        settings.OWS_DB_REPLICAS = ['default']
+        try:
+            routers.use_replica(True)
+            assert router.db_for_read(db.Article) == 'default'
+            assert router.db_for_write(db.Article) == 'default'
+            assert router.db_for_read(db.Article) is None, 'wrote'
+            routers._lag['default'] = (time.time(), 999)
+            routers.use_replica(True)
+            assert router.db_for_read(db.Article) is None, 'too laggy'
+            routers._lag.clear()
+            routers.use_replica(False)
+            assert router.db_for_read(db.Article) is None
+            # a GET that writes pins the user too
+            from django.http import HttpResponse
+            from django.test.client import RequestFactory
+            middleware = routers.ReplicaMiddleware()
+            request = RequestFactory().get('/')
+            middleware.process_request(request)
+            resp = middleware.process_response(request, HttpResponse())
+            assert routers.PIN_COOKIE not in resp.cookies
+            middleware.process_request(request)
+            router.db_for_write(db.Notification)
+            resp = middleware.process_response(request, HttpResponse())
+            assert routers.PIN_COOKIE in resp.cookies
+        finally:
+            settings.OWS_DB_REPLICAS = []
+            routers._lag.clear()
+        response = self.client.post('/api/logout/')
+        assert routers.PIN_COOKIE in response.cookies
+        response = self.client.get('/api/safe/forumlinks/')
+        assert not routers._state.replica, 'should be pinned after write'
+
+    def test_attendee_clusters(self):
+        from occupywallst import attendeemap
+        for lat, lng in [(40.71, -74.00), (40.72, -74.01), (51.5, -0.12)]:
+            new_user(position=Point(lng, lat))
+        world = [-80, -179, 80, 179]
+        res = list(attendeemap.attendees(world, 2))
+        assert sorted(c['count'] for c in res) == [1, 2], res
+        res = list(attendeemap.attendees([40.7, -74.02, 40.73, -73.99], 14))
+        assert len(res) == 2 and all('username' in r for r in res), res
+        new_user(position=Point(-74.005, 40.715))
+        attendeemap.invalidate()
+        res = list(attendeemap.attendees(world, 2))
+        assert sorted(c['count'] for c in res) == [1, 3], res
+
+    def test_haversine(self):
+        from occupywallst import geo
+        km = geo.haversine(40.71, -74.0, 51.5, -0.12)
+        assert 5560 < km < 5575, km
+        assert geo.haversine(1, 2, 1, 2) == 0
+        lats, lngs = [51.5, 40.71, -33.87], [-0.12, -74.0, 151.21]
+        res = list(geo.distances(40.71, -74.0, lats, lngs))
+        for got, lat, lng in zip(res, lats, lngs):
+            assert abs(got - geo.haversine(40.71, -74.0, lat, lng)) < 1e-6
+        matrix = geo.distance_matrix(lats, lngs, lats, lngs)
+        for i in range(3):
+            for j in range(3):
+                want = geo.haversine(lats[i], lngs[i], lats[j], lngs[j])
+                assert abs(matrix[i][j] - want) < 1e-6
+        assert len(geo.distances(0, 0, [], [])) == 0
+
+    def test_polyline(self):
+        from occupywallst import polyline
+        from rideshare import models as rdb
+        google = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+        coords = polyline.decode(google)
+        assert list(coords) == [38.5, -120.2, 40.7, -120.95,
+                                43.252, -126.453], coords
+        assert polyline.encode(coords) == google
+        ucode = json.loads(json.dumps({'points': google}))['points']
+        assert isinstance(ucode, unicode)
+        assert polyline.decode(ucode) == coords
+        assert polyline.decode_many([ucode])[0] == coords
+        assert polyline.encode([]) == ''
+        both, offsets = polyline.decode_many([google, google])
+        assert list(offsets) == [0, 6, 12]
+        assert both[6:12] == coords
+        line = polyline.linestring(coords)
+        assert line.coords[0] == (-120.2, 38.5), line.coords
+        assert line.srid == 4326
+        assert polyline.encode_linestring(line) == google
+        ride = rdb.Ride.objects.create(user=new_user(), title='ride',
+                                       waypoints='nyc\nphilly', route=line)
+        response = self.client.get('/rides/api/safe/rides/')
+        j = assert_and_get_valid_json(response)
+        res = [r for r in j['results'] if r['id'] == ride.id]
+        assert res[0]['polyline'] == google, jdump(j)
+        assert fresh(ride).route_data == '', 'reads should not write'
+
+    def test_geocache(self):
+        from occupywallst import geo
+        lat, lng = geo.address_to_latlng('New York,  NY ')
+        assert (lat, lng) == (40.7143528, -74.0059731)
+        assert geo.address_to_latlng('new york, ny') == (lat, lng)
+        assert db.GeoCache.objects.filter(kind='geocode').count() == 1
+        routes = geo.directions(['Philadelphia, PA', 'New York, NY'])
+        assert routes[0]['overview_polyline']['points']
+        self.assertRaises(geo.GeocodeException, geo.geocode, 'mars')
+        assert db.GeoCache.objects.count() == 2
+        settings.OWS_GEO_PROVIDER = 'occupywallst.tests.BrokenProvider'
+        try:
+            cache.clear()
+            assert geo.address_to_latlng('NEW YORK, NY') == (lat, lng)
+            assert geo.directions(['philadelphia, pa', 'new york, ny'])
+        finally:
+            settings.OWS_GEO_PROVIDER = 'occupywallst.geo.FixtureProvider'
+        settings.OWS_GEO_PROVIDER = 'occupywallst.tests.EmptyProvider'
+        timeout = geo.MISS_TIMEOUT
+        try:
+            EmptyProvider.calls = 0
+            assert geo.geocode('atlantis') == []
+            assert geo.geocode('atlantis') == []
+            assert EmptyProvider.calls == 1
+            assert db.GeoCache.objects.count() == 2, 'misses not stored'
+            geo.MISS_TIMEOUT = 0
+            assert geo.geocode('atlantis') == []
+            assert EmptyProvider.calls == 2, 'misses should expire'
+        finally:
+            geo.MISS_TIMEOUT = timeout
+            settings.OWS_GEO_PROVIDER = 'occupywallst.geo.FixtureProvider'
+
+    def test_nearby(self):
+        from occupywallst import attendeemap
+        me = new_user(position=Point(-74.00, 40.71))
+        near = new_user(position=Point(-74.01, 40.72))
+        far = new_user(position=Point(-0.12, 51.5))
+        new_user()
+        res = attendeemap.nearby(me.userinfo, 2)
+        assert [i.user_id for i in res] == [near.id, far.id], res
+        assert res[0].distance.mi < 1 < res[1].distance.mi
+        nearer = new_user(position=Point(-74.001, 40.711))
+        assert attendeemap.nearby(me.userinfo, 2)[0].user_id == near.id
+        attendeemap.invalidate()
+        assert attendeemap.nearby(me.userinfo, 2)[0].user_id == nearer.id
+        assert attendeemap.nearby(db.UserInfo()) == []
+
     def test_api_attendee_info(self):
         response = self.client.get('/api/safe/attendee_info/')
         j = assert_and_get_valid_json(response)
@@ -646,6 +1234,30 @@ class OWS(TestCase):
         j = assert_and_get_valid_json(response)
         assert j['status'] == 'OK', jdump(j)
 
+    def test_api_forumlinks_cursor(self):
+        for n in range(5):
+            new_article(self.red_user)
+        response = self.client.get('/api/safe/forumlinks/',
+                                   {'after': 0, 'count': 100})
+        everything = assert_and_get_valid_json(response)['results']
+        got = []
+        args = {'count': 2}
+        while True:
+            response = self.client.get('/api/safe/forumlinks/', args)
+            j = assert_and_get_valid_json(response)
+            if j['status'] == 'ZERO_RESULTS':
+                break
+            assert j['status'] == 'OK', jdump(j)
+            assert len(j['results']) <= 2
+            got += j['results']
+            args['cursor'] = j['cursor']
+        assert got == everything
+
+        response = self.client.get('/api/safe/commentfeed/',
+                                   {'cursor': 'garbage', 'count': 2})
+        j = assert_and_get_valid_json(response)
+        assert j['status'] == 'ERROR', jdump(j)
+
     def test_api_check_username(self):
         # already taken
         response = self.client.post('/api/check_username/',
@@ -1078,6 +1690,21 @@ class OWS(TestCase):
         self.red_user.userinfo.save()
 
 
+class BrokenProvider(object):
+    def geocode(self, address):
+        raise AssertionError('should have been cached')
+
+    directions = geocode
+
+
+class EmptyProvider(object):
+    calls = 0
+
+    def geocode(self, address):
+        EmptyProvider.calls += 1
+        return []
+
+
 class TestAPI(TestCase):
     def setUp(self):
         settings.TEST_MODE = True
@@ -1085,6 +1712,7 @@ class TestAPI(TestCase):
         settings.OWS_LIMIT_THREAD = -1
         settings.OWS_LIMIT_COMMENT = -1
         settings.OWS_LIMIT_MSG_DAY = 999999
+        settings.OWS_GEO_PROVIDER = 'occupywallst.geo.FixtureProvider'
 
     def invoke(self, api, data, extra):
         resp = self.client.post(api, data, **extra)
@@ -41,15 +41,15 @@ urlpatterns = patterns('',
     url(r'^error/$', 'occupywallst.views.error', name='error'),
     url(r'^users/(?P<username>[-_\d\w]+)/$', 'occupywallst.views.user_page', name='user'),
     url(r'^users/(?P<username>[-_\d\w]+)/edit/$', 'occupywallst.views.edit_profile', name='user-edit'),
-    url(r'^api/safe/attendees/$', require_GET(utils.api_view(api.attendees))),
-    url(r'^api/safe/attendee_info/$', require_GET(utils.api_view(api.attendee_info))),
-    url(r'^api/safe/article_get/$', require_GET(utils.api_view(api.article_get))),
-    url(r'^api/safe/article_get_comments/$', require_GET(utils.api_view(api.article_get_comments))),
-    url(r'^api/safe/article_get_comment_votes/$', require_GET(utils.api_view(api.article_get_comment_votes))),
-    url(r'^api/safe/comment_get/$', require_GET(utils.api_view(api.comment_get))),
-    url(r'^api/safe/carousel_get/$', require_GET(utils.api_view(api.carousel_get))),
-    url(r'^api/safe/forumlinks/$', require_GET(utils.api_view(api.forumlinks))),
-    url(r'^api/safe/commentfeed/$', require_GET(utils.api_view(api.commentfeed))),
+    url(r'^api/safe/attendees/$', require_GET(utils.api_view(api.attendees, stream=True, readonly=True))),
+    url(r'^api/safe/attendee_info/$', require_GET(utils.api_view(api.attendee_info, readonly=True))),
+    url(r'^api/safe/article_get/$', require_GET(utils.api_view(api.article_get, readonly=True))),
+    url(r'^api/safe/article_get_comments/$', require_GET(utils.api_view(api.article_get_comments, readonly=True))),
+    url(r'^api/safe/article_get_comment_votes/$', require_GET(utils.api_view(api.article_get_comment_votes, readonly=True))),
+    url(r'^api/safe/comment_get/$', require_GET(utils.api_view(api.comment_get, readonly=True))),
+    url(r'^api/safe/carousel_get/$', require_GET(utils.api_view(api.carousel_get, readonly=True))),
+    url(r'^api/safe/forumlinks/$', require_GET(utils.api_view(api.forumlinks, readonly=True))),
+    url(r'^api/safe/commentfeed/$', require_GET(utils.api_view(api.commentfeed, readonly=True))),
     url(r'^api/article_new/$', require_POST(utils.api_view(api.article_new))),
     url(r'^api/article_edit/$', require_POST(utils.api_view(api.article_edit))),
     url(r'^api/article_delete/$', require_POST(utils.api_view(api.article_delete))),
@@ -69,6 +69,7 @@ urlpatterns = patterns('',
     url(r'^api/logout/$', require_POST(utils.api_view(api.logout))),
     url(r'^i18n/', include('django.conf.urls.i18n')),
     url(r'^rosetta/', include('rosetta.urls')),
+    url(r'^admin/queues/$', site_admin.site.admin_view(admin.view_queues)),
     url(r'^admin/', include(site_admin.site.urls)),    
 )
 
@@ -7,17 +7,29 @@ r"""
 
 """
 
-import json
+import math
 import time
+import base64
+import types
+import random
 import logging
+import itertools
+import threading
 import traceback
 from decimal import Decimal
 from functools import wraps
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 from django.conf import settings
 from django.db import transaction
 from django.http import HttpResponse
+from django.core.cache import cache
 from django.utils.timezone import utc
 from django.utils.translation import ungettext, ugettext
 
@@ -38,7 +50,7 @@ class APIException(Exception):
         return "<APIException: %s>" % (self)
 
 
-def api_view(function):
+def api_view(function, stream=False, readonly=False):
     """Decorator that turns a function into a Django JSON API view
 
     Your function must return a list of results which are expressed as
@@ -51,28 +63,57 @@ def api_view(function):
     API functions that have side-effects should be wrapped in a
     ``require_POST`` decorator in your ``url.py`` file to ensure CSRF
     protection, otherwise they should be wrapped in ``require_GET``.
+
+    If ``readonly`` is true the function promises not to write to the
+    database, so we don't bother committing or rolling back its
+    transaction.  Use it for the ``require_GET`` stuff.
+
+    If ``stream`` is true and your function is a generator, results
+    are sent to the client as they're yielded instead of being
+    buffered, see :py:func:`_stream`.  Only do this for read-only
+    functions because the transaction is over by the time the rest of
+    the generator runs.
+
+    How long each function takes is tracked by :py:func:`api_stats`.
     """
+    def finish(success):
+        if readonly:
+            return
+        if success:
+            transaction.commit()
+        else:
+            transaction.rollback()
+
     @wraps(function)
-    @transaction.commit_manually
     def _api_view(request):
+        start = time.time()
         args = {}
         args.update(request.REQUEST)
         args['request'] = request
         args['user'] = request.user
         try:
-            data = list(function(**args))
+            result = function(**args)
+            if stream and isinstance(result, types.GeneratorType):
+                # run up to the first result so argument errors and
+                # empty results get reported the usual way
+                data = list(itertools.islice(result, 1))
+                if data:
+                    finish(True)
+                    _record_api(function, readonly, start)
+                    return _streaming_response(request, data[0], result)
+            data = list(result)
         except APIException, exc:
             res = {'status': 'ERROR',
                    'message': str(exc),
                    'results': list(getattr(exc, 'results', None))}
-            transaction.rollback()
+            finish(False)
         except Exception, exc:
             traceback.print_exc()
             logger.exception('api request failed')
             res = {'status': 'ERROR',
                    'message': 'system malfunction',
                    'results': []}
-            transaction.rollback()
+            finish(False)
             if getattr(settings, 'TEST_MODE', False):
                 raise
         else:
@@ -80,49 +121,191 @@ def api_view(function):
                 res = {'status': 'OK',
                        'message': 'success',
                        'results': data}
+                if getattr(result, 'cursor', None):
+                    res['cursor'] = result.cursor
             else:
                 res = {'status': 'ZERO_RESULTS',
                        'message': 'no data returned',
                        'results': data}
-            transaction.commit()
-        logger.info("api %s returning %s: %s" %
-                    (request.path, res['status'], res['message']))
+            finish(True)
+        ms = _record_api(function, readonly, start)
+        logger.info("api %s returning %s: %s (%dms)" %
+                    (request.path, res['status'], res['message'], ms))
         return _as_json(res)
-    return _api_view
+
+    if readonly:
+        return _api_view
+    return transaction.commit_manually(_api_view)
+
+
+_api_stats = {}
+
+
+def _record_api(function, readonly, start):
+    ms = int((time.time() - start) * 1000)
+    stats = _api_stats.setdefault(function.__name__, {
+        'calls': 0, 'ms_total': 0, 'readonly': readonly})
+    stats['calls'] += 1
+    stats['ms_total'] += ms
+    return ms
+
+
+def api_stats():
+    """Returns timing of each api function in this process
+
+    Maps function names to dicts with ``calls``, ``ms_total``,
+    ``ms_avg`` and whether it ran in ``readonly`` mode.
+    """
+    res = {}
+    for name, stats in _api_stats.items():
+        res[name] = dict(stats)
+        res[name]['ms_avg'] = stats['ms_total'] / (stats['calls'] or 1)
+    return res
+
+
+class Page(list):
+    """API results along with a cursor for fetching the next page
+
+    ``api_view`` puts the cursor in the response next to ``results``.
+    """
+    def __init__(self, items, cursor=None):
+        list.__init__(self, items)
+        self.cursor = cursor
+
+
+_epoch = datetime(1970, 1, 1, tzinfo=utc)
+
+
+def make_cursor(when, id):
+    """Encodes position in a list sorted by ``(when, id)``
+
+    The result is an opaque string clients hand back to us to get the
+    stuff after it.  This lets us seek with an index rather than
+    using ``OFFSET`` which gets slower the further you scroll.
+    """
+    delta = when - _epoch
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6
+    micros += delta.microseconds
+    return base64.urlsafe_b64encode('%d:%d' % (micros, id))
+
+
+def parse_cursor(cursor):
+    """Decodes :py:func:`make_cursor` into ``(when, id)``"""
+    try:
+        micros, id = base64.urlsafe_b64decode(str(cursor)).split(':')
+        return _epoch + timedelta(microseconds=int(micros)), int(id)
+    except (TypeError, ValueError):
+        raise APIException(ugettext("bad cursor"))
+
+
+def _streaming_response(request, first, rest):
+    response = HttpResponse(_stream(request, first, rest),
+                            mimetype="application/json")
+    return response
+
+
+def _stream(request, first, rest, batch=50):
+    """Yields JSON envelope while consuming a generator of results
+
+    The status goes at the end because we don't know it until we're
+    done.  If the generator blows up partway through, the results so
+    far are followed by an error status, so the client still gets
+    valid JSON.
+    """
+    status, message = 'OK', 'success'
+    yield '{"results": [' + _encoder.encode(first)
+    chunk = []
+    try:
+        for item in rest:
+            chunk.append(_encoder.encode(item))
+            if len(chunk) >= batch:
+                yield ', ' + ', '.join(chunk)
+                chunk = []
+    except APIException, exc:
+        status, message = 'ERROR', str(exc)
+    except Exception, exc:
+        logger.exception('api stream failed')
+        status, message = 'ERROR', 'system malfunction'
+        if getattr(settings, 'TEST_MODE', False):
+            raise
+    if chunk:
+        yield ', ' + ', '.join(chunk)
+    logger.info("api %s streamed %s: %s" % (request.path, status, message))
+    yield '], "status": %s, "message": %s}' % (
+        _encoder.encode(status), _encoder.encode(message))
+
+
+STREAM_MIN = 500  # stream responses with at least this many results
 
 
 def _as_json(data):
     """Turns API result into JSON data"""
-    data['results'] = sanitize_json(data['results'])
     if settings.DEBUG:
-        content = json.dumps(data, indent=2) + '\n'
+        content = jsonify(data, indent=2) + '\n'
+    elif len(data['results']) >= STREAM_MIN:
+        content = iterjson(data)
     else:
-        content = json.dumps(data)
+        content = _encoder.encode(data)
     response = HttpResponse(content, mimetype="application/json")
     return response
 
 
-def jsonify(value, **argv):
-    return json.dumps(sanitize_json(value), **argv)
-
+def _encode_default(value):
+    """Called by the JSON encoder on stuff it doesn't understand
 
-def sanitize_json(value):
+    Encoders are looked up by type in ``ENCODERS``.  If it isn't there
+    we figure out what to do, which is slower, and remember it for
+    next time.
+    """
+    try:
+        return ENCODERS[type(value)](value)
+    except KeyError:
+        pass
     if hasattr(value, 'as_dict'):
-        return sanitize_json(value.as_dict())
+        encode = _encode_as_dict
     elif hasattr(value, 'timetuple'):
-        return jstime(value)
+        encode = jstime
     elif isinstance(value, Decimal):
-        return str(value)
-    elif isinstance(value, basestring):
-        return value
-    elif isinstance(value, dict):
-        for k in value:
-            value[k] = sanitize_json(value[k])
-        return value
+        encode = str
     elif hasattr(value, '__iter__'):
-        return [sanitize_json(i) for i in value]
+        encode = list
     else:
-        return value
+        raise TypeError('%r is not JSON serializable' % (value,))
+    ENCODERS[type(value)] = encode
+    return encode(value)
+
+
+def _encode_as_dict(value):
+    return value.as_dict()
+
+
+def jsonify(value, **argv):
+    """Turns value into JSON in a single pass
+
+    Model objects are encoded with their ``as_dict()`` method and
+    dates become javascript timestamps.  This uses the C speedups of
+    ``simplejson`` or the standard ``json`` module unless you pass
+    ``indent``.
+    """
+    if argv:
+        return json.dumps(value, **dict(_json_args, **argv))
+    return _encoder.encode(value)
+
+
+def iterjson(data, key='results', batch=100):
+    """Yields JSON of dict in pieces so big lists can be streamed
+
+    Each item of ``data[key]`` is encoded on its own, ``batch`` at a
+    time, so we never build the whole response in memory.
+    """
+    head = dict(data)
+    items = head.pop(key)
+    res = _encoder.encode(head)[:-1]
+    yield res + (', ' if head else '') + _encoder.encode(key) + ': ['
+    for n in xrange(0, len(items), batch):
+        yield (', ' if n else '') + ', '.join(
+            _encoder.encode(item) for item in items[n:n + batch])
+    yield ']}'
 
 
 def timesince(d, now_=None):
@@ -166,6 +349,216 @@ def jstime(dt):
     return ts
 
 
+ENCODERS = {datetime: jstime,
+            date: jstime,
+            Decimal: str}
+_json_args = {'default': _encode_default}
+if json.__name__ == 'simplejson':
+    _json_args['use_decimal'] = False  # keep sending them as strings
+_encoder = json.JSONEncoder(**_json_args)
+
+
 def now():
     """Returns current timestamp in a non-naive way"""
     return datetime.utcnow().replace(tzinfo=utc)
+
+
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def get_version(name):
+    """Returns value of a version counter stored in memcached
+
+    Version counters let us invalidate a whole family of cache entries
+    in one go by making them part of the key.  If memcached forgets
+    the counter, we start it at the current time in milliseconds so we
+    don't end up serving entries that were keyed on an old value.
+    """
+    key = 'version:' + name
+    res = cache.get(key)
+    if res is None:
+        res = int(time.time() * 1000)
+        if not cache.add(key, res, VERSION_TIMEOUT):
+            res = cache.get(key) or res
+    return res
+
+
+def get_versions(names):
+    """Returns dict of many version counters in one round trip"""
+    keys = dict(('version:' + name, name) for name in names)
+    found = cache.get_many(keys.keys())
+    res = dict((keys[key], val) for key, val in found.items())
+    for name in set(names) - set(res):
+        res[name] = get_version(name)
+    return res
+
+
+def bump_version(name):
+    """Increments a version counter, invalidating stuff keyed on it"""
+    key = 'version:' + name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        res = int(time.time() * 1000)
+        cache.set(key, res, VERSION_TIMEOUT)
+        return res
+
+
+LOCK_TIMEOUT = 10
+CACHED_FORMAT = 1  # bump if what cached() stores changes shape
+_cache_stats = dict.fromkeys(['hit', 'miss', 'refresh', 'stale',
+                              'coalesced'], 0)
+
+
+def cached(key, compute, timeout, grace=None, early=False, fresh=None,
+           wait=2.0):
+    """Returns cached result of ``compute()`` without stampeding
+
+    The usual get/miss/compute/set dance means every worker recomputes
+    a hot key at the same moment when it expires.  Instead we keep
+    entries in memcached for ``grace`` seconds (default ``timeout``)
+    past their expiry.  When an entry goes stale, whoever grabs the
+    lock key recomputes it while everyone else keeps serving the
+    stale value.  If there's no value at all, other workers wait up to
+    ``wait`` seconds for the lock holder to fill it in.
+
+    If ``early`` is true, entries may be refreshed shortly before they
+    expire, with a probability that grows as expiry approaches and
+    with how long ``compute()`` took last time.  This way the lock is
+    rarely contended at all.
+
+    ``fresh`` is an optional function that can declare a cached value
+    stale before its time, e.g. because it depends on version
+    counters that have changed.
+
+    Exceptions from ``compute()`` propagate and nothing is cached.
+
+    Entries live under ``key`` with a prefix, so they don't collide
+    with anything stored under it by plain ``cache.set()``.  Use
+    :py:func:`uncache` to get rid of them.
+    """
+    key = _cached_key(key)
+    lock = key + ':lock'
+    entry = _entry(cache.get(key))
+    if entry is not None:
+        value, expires, cost = entry
+        now_ = time.time()
+        stale = now_ >= expires or (fresh is not None and not fresh(value))
+        if not stale and not (early and now_ - cost *
+                              math.log(1 - random.random()) >= expires):
+            _cache_stats['hit'] += 1
+            return value
+        if not cache.add(lock, 1, LOCK_TIMEOUT):
+            _cache_stats['stale' if stale else 'hit'] += 1
+            return value
+        _cache_stats['refresh'] += 1
+    elif cache.add(lock, 1, LOCK_TIMEOUT):
+        _cache_stats['miss'] += 1
+    else:
+        deadline = time.time() + wait
+        while cache.get(lock) is not None and time.time() < deadline:
+            time.sleep(0.05)
+        entry = _entry(cache.get(key))
+        if entry is not None:
+            _cache_stats['coalesced'] += 1
+            return entry[0]
+        _cache_stats['miss'] += 1
+        return _fill(key, compute, timeout, grace)
+    try:
+        return _fill(key, compute, timeout, grace)
+    finally:
+        cache.delete(lock)
+
+
+def _cached_key(key):
+    return 'cached%d:%s' % (CACHED_FORMAT, key)
+
+
+def _entry(entry):
+    """Returns ``(value, expires, cost)`` or ``None`` if it's garbage"""
+    if isinstance(entry, tuple) and len(entry) == 3:
+        return entry
+    return None
+
+
+def uncache(*keys):
+    """Forgets values stored by :py:func:`cached`"""
+    cache.delete_many([_cached_key(key) for key in keys])
+
+
+def _fill(key, compute, timeout, grace):
+    start = time.time()
+    value = compute()
+    cost = time.time() - start
+    if grace is None:
+        grace = timeout
+    cache.set(key, (value, time.time() + timeout, cost), timeout + grace)
+    return value
+
+
+def cache_stats():
+    """Returns counters for :py:func:`cached` in this process
+
+    ``avoided`` is how many times we didn't recompute something
+    because another worker was already on it.
+    """
+    res = dict(_cache_stats)
+    res['avoided'] = res['stale'] + res['coalesced']
+    return res
+
+
+def cached_many(keys):
+    """Returns dict of unexpired :py:func:`cached` entries in one trip
+
+    Keys that are missing or stale aren't included, so the caller can
+    go through :py:func:`cached` for those.
+    """
+    now_ = time.time()
+    res = {}
+    entries = cache.get_many([_cached_key(key) for key in keys])
+    for key in keys:
+        entry = _entry(entries.get(_cached_key(key)))
+        if entry is not None and now_ < entry[1]:
+            res[key] = entry[0]
+    return res
+
+
+class LocalCache(object):
+    """Small LRU cache with expiry that lives in process memory
+
+    This sits in front of memcached for stuff we look up many times
+    per page, where even a memcached round trip adds up.  At most
+    ``size`` entries are kept and each is forgotten ``timeout``
+    seconds after it was set.  There's no cross-process invalidation,
+    so either keep ``timeout`` short or put a version counter in the
+    key.  It's thread safe.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.timeout)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -9,11 +9,11 @@ r"""
 
 import logging
 from hashlib import sha256
-from functools import wraps
 from datetime import datetime, timedelta
 
 from django.db.models import Q
 from django.conf import settings
+from django.utils.timezone import utc
 from django.forms import ValidationError
 from django.contrib.auth import views as authviews
 from django.core.cache import cache
@@ -25,7 +25,8 @@ from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.views.decorators.csrf import csrf_exempt
 
-from occupywallst import api, forms, models as db
+from occupywallst import (api, forms, utils, pagecache, commenttree,
+                          attendeemap, models as db)
 
 
 logger = logging.getLogger(__name__)
@@ -39,25 +40,8 @@ def error(request):
     assert False
 
 
-def my_cache(mkkey, seconds=60):
-    def _my_cache(function):
-        @wraps(function)
-        def __my_cache(request, *args, **kwargs):
-            if request.user.is_authenticated():
-                response = function(request, *args, **kwargs)
-            else:
-                key = sha256(mkkey(request, *args, **kwargs) + ':' +
-                             request.LANGUAGE_CODE).hexdigest()
-                response = cache.get(key)
-                if not response:
-                    response = function(request, *args, **kwargs)
-                    cache.set(key, response, seconds)
-            return response
-        return __my_cache
-    return _my_cache
-
-
-@my_cache(lambda r, per_page: 'index-%d' % (per_page))
+@pagecache.cache_page(lambda r, per_page: 'index-%d' % (per_page), ['index'],
+                      early=True)
 def index(request, per_page=10):
     articles = (db.Article.objects
                 .select_related("author")
@@ -108,8 +92,44 @@ def showtag(request, tag, page, per_page):
     }, context_instance=RequestContext(request))
 
 
+ARCHIVE_CLOSED_CACHE = 60 * 60 * 24 * 30
+
+
 def archive(request, is_forum, prefix, per_page,
             page=None, year=None, month=None, day=None):
+    """Lists articles by month and day
+
+    Pages for months that are over are crawled a lot by bots, so we
+    cache those for anonymous users until an article in that month
+    changes.  Older posts are found by seeking past the ``after``
+    cursor in the url rather than using an ``OFFSET``, but plain page
+    numbers still work for old links.
+    """
+    if not (year and month) or request.user.is_authenticated():
+        return _archive(request, is_forum, prefix, per_page,
+                        page, year, month, day)
+    try:
+        start = datetime(int(year), iMONTHS[month[:3].lower()], 1,
+                         tzinfo=utc)
+    except KeyError:
+        raise Http404()
+    end = (start + timedelta(days=32)).replace(day=1)
+    if end > utils.now() - timedelta(days=1):
+        return _archive(request, is_forum, prefix, per_page,
+                        page, year, month, day)
+    key = 'archive:%d:%s:%s' % (
+        db.ArchiveDay.month_version(start), request.LANGUAGE_CODE,
+        sha256(request.get_full_path()).hexdigest())
+
+    def render():
+        return _archive(request, is_forum, prefix, per_page,
+                        page, year, month, day)
+
+    return utils.cached(key, render, ARCHIVE_CLOSED_CACHE)
+
+
+def _archive(request, is_forum, prefix, per_page,
+             page=None, year=None, month=None, day=None):
     page = int(page) - 1 if page else 0
     year = int(year) if year else None
     month = iMONTHS[month[:3].lower()] if month else None
@@ -117,26 +137,49 @@ def archive(request, is_forum, prefix, per_page,
     qset = (db.Article.objects_as(request.user)
             .select_related("author", "author__userinfo")
             .filter(is_forum=is_forum)
-            .order_by('-published'))
+            .order_by('-published', '-id'))
+    days = db.ArchiveDay.days(is_forum)
     if year and month:
         filterday = datetime(year, month, day or 1)
-        qset = qset.filter(published__year=year, published__month=month)
+        start = datetime(year, month, day or 1, tzinfo=utc)
+        if day:
+            end = start + timedelta(days=1)
+        else:
+            end = (start + timedelta(days=32)).replace(day=1)
+        qset = qset.filter(published__gte=start, published__lt=end)
         smonth = MONTHS[month].capitalize()
-        drill = qset.dates('published', 'day')
+        drill = [datetime(d.year, d.month, d.day) for d in days
+                 if (d.year, d.month) == (year, month)]
         if day:
             mode = 'day'
-            qset = qset.filter(published__day=day)
             path = '%s%s-%d-%d/' % (prefix, smonth, day, year)
         else:
             mode = 'month'
             path = '%s%s-%d/' % (prefix, smonth, year)
     else:
         mode = 'all'
-        drill = qset.dates('published', 'month')
+        drill = sorted(set(datetime(d.year, d.month, 1) for d in days),
+                       reverse=True)
         filterday = None
         path = prefix
-    articles = qset[page * per_page:page * per_page + per_page]
+    after = request.GET.get('after')
+    if after:
+        try:
+            when, id = utils.parse_cursor(after)
+        except utils.APIException:
+            raise Http404()
+        qset = qset.filter(Q(published__lt=when) |
+                           Q(published=when, id__lt=id))
+        articles = list(qset[:per_page])
+    else:
+        articles = list(qset[page * per_page:page * per_page + per_page])
     fool = (len(articles) == per_page)  # 90% correct without count(*)
+    if fool:
+        next_path = '/%spage-%d/?after=%s' % (
+            path, page + 2, utils.make_cursor(articles[-1].published,
+                                              articles[-1].id))
+    else:
+        next_path = None
     return render_to_response('occupywallst/archive.html', {
         'articles': articles,
         'is_forum': is_forum,
@@ -146,24 +189,25 @@ def archive(request, is_forum, prefix, per_page,
         'filterday': filterday,
         'prev_path': '/%spage-%d/' % (path, page + 0) if page else None,
         'cano_path': '/%spage-%d/' % (path, page + 1),
-        'next_path': '/%spage-%d/' % (path, page + 2) if fool else None,
+        'next_path': next_path,
     }, context_instance=RequestContext(request))
 
 
-@my_cache(lambda r: 'forum')
+def _best_comments():
+    return list(db.Comment.objects
+                .select_related("article", "user", "user__userinfo")
+                .filter(is_removed=False, is_deleted=False)
+                .filter(published__gt=datetime.now() - timedelta(days=1))
+                .order_by('-karma')[:7])
+
+
+@pagecache.cache_page(lambda r: 'forum', ['forum'], early=True)
 def forum(request):
     per_page = 25
     articles = (db.Article.objects_as(request.user)
                 .select_related("author", "author__userinfo")
                 .order_by('-killed'))
-    bests = cache.get('forum:bests')
-    if not bests:
-        bests = (db.Comment.objects
-                 .select_related("article", "user", "user__userinfo")
-                 .filter(is_removed=False, is_deleted=False)
-                 .filter(published__gt=datetime.now() - timedelta(days=1))
-                 .order_by('-karma'))[:7]
-        cache.set('forum:bests', bests, 60 * 15)
+    bests = utils.cached('forum:bests', _best_comments, 60 * 15, early=True)
     recents = (db.Comment.objects_as(request.user)
                .select_related("article", "user", "user__userinfo")
                .order_by('-published'))[:20]
@@ -175,7 +219,7 @@ def forum(request):
         context_instance=RequestContext(request))
 
 
-@my_cache(lambda r: 'forum_comments')
+@pagecache.cache_page(lambda r: 'forum_comments', ['forum'])
 def forum_comments(request):
     per_page = 25
     comments = (db.Comment.objects_as(request.user)
@@ -199,26 +243,9 @@ def bonus(request, page):
     return HttpResponse(res)
 
 
-def _instate_hierarchy(comments):
-    """Rearranges list of comments into hierarchical structure
-
-    This adds the pseudo-field "replies" to each comment.
-    """
-    for com in comments:
-        com.replies = []
-    comhash = dict([(c.id, c) for c in comments])
-    res = []
-    for com in comments:
-        if com.parent_id is None:
-            res.append(com)
-        else:
-            if com.parent_id in comhash:
-                comhash[com.parent_id].replies.append(com)
-    return res
-
-
-@my_cache(lambda r, slug, forum=False:
-              ('artfrm:' if forum else 'artnwz:') + slug)
+@pagecache.cache_page(lambda r, slug, forum=False:
+                           ('artfrm:' if forum else 'artnwz:') + slug,
+                       ['recent'])
 def article(request, slug, forum=False):
     try:
         article = (db.Article.objects
@@ -228,13 +255,11 @@ def article(request, slug, forum=False):
             raise db.Article.DoesNotExist()
     except db.Article.DoesNotExist:
         raise Http404()
+    request.cache_tags.add('article:%d' % (article.id))
 
-    def get_comments():
-        comments = article.comments_as_user(
-            request.user, request.META['REMOTE_ADDR'])
-        comments = _instate_hierarchy(comments)
-        for comment in comments:
-            yield comment
+    comments = commenttree.render(article, request.user,
+                                  request.META['REMOTE_ADDR'],
+                                  request.LANGUAGE_CODE)
     recents = (db.Article.objects
                .select_related("author")
                .filter(is_visible=True, is_deleted=False)
@@ -243,7 +268,7 @@ def article(request, slug, forum=False):
         recents = recents.filter(is_forum=False)
     return render_to_response(
         "occupywallst/article.html", {'article': article,
-                                      'comments': get_comments(),
+                                      'comments': comments,
                                       'recents': recents[:25],
                                       'forum': forum},
         context_instance=RequestContext(request))
@@ -262,14 +287,7 @@ def user_page(request, username):
                 .get(username=username))
     except db.User.DoesNotExist:
         raise Http404()
-    if user.userinfo.position is not None:
-        nearby_users = (db.UserInfo.objects
-                        .select_related("user")
-                        .filter(position__isnull=False)
-                        .distance(user.userinfo.position)
-                        .order_by('distance'))[1:10]
-    else:
-        nearby_users = []
+    nearby_users = attendeemap.nearby(user.userinfo)
     if request.user.is_authenticated():
         messages = (db.Message.objects
                     .select_related("from_user", "from_user__userinfo",
@@ -0,0 +1,323 @@
+r"""
+
+    occupywallst.votes
+    ~~~~~~~~~~~~~~~~~~
+
+    Bookkeeping for comment votes.
+
+    Every page that shows comments needs to know which arrows the user
+    already clicked.  Rather than joining the ``CommentVote`` table on
+    each page view, we keep a little index in memcached for each
+    (user, article) pair which holds two sorted arrays of comment ids:
+    the ones they upvoted and the ones they downvoted.
+
+    :py:meth:`Comment.upvote` and :py:meth:`Comment.downvote` throw
+    the index away and the next lookup rebuilds it from the
+    ``CommentVote`` table, as it does when memcached forgets it.
+
+    This module also applies the votes to the ``ups``, ``downs`` and
+    ``karma`` counters on the comment.  By default that's a relative
+    ``UPDATE ... SET ups = ups + 1`` which Postgres does atomically.
+    Popular comments can get a lot of votes at once though, so if
+    ``OWS_VOTE_BUFFER`` is set we instead accumulate the deltas in a
+    redis hash and have ``occupywallst flushvotes`` write them out
+    every few seconds as one big ``UPDATE``.  If redis is down, votes
+    go straight to the database.
+
+"""
+
+import time
+import uuid
+import logging
+from array import array
+from datetime import timedelta
+from bisect import bisect_left
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.db import connection, transaction
+
+from occupywallst import models as db
+from occupywallst.utils import now
+
+
+logger = logging.getLogger(__name__)
+INDEX_TIMEOUT = 60 * 60 * 24
+BUFFER_KEY = 'ows:votebuf'
+FLUSHING_KEY = 'ows:votebuf:flushing'
+STATS_KEY = 'ows:votebuf:stats'
+LOCK_KEY = 'ows:votebuf:lock'
+LOCK_TIMEOUT = 60 * 5
+FLUSH_CHUNK = 500
+_redis = None
+
+
+def _key(user_id, article_id):
+    return 'votes:%d:%d' % (user_id, article_id)
+
+
+def _contains(ids, comid):
+    pos = bisect_left(ids, comid)
+    return pos < len(ids) and ids[pos] == comid
+
+
+def rebuild(user_id, article_ids):
+    """Recreates vote indexes from the database
+
+    Returns a dict mapping article ids to ``(ups, downs)`` tuples.
+    This is done in a single query no matter how many articles you
+    ask for.
+    """
+    res = dict((aid, (array('l'), array('l'))) for aid in article_ids)
+    if not res:
+        return res
+    rows = (db.CommentVote.objects
+            .filter(user__id=user_id, comment__article__in=res.keys())
+            .values_list('comment__article', 'comment', 'vote'))
+    for article_id, comid, vote in rows:
+        ups, downs = res[article_id]
+        if vote == 1:
+            ups.append(comid)
+        elif vote == -1:
+            downs.append(comid)
+    for ups, downs in res.values():
+        ups[:] = array('l', sorted(ups))
+        downs[:] = array('l', sorted(downs))
+    cache.set_many(dict((_key(user_id, aid), val)
+                        for aid, val in res.items()), INDEX_TIMEOUT)
+    return res
+
+
+def get_indexes(user_id, article_ids):
+    """Fetches vote indexes for many articles in one round trip"""
+    article_ids = set(article_ids)
+    keys = dict((_key(user_id, aid), aid) for aid in article_ids)
+    found = cache.get_many(keys.keys())
+    res = dict((keys[k], v) for k, v in found.items())
+    missing = article_ids - set(res)
+    if missing:
+        res.update(rebuild(user_id, missing))
+    return res
+
+
+def lookup(user, comments):
+    """Returns dict mapping comment ids to how user voted on them
+
+    ``comments`` may be any iterable of objects with ``id`` and
+    ``article_id`` attributes.  Comments the user didn't vote on
+    aren't included in the result.
+    """
+    res = {}
+    if not (user and user.id):
+        return res
+    comments = list(comments)
+    indexes = get_indexes(user.id, [c.article_id for c in comments])
+    for com in comments:
+        ups, downs = indexes[com.article_id]
+        if _contains(ups, com.id):
+            res[com.id] = 1
+        elif _contains(downs, com.id):
+            res[com.id] = -1
+    return res
+
+
+def lookup_article(user, article_id):
+    """Returns dict of all votes user cast on an article's comments"""
+    if not (user and user.id):
+        return {}
+    ups, downs = get_indexes(user.id, [article_id])[article_id]
+    res = dict((comid, -1) for comid in downs)
+    res.update((comid, 1) for comid in ups)
+    return res
+
+
+def record(user_id, article_id, comment_id, vote):
+    """Updates vote index after user votes on a comment
+
+    We just forget the index so the next lookup rebuilds it from the
+    database, which by then has this vote.  Editing it in place would
+    be a read-modify-write that loses one of two votes cast at once.
+    """
+    cache.delete(_key(user_id, article_id))
+
+
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis()
+    return _redis
+
+
+def tally(comment, dups, ddowns):
+    """Adds vote deltas to a comment's counters
+
+    The fields on ``comment`` are updated right away so the caller
+    sees the new karma even if the database write is buffered.
+    """
+    comment.ups += dups
+    comment.downs += ddowns
+    comment.karma = comment.ups - comment.downs
+    if settings.OWS_VOTE_BUFFER and _buffer(comment.id, dups, ddowns):
+        return
+    (db.Comment.objects
+     .filter(id=comment.id)
+     .update(ups=F('ups') + dups,
+             downs=F('downs') + ddowns,
+             karma=F('karma') + (dups - ddowns)))
+    from occupywallst import commenttree
+    commenttree.invalidate(comment.article_id)
+
+
+def _buffer(comid, dups, ddowns):
+    try:
+        pipe = _get_redis().pipeline()
+        pipe.hincrby(BUFFER_KEY, '%d:u' % (comid), dups)
+        pipe.hincrby(BUFFER_KEY, '%d:d' % (comid), ddowns)
+        pipe.hincrby(BUFFER_KEY, 'n', 1)
+        pipe.execute()
+    except redis.ConnectionError:
+        logger.warning('vote buffer unavailable, writing through')
+        return False
+    return True
+
+
+def _apply(deltas):
+    """Writes ``{comid: [ups, downs]}`` deltas with batched UPDATEs
+
+    Returns set of article ids whose comments were changed.
+    """
+    table = db.Comment._meta.db_table
+    articles = set()
+    items = [(comid, u, d) for comid, (u, d) in deltas.items()
+             if u or d]
+    cursor = connection.cursor()
+    for n in range(0, len(items), FLUSH_CHUNK):
+        chunk = items[n:n + FLUSH_CHUNK]
+        params = []
+        for row in chunk:
+            params.extend(row)
+        cursor.execute("""
+            UPDATE %s AS c
+               SET ups = c.ups + v.ups,
+                   downs = c.downs + v.downs,
+                   karma = c.karma + v.ups - v.downs
+              FROM (VALUES %s) AS v(id, ups, downs)
+             WHERE c.id = v.id
+         RETURNING c.article_id
+        """ % (table, ", ".join(["(%s, %s, %s)"] * len(chunk))), params)
+        articles.update(row[0] for row in cursor.fetchall())
+    transaction.set_dirty()
+    return articles
+
+
+def flush():
+    """Writes buffered votes to the database
+
+    The buffer is renamed before we read it so votes coming in while
+    we flush go into a fresh hash.  If the database write fails, the
+    renamed hash sticks around and gets retried on the next flush.
+    Each batch gets a random id which is recorded as a
+    :py:class:`VoteFlush` row in the same transaction as the votes, so
+    if we die before deleting the hash, the retry won't count the
+    votes twice.
+
+    Only one flush runs at a time, otherwise two flushers could both
+    apply the renamed hash.  If another one holds the lock we do
+    nothing.  The lock expires after ``LOCK_TIMEOUT`` seconds in case
+    its holder died.
+
+    Returns number of comments updated.
+    """
+    conn = _get_redis()
+    token = uuid.uuid4().hex
+    if not conn.set(LOCK_KEY, token, nx=True, ex=LOCK_TIMEOUT):
+        return 0
+    try:
+        return _flush(conn)
+    finally:
+        _unlock(conn, token)
+
+
+def _unlock(conn, token):
+    """Releases flush lock unless it expired and someone else took it"""
+    with conn.pipeline() as pipe:
+        try:
+            pipe.watch(LOCK_KEY)
+            if pipe.get(LOCK_KEY) != token:
+                pipe.unwatch()
+                return
+            pipe.multi()
+            pipe.delete(LOCK_KEY)
+            pipe.execute()
+        except redis.WatchError:
+            pass
+
+
+def _flush(conn):
+    if not conn.exists(FLUSHING_KEY):
+        try:
+            conn.rename(BUFFER_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            return 0  # nothing buffered
+        conn.hset(FLUSHING_KEY, 'batch', uuid.uuid4().hex)
+    start = time.time()
+    nvotes = 0
+    batch = None
+    deltas = {}
+    for field, val in conn.hgetall(FLUSHING_KEY).items():
+        if field == 'n':
+            nvotes = int(val)
+            continue
+        if field == 'batch':
+            batch = val
+            continue
+        comid, what = field.split(':')
+        delta = deltas.setdefault(int(comid), [0, 0])
+        delta[0 if what == 'u' else 1] += int(val)
+    if batch is None:
+        # we died between the rename and the hset, so it can't have
+        # been applied yet
+        batch = uuid.uuid4().hex
+    articles = set()
+    with transaction.commit_on_success():
+        if db.VoteFlush.objects.filter(batch=batch).exists():
+            logger.warning('vote batch %s was already applied', batch)
+            deltas = {}
+        else:
+            articles = _apply(deltas)
+            db.VoteFlush.objects.create(batch=batch)
+        cutoff = now() - timedelta(days=db.VoteFlush.KEEP_DAYS)
+        db.VoteFlush.objects.filter(created__lt=cutoff).delete()
+    conn.delete(FLUSHING_KEY)
+    from occupywallst import commenttree
+    for article_id in articles:
+        commenttree.invalidate(article_id)
+    millis = int((time.time() - start) * 1000)
+    pipe = conn.pipeline()
+    pipe.hincrby(STATS_KEY, 'flushes', 1)
+    pipe.hincrby(STATS_KEY, 'votes', nvotes)
+    pipe.hincrby(STATS_KEY, 'rows', len(deltas))
+    pipe.hincrby(STATS_KEY, 'flush_ms_total', millis)
+    pipe.hset(STATS_KEY, 'flush_ms_last', millis)
+    pipe.hset(STATS_KEY, 'flushed_at', int(time.time()))
+    pipe.execute()
+    return len(deltas)
+
+
+def buffer_stats():
+    """Returns metrics about the vote buffer
+
+    ``ratio`` is how many votes got coalesced into each row we wrote.
+    The higher the better.
+    """
+    conn = _get_redis()
+    stats = dict((k, int(v)) for k, v in conn.hgetall(STATS_KEY).items())
+    for key in ('flushes', 'votes', 'rows', 'flush_ms_total',
+                'flush_ms_last', 'flushed_at'):
+        stats.setdefault(key, 0)
+    stats['pending'] = int(conn.hget(BUFFER_KEY, 'n') or 0)
+    stats['ratio'] = float(stats['votes']) / (stats['rows'] or 1)
+    stats['flush_ms_avg'] = stats['flush_ms_total'] / (stats['flushes'] or 1)
+    return stats
@@ -1,9 +1,11 @@
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import Point, LineString
+from django.contrib.gis.geos import Point
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from occupywallst import geo
+from occupywallst import geo, polyline, pagecache
 from rideshare import settings
 
 
@@ -61,7 +63,8 @@ class Ride(models.Model):
     route = models.LineStringField(null=True, default=None, help_text="""
         The driving route coords Google gave us from waypoints.""")
     route_data = models.TextField(blank=True, help_text="""
-        Google's goofy compressed version of route coords.""")
+        Google's goofy compressed version of route coords.  This is
+        what rides_get sends to browsers.""")
     info = models.TextField(blank=True, help_text="""
         A little bit about yourself, the ride, and what to expect""")
     #forum_post = models.ForeignKey(ForumPost, null=True, blank=True)
@@ -93,12 +96,22 @@ class Ride(models.Model):
             waypoints[0], waypoints[-1], self.depart_time.date())
 
     def retrieve_route_from_google(self):
-        route = geo.directions(self.waypoint_list)
-        points = []
-        for waypoint in route:
-            flip_me = waypoint['overview_polyline']['points']
-            points += [(x, y) for y, x in flip_me]
-        self.route = LineString(points)
+        routes = geo.directions(self.waypoint_list)
+        encoded = [r['overview_polyline']['points'] for r in routes]
+        coords, offsets = polyline.decode_many(encoded)
+        self.route = polyline.linestring(coords)
+        if len(encoded) == 1:
+            self.route_data = encoded[0]
+        else:
+            self.route_data = polyline.encode(coords)
+
+    @property
+    def route_polyline(self):
+        """Returns route as an encoded polyline, which is what we send
+        browsers"""
+        if not self.route_data and self.route is not None:
+            return polyline.encode_linestring(self.route)
+        return self.route_data
 
     @property
     def waypoint_list(self):
@@ -191,3 +204,11 @@ class RideRequest(models.Model):
             return cls.objects.get(ride=ride, user=user)
         except ObjectDoesNotExist:
             return None
+
+
+@receiver(post_save, sender=Ride)
+@receiver(post_delete, sender=Ride)
+@receiver(post_save, sender=RideRequest)
+@receiver(post_delete, sender=RideRequest)
+def _rides_changed(sender, **kwargs):
+    pagecache.purge('rides')
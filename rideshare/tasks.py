@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+
+from occupywallst import jobs, pagecache, models as maindb
+from rideshare import models as db
+
+
+@jobs.task
+def route_ride(ride_id, waypoints):
+    """Asks Google for the driving route of a ride and stores it
+
+    ``waypoints`` is what the ride said when the job was submitted.
+    The job may run before that request commits, in which case we'd
+    see the old row (or none at all), so we fail and get retried until
+    the row matches.  If it was edited again, the job for the newer
+    waypoints does the work and this one runs out of retries.
+    """
+    ride = db.Ride.objects.get(id=ride_id)
+    if ride.waypoints != waypoints:
+        raise LookupError('ride %d has different waypoints' % (ride_id))
+    ride.retrieve_route_from_google()
+    if not (db.Ride.objects
+            .filter(id=ride.id, waypoints=waypoints)
+            .update(route=ride.route, route_data=ride.route_data)):
+        raise LookupError('ride %d changed while routing' % (ride_id))
+    pagecache.purge('rides')
+
+
+@jobs.task
+def notify(user_ids, url, message):
+    """Sends the same notification to a bunch of users"""
+    for user in User.objects.filter(id__in=user_ids):
+        maindb.Notification.send(user, url, message)
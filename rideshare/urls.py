@@ -18,7 +18,7 @@ urlpatterns = patterns('rideshare',
     url(r'^(?P<ride_id>\d+)/request/add/$', 'views.ride_request_add_update', name='ride_request_add_update'),
     url(r'^(?P<ride_id>\d+)/request/delete/$', 'views.ride_request_delete', name="ride_request_delete"),
     #ride ajax
-    url(r'^api/safe/rides/$', require_GET(utils.api_view(views.rides_get))),
+    url(r'^api/safe/rides/$', require_GET(utils.api_view(views.rides_get, stream=True, readonly=True))),
     url(r'^api/ride_request_update/$', require_POST(utils.api_view(views.ride_request_update)), name="ride_request_update"),
     #url(r'^api/ride_edit_rendezvous/$', require_POST(utils.api_view(views.ride_edit_rendezvous)), name="ride_edit_rendezvous"),  
 )
@@ -1,8 +1,6 @@
-from hashlib import sha256
-from functools import wraps
+from itertools import chain
 
 from django.conf import settings
-from django.core.cache import cache
 from django.forms import ValidationError
 from django.template import RequestContext
 from django.contrib.gis.geos import Polygon
@@ -12,29 +10,11 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 
-from rideshare import forms, models as db
-from occupywallst import api, utils, models as maindb
+from rideshare import forms, tasks, models as db
+from occupywallst import api, jobs, utils, pagecache, models as maindb
 
 
-def my_cache(mkkey, seconds=60):
-    def _my_cache(function):
-        @wraps(function)
-        def __my_cache(request, *args, **kwargs):
-            if request.user.is_authenticated():
-                response = function(request, *args, **kwargs)
-            else:
-                key = sha256(mkkey(request, *args, **kwargs) + ':' +
-                             request.LANGUAGE_CODE).hexdigest()
-                response = cache.get(key)
-                if not response:
-                    response = function(request, *args, **kwargs)
-                    cache.set(key, response, seconds)
-            return response
-        return __my_cache
-    return _my_cache
-
-
-@my_cache(lambda r: 'rides')
+@pagecache.cache_page(lambda r: 'rides', ['rides'])
 def rides(request):
     rides = db.Ride.objects.all()
     user_ride_request = None
@@ -69,10 +49,9 @@ def ride_delete(request, ride_id):
     ride = db.Ride.objects.select_related('requests').get(
         user=request.user, pk=int(ride_id))
     requests = ride.requests.all()
-    for req in requests:
-        maindb.Notification.send(
-            req.user, reverse('rides'),
-            '%s has deleted there ride' % (ride.user.username))
+    jobs.submit(tasks.notify, list(requests.values_list('user', flat=True)),
+                reverse('rides'),
+                '%s has deleted there ride' % (ride.user.username))
     requests.delete()
     ride.delete()
     return HttpResponseRedirect(reverse(rides))
@@ -96,12 +75,10 @@ def ride_create_or_update(request, instance=None):
         if form.is_valid():
             ride = form.save(commit=False)
             try:
-                # this should maybe go into some work queue instead of
-                # being run sync
                 ride.user = request.user
-                ride.retrieve_route_from_google()
                 #ride.full_clean()
                 ride.save()
+                jobs.submit(tasks.route_ride, ride.id, ride.waypoints)
                 return HttpResponseRedirect(ride.get_absolute_url())
             except ValidationError:
                  #stupid hack
@@ -170,7 +147,7 @@ def ride_request_add_update(request, ride_id):
         msg = '%s has request a seat on your ride' % (
             ride_request.user.username)
         url = ride_request.ride.get_absolute_url()
-        maindb.Notification.send(ride.user, url, msg)
+        jobs.submit(tasks.notify, [ride.user_id], url, msg)
     if request.is_ajax():
         return HttpResponse("{test:tes}", mimetype="application/json")
     else:
@@ -186,7 +163,7 @@ def ride_request_delete(request, ride_id):
         msg = '%s has canceled their ride request' % (
             ride_request.user.username)
         url = ride_request.ride.get_absolute_url()
-        maindb.Notification.send(ride_request.ride.user, url, msg)
+        jobs.submit(tasks.notify, [ride_request.ride.user_id], url, msg)
     return HttpResponseRedirect(reverse(rides))
 
 
@@ -196,7 +173,14 @@ def _str_to_bbox(val):
 
 
 def rides_get(bounds=None, **kwargs):
-    """Find all rides within visible map area"""
+    """Find all rides within visible map area
+
+    Routes are sent as encoded polylines (see
+    :py:mod:`occupywallst.polyline`) which are much smaller than
+    lists of coordinates.  We only load the ``route`` LineString for
+    the odd ride that doesn't have one encoded, which migration 0002
+    should have taken care of.
+    """
     if bounds:
         bbox = _str_to_bbox(bounds)
         qset = (db.Ride.objects
@@ -205,11 +189,14 @@ def rides_get(bounds=None, **kwargs):
     else:
         qset = (db.Ride.objects
                 .filter(route__isnull=False))
-    for ride in qset:
+    qset = qset.defer('waypoints_points')
+    rides = chain(qset.exclude(route_data='').defer('route').iterator(),
+                  qset.filter(route_data='').iterator())
+    for ride in rides:
         yield {'id': ride.id,
                'title': ride.title,
                'address': ride.waypoint_list[0],
-               'route': ride.route}
+               'polyline': ride.route_polyline}
 
 def ride_request_update(request_id, status, user=None, **kwargs):
     ride_request = (db.RideRequest.objects
@@ -224,9 +211,9 @@ def ride_request_update(request_id, status, user=None, **kwargs):
         req.save()
         # msg = '%s %s your ride request' % (req.ride.user.username, status)
         # message_send(req.ride.user, req.user, msg)
-        maindb.Notification.send(
-            req.user, req.ride.get_absolute_url(),
-            '%s %s your ride request' % (req.ride.user.username, status))
+        jobs.submit(tasks.notify, [req.user_id], req.ride.get_absolute_url(),
+                    '%s %s your ride request' % (req.ride.user.username,
+                                                 status))
         return [{"id": req.id, "status": req.status}]
     else:
         raise utils.APIException(_("insufficient permissions"))